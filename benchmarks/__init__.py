@@ -0,0 +1,4 @@
+"""
+Benchmarks for crypto_backtesting on seeded synthetic data, run them with python -m benchmarks (see
+run_benchmarks.py for the options).
+"""
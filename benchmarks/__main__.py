@@ -0,0 +1,5 @@
+import sys
+
+from benchmarks.run_benchmarks import main
+
+sys.exit(main())
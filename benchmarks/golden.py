@@ -0,0 +1,405 @@
+"""
+Golden output harness: snapshots what the reference engine of the backtesters returns for a fixed grid of
+parameters on a fixed synthetic dataset, and checks other engines against that snapshot run by run, with the
+largest differences and the speedup of every run, so a faster engine doesn't have to be trusted blindly.
+
+The reference is the original pandas loop, frozen in benchmarks/reference_backtesters.py. Outputs it doesn't
+have (the risk metrics and the abort flags, see LATER_OUTPUTS) are taken from the current pandas engine.
+
+    python -m benchmarks.golden snapshot --output benchmarks/golden_outputs.json
+    python -m benchmarks.golden check --engine array --engine ma_cache
+    python -m benchmarks.golden loader
+
+check exits with 1 when a run of any engine differs from the snapshot by more than the tolerances. loader
+checks that get_bitcoin_data() gives the same rows for a subset of the years as loading every year and
+filtering, on synthetic price files with gaps at the edges of the years, and exits with 1 when they differ.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import crypto_backtesting as cb
+from benchmarks import reference_backtesters
+from benchmarks.run_benchmarks import benchmark_environment
+from benchmarks.synthetic_data import synthetic_backtest_data, write_bitcoin_data_directory
+
+GOLDEN_OUTPUTS_PATH = "benchmarks/golden_outputs.json"
+
+# bumped whenever the grid or the layout of the snapshot changes
+GOLDEN_FORMAT_VERSION = 2
+
+# a year of hourly bars, the pandas reference engine takes a few seconds per run on it
+GOLDEN_BARS = 8760
+
+# starting in October every run crosses into a new year after its first quarter, so the annual taxes of the
+# runs that gained by then are compared too
+GOLDEN_START = "2019-10-01"
+
+# (ma1_length, ma2_length), from a few hours to a month
+GOLDEN_SMA_PARAMETERS = [(5, 20), (7, 42), (10, 50), (20, 100), (24, 168), (50, 200), (100, 400), (168, 720)]
+
+# (ma_length, buy_threshold, take_profit, stop_loss)
+GOLDEN_MEAN_REVERSION_PARAMETERS = [(12, 0.005, 0.01, 0.01), (24, 0.01, 0.01, 0.05), (48, 0.03, 0.05, 0.02),
+                                    (100, 0.02, 0.02, 0.05), (168, 0.05, 0.03, 0.1), (500, 0.1, 0.1, 0.1)]
+
+# (shorting_allowed, fixed_fee, annual_taxes), every flag is on in half of them
+GOLDEN_MODES = [(False, True, True), (True, True, False), (False, False, False), (True, False, True)]
+
+# outputs that are not compared, they only describe how the results were displayed
+IGNORED_OUTPUTS = ["balance_data"]
+
+# outputs the original backtesters don't have (sharpe_ratio was always None), a snapshot of the "original"
+# engine takes them from LATER_OUTPUTS_ENGINE
+LATER_OUTPUTS = cb.RISK_METRICS + ["aborted", "abort_bar", "abort_reason"]
+LATER_OUTPUTS_ENGINE = "pandas"
+
+# year subsets the loader check requests: every year on its own, neighbours, and years far apart
+LOADER_YEAR_SUBSETS = [[year] for year in range(2014, 2024)] + [[2015, 2016], [2017, 2019], [2018, 2019, 2020],
+                                                                 [2014, 2023]]
+
+# minute files with a few weeks per year and an hourly file starting mid-year leave gaps at the edges of years
+LOADER_MINUTE_DAYS = 20
+LOADER_HOURLY_START = "2018-03-01"
+
+
+def golden_runs():
+    """
+    The grid of the snapshot as a list of (strategy, settings) pairs, settings are keyword arguments of the
+    backtester.
+    """
+    runs = []
+    for shorting_allowed, fixed_fee, annual_taxes in GOLDEN_MODES:
+        common = {"order_sizing": 1, "starting_capital": 10000, "shorting_allowed": shorting_allowed,
+                  "fixed_fee": fixed_fee, "annual_taxes": annual_taxes, "tax_percentage": 0.3, "fee": 0.001}
+        for ma1_length, ma2_length in GOLDEN_SMA_PARAMETERS:
+            runs.append(("simple moving average crossover", dict(common, ma1_length=ma1_length, ma2_length=ma2_length)))
+        for ma_length, buy_threshold, take_profit, stop_loss in GOLDEN_MEAN_REVERSION_PARAMETERS:
+            runs.append(("mean reversion", dict(common, ma_length=ma_length, buy_threshold=buy_threshold,
+                                                take_profit=take_profit, stop_loss=stop_loss)))
+
+    return runs
+
+
+def run_engine(engine, strategy, crypto_df, settings, ma_cache=None):
+    """
+    Run one backtest on an engine.
+
+    Engines:
+        "original": the backtesters as they were before any optimization (see reference_backtesters), the
+            reference the snapshot is taken from
+        "pandas": the current pandas implementation, walking the dataframe bar by bar
+        "array": the numpy array engine
+        "ma_cache": the array engine with its moving averages from a MovingAverageCache (pass ma_cache to
+            share it between runs)
+        a function called as engine(strategy, crypto_df, settings) that returns backtest_results
+    """
+    if callable(engine):
+        return engine(strategy, crypto_df, settings)
+    if engine not in ["original", "pandas", "array", "ma_cache"]:
+        raise Exception("Error:", engine, "is not a valid engine, please select 'original', 'pandas', 'array' or 'ma_cache'.")
+
+    if engine == "original":
+        arguments = dict(settings, sampled_data=crypto_df, display_results=False, record_balance=False,
+                         show_moving_averages=False)
+        if strategy == "simple moving average crossover":
+            backtest_results = reference_backtesters.sma_crossover_backtester(**arguments)
+        else:
+            backtest_results = reference_backtesters.mean_reversion_backtester(**arguments)
+        if isinstance(backtest_results, str):
+            raise Exception(backtest_results)
+        return backtest_results
+
+    arguments = dict(settings, sampled_data=crypto_df, display_results=False, record_balance=False,
+                     engine="pandas" if engine == "pandas" else "array")
+    if engine == "ma_cache":
+        arguments['ma_cache'] = ma_cache if ma_cache is not None else cb.MovingAverageCache(crypto_df['price'].to_numpy(dtype=np.float64))
+    if strategy == "simple moving average crossover":
+        backtest_results = cb.sma_crossover_backtester(show_moving_averages=False, **arguments)
+    else:
+        backtest_results = cb.mean_reversion_backtester(show_moving_averages=False, **arguments)
+    if isinstance(backtest_results, str):
+        raise Exception(backtest_results)
+
+    return backtest_results
+
+
+def to_json_value(value):
+    """
+    Backtest output as plain JSON values (numpy scalars become python numbers, timestamps strings).
+    """
+    if isinstance(value, dict):
+        return {key: to_json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [to_json_value(item) for item in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value)
+    if value is None or isinstance(value, str):
+        return value
+
+    return str(value)
+
+
+def snapshot_outputs(backtest_results):
+    """
+    The outputs of a backtest that are compared, as JSON values.
+    """
+    return {key: to_json_value(value) for key, value in backtest_results.items() if key not in IGNORED_OUTPUTS}
+
+
+def run_label(strategy, settings):
+    """
+    Short description of a run of the grid, like "sma 5/20 short volume_fee taxes".
+    """
+    if strategy == "simple moving average crossover":
+        label = "sma {}/{}".format(settings['ma1_length'], settings['ma2_length'])
+    else:
+        label = "mr {} {}/{}/{}".format(settings['ma_length'], settings['buy_threshold'], settings['take_profit'],
+                                        settings['stop_loss'])
+
+    return " ".join([label, "short" if settings['shorting_allowed'] else "long",
+                     "fixed_fee" if settings['fixed_fee'] else "volume_fee",
+                     "taxes" if settings['annual_taxes'] else "no_taxes"])
+
+
+def golden_dataset(bars, seed, start=GOLDEN_START):
+    crypto_df = synthetic_backtest_data(bars, start=start, seed=seed)
+    fingerprint = cb.dataset_fingerprint(*cb.extract_backtest_arrays(crypto_df))
+
+    return crypto_df, fingerprint
+
+
+def write_golden_outputs(output_path=GOLDEN_OUTPUTS_PATH, bars=GOLDEN_BARS, seed=0, engine="original",
+                         start=GOLDEN_START, verbose=True):
+    """
+    Run the grid of golden_runs() on the reference engine and save the outputs.
+
+    Arguments:
+        output_path: JSON file to write, default = GOLDEN_OUTPUTS_PATH
+        bars: hourly bars of the synthetic dataset, default = GOLDEN_BARS
+        seed: seed of the synthetic dataset, default = 0
+        engine: reference engine (see run_engine()), default = "original" (which takes the LATER_OUTPUTS
+            from LATER_OUTPUTS_ENGINE)
+        start: timestamp of the first bar of the synthetic dataset, default = GOLDEN_START
+    Returns:
+        snapshot: the dictionary that was written
+    """
+    crypto_df, fingerprint = golden_dataset(bars, seed, start)
+    if crypto_df['timestamp'].dt.year.nunique() < 2:
+        raise Exception("The synthetic dataset doesn't cross into a new year, the annual taxes wouldn't be compared.")
+
+    runs = []
+    for strategy, settings in golden_runs():
+        start_time = time.perf_counter()
+        backtest_results = run_engine(engine, strategy, crypto_df, settings)
+        seconds = time.perf_counter() - start_time
+        outputs = snapshot_outputs(backtest_results)
+        if engine == "original":
+            later_outputs = snapshot_outputs(run_engine(LATER_OUTPUTS_ENGINE, strategy, crypto_df, settings))
+            outputs.update({key: later_outputs[key] for key in LATER_OUTPUTS})
+        runs.append({"strategy": strategy, "settings": settings, "seconds": seconds, "outputs": outputs})
+        if verbose:
+            print("{:<50} {:>8.3f} s".format(run_label(strategy, settings), seconds))
+
+    snapshot = {"format_version": GOLDEN_FORMAT_VERSION, "environment": benchmark_environment(), "engine": engine,
+                "later_outputs_engine": LATER_OUTPUTS_ENGINE if engine == "original" else None, "bars": bars,
+                "seed": seed, "start": start, "dataset": fingerprint, "runs": runs}
+    with open(output_path, "w") as handle:
+        json.dump(snapshot, handle, indent=1)
+
+    return snapshot
+
+
+def compare_outputs(reference, outputs, rtol, atol, tolerances=None):
+    """
+    Compare the outputs of a run with the snapshot of it.
+
+    Arguments:
+        reference, outputs: dictionaries of JSON values (see snapshot_outputs())
+        rtol, atol: numbers match when |value - reference| <= atol + rtol*|reference| (NaN matches NaN)
+        tolerances: {output name: (rtol, atol)} overriding rtol and atol for some outputs, default = None
+    Returns:
+        mismatches: names of the outputs that don't match
+        max_abs_diff, max_rel_diff: largest differences over all numbers
+    """
+    mismatches = []
+    differences = []
+
+    def matches(expected, value, rtol, atol):
+        if isinstance(expected, list) or isinstance(value, list):
+            if not (isinstance(expected, list) and isinstance(value, list)) or len(expected) != len(value):
+                return False
+            return all([matches(x, y, rtol, atol) for x, y in zip(expected, value)])
+        numbers = (int, float)
+        if isinstance(expected, numbers) and isinstance(value, numbers) and not isinstance(expected, bool) and not isinstance(value, bool):
+            if math.isnan(expected) or math.isnan(value):
+                return math.isnan(expected) and math.isnan(value)
+            difference = abs(value - expected)
+            differences.append((difference, difference / abs(expected) if expected != 0 else (0.0 if difference == 0 else math.inf)))
+            return difference <= atol + rtol*abs(expected)
+        return expected == value
+
+    for key in sorted(set(reference) | set(outputs)):
+        key_rtol, key_atol = (tolerances or {}).get(key, (rtol, atol))
+        if key not in reference or key not in outputs or not matches(reference[key], outputs[key], key_rtol, key_atol):
+            mismatches.append(key)
+
+    max_abs_diff = max([difference[0] for difference in differences], default=0.0)
+    max_rel_diff = max([difference[1] for difference in differences], default=0.0)
+
+    return mismatches, max_abs_diff, max_rel_diff
+
+
+def check_engine(engine, snapshot_path=GOLDEN_OUTPUTS_PATH, rtol=1e-9, atol=1e-12, tolerances=None, repeats=1):
+    """
+    Run every backtest of a snapshot on engine and compare the outputs (without the LATER_OUTPUTS when the
+    engine is "original").
+
+    Arguments:
+        engine: engine to check, see run_engine()
+        snapshot_path: JSON file written by write_golden_outputs(), default = GOLDEN_OUTPUTS_PATH
+        rtol, atol, tolerances: see compare_outputs(), defaults = 1e-9, 1e-12 and None
+        repeats: runs of every backtest, the fastest one is compared with the reference time, default = 1
+    Returns:
+        report: pandas dataframe with one row per backtest: 'run' (see run_label()), 'strategy', 'settings',
+            'passed', 'mismatches', 'max_abs_diff', 'max_rel_diff', 'reference_seconds' (as recorded in the
+            snapshot), 'seconds' and 'speedup'
+    """
+    with open(snapshot_path) as handle:
+        snapshot = json.load(handle)
+    if snapshot['format_version'] != GOLDEN_FORMAT_VERSION:
+        raise Exception(snapshot_path, "was written by another version of the harness, write a new snapshot.")
+
+    crypto_df, fingerprint = golden_dataset(snapshot['bars'], snapshot['seed'], snapshot['start'])
+    if fingerprint != snapshot['dataset']:
+        raise Exception("The synthetic dataset is not the one", snapshot_path, "was written for, write a new snapshot.")
+    ma_cache = cb.MovingAverageCache(crypto_df['price'].to_numpy(dtype=np.float64)) if engine == "ma_cache" else None
+
+    rows = []
+    for run in snapshot['runs']:
+        times = []
+        for x in range(repeats):
+            start_time = time.perf_counter()
+            backtest_results = run_engine(engine, run['strategy'], crypto_df, run['settings'], ma_cache)
+            times.append(time.perf_counter() - start_time)
+        outputs = json.loads(json.dumps(snapshot_outputs(backtest_results)))
+        reference = run['outputs']
+        if engine == "original":
+            reference = {key: value for key, value in reference.items() if key not in LATER_OUTPUTS}
+            outputs = {key: value for key, value in outputs.items() if key not in LATER_OUTPUTS}
+        mismatches, max_abs_diff, max_rel_diff = compare_outputs(reference, outputs, rtol, atol, tolerances)
+        rows.append({"run": run_label(run['strategy'], run['settings']), "strategy": run['strategy'],
+                     "settings": json.dumps(run['settings']), "passed": not mismatches,
+                     "mismatches": ", ".join(mismatches), "max_abs_diff": max_abs_diff, "max_rel_diff": max_rel_diff,
+                     "reference_seconds": run['seconds'], "seconds": min(times),
+                     "speedup": run['seconds'] / min(times)})
+
+    report = pd.DataFrame(rows)
+
+    return report
+
+
+def check_loader(seed=0, year_subsets=LOADER_YEAR_SUBSETS, minute_days=LOADER_MINUTE_DAYS,
+                 hourly_start=LOADER_HOURLY_START):
+    """
+    Check that get_bitcoin_data() loads the same rows for a subset of the years as a load of every year
+    filtered to them, with and without the cache, and that a load without the cache writes nothing.
+
+    Arguments:
+        seed: seed of the synthetic price files, default = 0
+        year_subsets: lists of years to load, default = LOADER_YEAR_SUBSETS
+        minute_days, hourly_start: days of minute data per year and start of the hourly file, see
+            write_bitcoin_data_directory(), defaults = LOADER_MINUTE_DAYS and LOADER_HOURLY_START
+    Returns:
+        report: pandas dataframe with one row per subset: 'years', 'passed', 'rows', 'expected_rows',
+            'uncached_equal', 'cached_equal' and 'wrote_files' (files a load without the cache left behind)
+    """
+    directory = tempfile.mkdtemp(prefix="golden_loader_")
+    data_directory = os.path.join(directory, "data")
+    cache_directory = os.path.join(directory, "cache")
+    original_directory = cb.BITCOIN_DATA_DIRECTORY
+    try:
+        write_bitcoin_data_directory(data_directory, seed, minute_days, hourly_start)
+        cb.BITCOIN_DATA_DIRECTORY = data_directory
+        all_years = list(range(2014, 2024))
+        full_df = cb.get_bitcoin_data(all_years, use_cache=False, cache_directory=cache_directory)
+
+        rows = []
+        for years in year_subsets:
+            expected = full_df[full_df['timestamp'].dt.year.isin(years)].drop(columns='quarter').reset_index(drop=True)
+            expected = cb.add_quarter_annotation(expected)
+            uncached = cb.get_bitcoin_data(years, use_cache=False, cache_directory=cache_directory)
+            wrote_files = os.path.exists(cache_directory)
+            # the first call writes the cache entry, the second one reads it back
+            cb.get_bitcoin_data(years, use_cache=True, cache_directory=cache_directory)
+            cached = cb.get_bitcoin_data(years, use_cache=True, cache_directory=cache_directory)
+            shutil.rmtree(cache_directory)
+            rows.append({"years": " ".join(str(year) for year in years),
+                         "passed": uncached.equals(expected) and cached.equals(expected) and not wrote_files,
+                         "rows": len(uncached), "expected_rows": len(expected),
+                         "uncached_equal": uncached.equals(expected), "cached_equal": cached.equals(expected),
+                         "wrote_files": wrote_files})
+    finally:
+        cb.BITCOIN_DATA_DIRECTORY = original_directory
+        shutil.rmtree(directory)
+
+    return pd.DataFrame(rows)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Snapshot the reference backtester outputs or check an engine against them.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    snapshot_parser = subparsers.add_parser("snapshot", help="run the reference engine and save its outputs")
+    snapshot_parser.add_argument("--output", default=GOLDEN_OUTPUTS_PATH)
+    snapshot_parser.add_argument("--bars", type=int, default=GOLDEN_BARS)
+    snapshot_parser.add_argument("--seed", type=int, default=0)
+    snapshot_parser.add_argument("--start", default=GOLDEN_START)
+    snapshot_parser.add_argument("--engine", default="original")
+    check_parser = subparsers.add_parser("check", help="compare engines with the saved outputs")
+    check_parser.add_argument("--snapshot", default=GOLDEN_OUTPUTS_PATH)
+    check_parser.add_argument("--engine", action="append", help="engine to check, can be repeated (default: array)")
+    check_parser.add_argument("--rtol", type=float, default=1e-9)
+    check_parser.add_argument("--atol", type=float, default=1e-12)
+    check_parser.add_argument("--repeats", type=int, default=1)
+    loader_parser = subparsers.add_parser("loader", help="compare loading a subset of the years with loading them all")
+    loader_parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args(arguments)
+    # the pandas engine converts the timestamps of the dataframe it is given in place
+    warnings.simplefilter("ignore", pd.errors.SettingWithCopyWarning)
+
+    if arguments.command == "snapshot":
+        write_golden_outputs(arguments.output, arguments.bars, arguments.seed, arguments.engine, arguments.start)
+        return 0
+
+    if arguments.command == "loader":
+        report = check_loader(arguments.seed)
+        print("get_bitcoin_data:", int(report['passed'].sum()), "of", len(report), "year subsets match the full load")
+        print(report.to_string(index=False))
+        return 0 if report['passed'].all() else 1
+
+    failed = False
+    for engine in arguments.engine or ["array"]:
+        report = check_engine(engine, arguments.snapshot, arguments.rtol, arguments.atol, repeats=arguments.repeats)
+        print("engine:", engine, "-", int(report['passed'].sum()), "of", len(report), "runs match,",
+              "median speedup {:.1f}x".format(report['speedup'].median()))
+        with pd.option_context("display.width", 250, "display.max_rows", None, "display.max_colwidth", 60):
+            print(report.drop(columns=["strategy", "settings", "reference_seconds"]).to_string(index=False))
+        failed = failed or not report['passed'].all()
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
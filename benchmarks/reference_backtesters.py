@@ -0,0 +1,718 @@
+"""
+The two backtesters exactly as they were in the first commit of crypto_backtesting.py, before any of the
+engines and optimizations, frozen as the reference benchmarks.golden snapshots its outputs from (engine
+"original"). Only the plotting is cut out (balance_data is always the placeholder string), everything else is
+kept line for line, quirks and unused variables included, so an engine that drifts from the original behavior
+can't also move the reference along with it. Don't edit these to match a change of the backtesters.
+"""
+import statistics
+
+import pandas as pd
+
+
+def mean_reversion_backtester(sampled_data, 
+                            order_sizing, 
+                            ma_length, 
+                            starting_capital,
+                            buy_threshold,
+                            take_profit,
+                            stop_loss,
+                            shorting_allowed,
+                            fixed_fee,
+                            display_results,
+                            record_balance,
+                            show_moving_averages,
+                            annual_taxes,
+                            tax_percentage = 0,
+                            fee=0
+                            ):
+    """ 
+    Parameters:
+        sampled_data: pandas dataframe that must have columns 'timestamp' and 'price'
+        order_sizing: how much of available capital to use on a given trade (betwen 0 and 1)
+        ma_length: moving average length (in hours)
+        starting_capital: how much capital to start with (USD)
+        buy_threshold: at what % below the moving average to buy (if 5%, should be 0.05)
+        take_profit: at what % gain to sell and take the profit (if 5%, should be 0.05)
+        stop_loss: at what % to sell and stop losses (if 5%, should be 0.05)
+        shorting_allowed: whether or not to short or sell regularly (true or false)
+        fee: the % charged per transaction by the exchange (in %, so 0.01 = 1%)
+        record_balance: whether or not to track the balance over the whole period
+        show_moving_averages: whether or not to show the moving averages in the plot displayed (true or false)
+        annual_taxes: whether or not to take annual taxes on gains (true or false)
+        tax_percentage: if taxes are enabled, what % of taxes to pay on gains (0.01 = 1%), default = 0
+    Returns:
+        backtest_results: dictionary that contains backtest result metrics and balance information 
+    """
+
+    # for figuring out how much a fee is
+    # we are taking the average of maker and taker fees on coinbase pro starting on 6/5/23
+    def find_fee(thirty_day_volume):
+        volume_fee_table = {
+            10000: 0.005,
+            50000: 0.00325,
+            100000: 0.002,
+            1000000: 0.0015,
+            15000000: 0.0013,
+            75000000: 0.0011,
+            250000000: 0.00075,
+            400000000: 0.0004,
+        }
+        
+        for volume, fee in volume_fee_table.items():
+            if thirty_day_volume <= volume:
+                return fee
+        
+        # If the volume is greater than the largest key, return the fee for the largest key
+        return volume_fee_table[400000000]
+    
+    
+    # Ensure inputs are valid
+    if "timestamp" not in sampled_data.columns:
+        return "Could not run ma_crossover_backtester(), 'timestamp' column missing from data."
+    if "price" not in sampled_data.columns:
+        return "Could not run ma_crossover_backtester(), 'price' column missing from data."
+    if starting_capital <= 0:
+        return "Could not run ma_crossover_backtester(), starting_capital must be greater than zero."
+    if order_sizing > 1 or order_sizing <= 0:
+        return "Could not run ma_crossover_backtester(), order_sizing must be between 1 and 0."
+    
+    
+    fiat = starting_capital
+    position_size = 0
+    baseline_position_size = 0
+    portfolio_balance = [] #keeps track of the total portfolio worth
+    baseline_balance = [] #keeps track of the buy and hold balance
+    moves = [] #keep track of buys and sells
+    trades = 0
+    purchase_price = 0
+    wins = 0
+    losses = 0
+
+    # setup for keeping track of quarterly results
+    three_month_hours = 2191
+    one_month_hours = 730 #actually 730.5 
+    quarter_numbers = []
+    quarter_return_rates = []
+    quarter_trades = []
+    quarter_hit_rates = []
+    baseline_return_rates = []
+
+    monthly_return_rates = []
+
+    # calculate the total number of quarters in the dataset
+    total_quarters = max(list(sampled_data['quarter']))
+    # total_months = math.floor(len(sampled_data.index)/one_month_hours)
+
+    # calculate quarter intervals
+    # quarter_intervals = [three_month_hours*x for x in range(0, total_quarters)]
+    # monthly_intervals = [one_month_hours*x for x in range(0, total_months)]
+
+    # convert to get the corresponding timestamps
+    # quarter_intervals = [crypto_df.iloc[x]['timestamp'] for x in quarter_intervals]
+    # monthly_intervals = [crypto_df.iloc[x]['timestamp'] for x in monthly_intervals]
+    
+    current_price = sampled_data['price'][0]
+    baseline_position_size = starting_capital/current_price
+    baseline_initial = current_price
+
+    ma = sampled_data.price.rolling(ma_length).mean()
+
+    #truncate the data so they all are aligned 
+    ma = list(ma[ma_length:])
+    sampled_data = sampled_data[ma_length:]
+    last_average_higher = "None"
+
+    # set up shorting mechanism
+    short_position = None
+    short_results = []
+
+    # set up volume data
+    thirty_day_volume = 0
+    volume_data = []
+
+    # set up tax information, when the year changes, we check if we gained or lost for the year, and then put that aside for taxes
+    sampled_data['timestamp'] = pd.to_datetime(sampled_data['timestamp'])
+
+    past_year = sampled_data.iloc[0]['timestamp'].year
+    annual_change = 0
+    past_quarter = 1
+    
+    #now run through each moment in the data and check if there is a crossover
+    for x in range(0, len(sampled_data['price'])):
+
+        # calculate the fee using the thirty_day_volume
+        if not fixed_fee:
+            fee = find_fee(thirty_day_volume)
+
+        #get the current price
+        current_price = sampled_data.iloc[x]['price']
+        current_quarter = sampled_data.iloc[x]['quarter']
+
+        if x == 0:
+            #baseline_initial = current_price
+            #baseline_position_size = starting_capital/current_price
+            quarter_initial = current_price
+
+            monthly_initial_balance = starting_capital
+            quarter_initial_balance = starting_capital
+            quarter_baseline_initial_balance = starting_capital
+
+            annual_baseline_balance = starting_capital
+        
+        # if the year has changed, calculate how much has happened
+        if annual_taxes == True:
+            current_year = sampled_data.iloc[x]['timestamp'].year
+            if current_year != past_year:
+                # the year has changed
+                if short_position == True:
+                    short_delta = (purchase_price*position_size - current_price*position_size)
+                    current_balance = (purchase_price*position_size + short_delta + fiat)
+                else:
+                    current_balance = current_price*position_size + fiat
+
+                annual_change = current_balance - annual_baseline_balance
+
+                # if we had a gain that year, you need to pay taxes
+                if annual_change > 0:
+                    taxes_due = annual_change*tax_percentage
+                    
+                    # if currently holding a position, will need to sell some of it to make up for the taxes...(since fiat is probably low)
+                    if position_size != 0:
+                        taxes_due = annual_change*tax_percentage - fiat #use all fiat first
+                        amount_to_sell = taxes_due/current_price # find out how many shares will cover the amount due
+                        position_size = position_size - amount_to_sell # reduce that many shares from the amount due
+                    else:
+                        fiat = fiat - taxes_due
+                
+                # reset the new amount
+                annual_baseline_balance = position_size*current_price + fiat
+            
+            past_year = current_year
+        
+        # if a new month begins, calculate the return for that month (for sharpe ratio calculations)
+        # if sampled_data.iloc[x]['timestamp'] in monthly_intervals:
+        #     monthly_return_rate = ((fiat + current_price*position_size)/monthly_initial_balance) - 1
+        #     monthly_return_rates.append(monthly_return_rate)
+        #     monthly_initial_balance = fiat + current_price*position_size
+
+        # If a new quarter begins, calculate metrics for the quarter
+        if current_quarter != past_quarter:
+            quarter_return_rate = ((fiat + current_price*position_size)/quarter_initial_balance) - 1
+            quarter_return_rates.append(quarter_return_rate)
+            quarter_trades.append(trades)
+            baseline_return_rate = ((baseline_position_size*current_price)/quarter_baseline_initial_balance) - 1
+            baseline_return_rates.append(baseline_return_rate)
+
+            if (losses + wins) > 0:
+                hit_rate = wins/(losses + wins)
+            else:
+                hit_rate = "N/A"
+
+            quarter_hit_rates.append(hit_rate)
+
+            # reset initial price for the quarter
+            quarter_initial = current_price
+
+            # reset number of trades, losses, wins
+            trades = 0
+            losses = 0
+            wins = 0
+
+            # calculate the new initial portfolio worth to be used for the new quarter
+            quarter_initial_balance = fiat + current_price*position_size
+            quarter_baseline_initial_balance = current_price*baseline_position_size
+
+        past_quarter = current_quarter
+            
+        #keep track of which one was higher previously
+        if x == 0:
+            last_move = "Pass"
+
+        else:
+            #begin the trading mechanism
+
+            #if the price dips below a set % from the moving average - BUY
+            if last_move != "Buy" and current_price <= ma[x]*(1-buy_threshold):
+                if shorting_allowed == True:
+                    if short_position == True:
+                        # if there is a short position, exit out of it
+                        short_delta = (purchase_price*position_size - current_price*position_size) # calculate the delta for the short
+                        short_results.append(short_delta)
+                        fiat = fiat + (purchase_price*position_size + short_delta)*(1 - fee) # sell the position and the short
+                        position_size = 0 # set the position to zero
+                    short_position = False 
+
+                #add the btc amount to the position
+                position_size = position_size + (order_sizing*fiat*(1 - fee))/current_price #add the btc purchased
+                fiat = fiat - order_sizing*fiat #subtract the amount of capital used
+                last_move = "Buy"
+                trades = trades + 1
+                purchase_price = current_price
+
+            #if the take profit or stop loss threshold is crossed - SELL
+            elif last_move == "Buy" and (current_price >= ma[x]*(1+take_profit) or current_price <=ma[x]*(1-stop_loss)):
+                fiat = fiat + position_size*current_price*(1 - fee)
+                position_size = 0
+
+                if shorting_allowed == True:
+                    position_size = (order_sizing*fiat*(1 - fee))/current_price
+                    fiat = fiat - position_size*current_price
+                    last_move = "Short-Sell"
+                    short_position = True
+                    purchase_price = current_price
+                else:
+                    last_move = "Sell"
+                    # reset the purchase price
+                    purchase_price = 0
+
+                trades = trades + 1
+
+                # record whether the trade was profitable
+                if purchase_price < current_price:
+                    wins = wins + 1 
+                else:
+                    losses = losses + 1
+                
+            else:
+                pass
+                #moves.append("Pass")
+        
+        if shorting_allowed == True:
+            #record the portfolio information
+            if short_position == False or short_position == None:
+                if record_balance == True:
+                    portfolio_balance.append(position_size*current_price + fiat)
+            if short_position == True:
+                short_delta = (purchase_price*position_size - current_price*position_size)
+                if record_balance == True:
+                    portfolio_balance.append(purchase_price*position_size + short_delta + fiat)
+        else:
+            #record the portfolio information
+            if record_balance == True:
+                portfolio_balance.append(position_size*current_price + fiat)
+            
+        if record_balance == True:
+            baseline_balance.append(baseline_position_size*current_price)
+
+        # go through the volume data
+        thirty_day_volume = 0 # re-calculate the current thirty_day_volume
+        new_volume_data = []
+        for volume_data_entry in volume_data:
+            if volume_data_entry[0] < 720: # 720 hours in thirty days
+                thirty_day_volume = thirty_day_volume + volume_data_entry[1]
+                new_volume_data.append([volume_data_entry[0] + 1, volume_data_entry[1]])
+        
+        volume_data = new_volume_data
+        
+    
+    # compute final results
+    baseline_final = current_price
+    baseline_return_rate = (baseline_final/baseline_initial) - 1  
+    final_return_rate = ((position_size*current_price + fiat)/starting_capital) - 1
+    if (losses + wins) > 0:
+        hit_rate = wins/(losses + wins)
+    else:
+        hit_rate = "N/A"
+
+    # calculate sharpe ratio (using 0% as the risk-free return benchmark)
+    #sharpe_ratio = (statistics.mean(monthly_return_rates)-0)/(statistics.stdev(monthly_return_rates)*np.sqrt(12))
+    sharpe_ratio = None
+
+    plot_data = "Could not generate plot_data: display_results and/or record_balance was set to False."
+
+    # calculate quarters_beating_baseline
+    count = 0
+    for x in range(0, len(quarter_return_rates)):
+        # we round so that a difference of 0.0000000001, etc. won't bring it over the edge.
+        if round(quarter_return_rates[x],2) > round(baseline_return_rates[x],2):
+            count = count + 1
+
+    quarters_beating_baseline = round(count/len(quarter_return_rates), 2)
+
+    # return the results
+    backtest_results = {"final_return_rate" : final_return_rate,
+               "hit_rate": hit_rate,
+               "baseline_return_rate": baseline_return_rate,
+               "quarter_return_rates": quarter_return_rates, 
+               "quarter_trades": quarter_trades,
+               "quarter_hit_rates": quarter_hit_rates,
+               "baseline_return_rates": baseline_return_rates,
+               "balance_data": plot_data,
+               "sharpe_ratio": sharpe_ratio,
+                "quarters_beating_baseline": quarters_beating_baseline,
+               "strategy_quarterly_stdev": statistics.stdev(quarter_return_rates),
+               "baseline_quarterly_stdev": statistics.stdev(baseline_return_rates)
+
+    }
+    
+    return backtest_results
+
+
+def sma_crossover_backtester(sampled_data, 
+                            order_sizing, 
+                            ma1_length, 
+                            ma2_length, 
+                            starting_capital,
+                            display_results,
+                            shorting_allowed,
+                            fixed_fee,
+                            record_balance,
+                            show_moving_averages,
+                            annual_taxes,
+                            tax_percentage = 0,
+                            fee=0
+                            ):
+    """ 
+    Parameters:
+        sampled_data: pandas dataframe that must have columns 'timestamp' and 'price'
+        order_sizing: how much of available capital to use on a given trade (betwen 0 and 1)
+        ma1_length: moving average 1 length (in hours)
+        ma2_length: moving average 2 length (in hours, must be longer than ma1_length)
+        starting_capital: how much capital to start with (USD)
+        display_results: plot the portfolio value over time (true or false)
+        shorting_allowed: whether or not to short or sell regularly (true or false)
+        fixed_fee: whether to use volume based fee or a fixed fee (true or false)
+        fee: if fixed fee, the % charged per transaction by the exchange (0.01 = 1%), default = 0
+        record_balance: whether or not to track the balance over the whole period
+        show_moving_averages: whether or not to show the moving averages in the plot displayed (true or false)
+        annual_taxes: whether or not to take annual taxes on gains (true or false)
+        tax_percentage: if taxes are enabled, what % of taxes to pay on gains (0.01 = 1%), default = 0
+    Returns:
+        backtest_results: dictionary that contains backtest result metrics and balance information 
+    """
+
+    # for figuring out how much a fee is
+    # we are taking the average of maker and taker fees on coinbase pro starting on 6/5/23
+    def find_fee(thirty_day_volume):
+        volume_fee_table = {
+            10000: 0.005,
+            50000: 0.00325,
+            100000: 0.002,
+            1000000: 0.0015,
+            15000000: 0.0013,
+            75000000: 0.0011,
+            250000000: 0.00075,
+            400000000: 0.0004,
+        }
+        
+        for volume, fee in volume_fee_table.items():
+            if thirty_day_volume <= volume:
+                return fee
+        
+        # If the volume is greater than the largest key, return the fee for the largest key
+        return volume_fee_table[400000000]
+
+    
+    # Ensure inputs are valid
+    if "timestamp" not in sampled_data.columns:
+        return "Could not run ma_crossover_backtester(), 'timestamp' column missing from data."
+    if "price" not in sampled_data.columns:
+        return "Could not run ma_crossover_backtester(), 'price' column missing from data."
+    if ma2_length < ma1_length:
+        return "Could not run ma_crossover_backtester(), ma1_length is larger than ma2_length."
+    if starting_capital <= 0:
+        return "Could not run ma_crossover_backtester(), starting_capital must be greater than zero."
+    if order_sizing > 1 or order_sizing <= 0:
+        return "Could not run ma_crossover_backtester(), order_sizing must be between 1 and 0."
+    
+    
+    fiat = starting_capital
+    position_size = 0
+    baseline_position_size = 0
+    portfolio_balance = [] #keeps track of the total portfolio worth
+    baseline_balance = [] #keeps track of the buy and hold balance
+    moves = [] #keep track of buys and sells
+    trades = 0
+    purchase_price = 0
+    wins = 0
+    losses = 0
+
+    # setup for keeping track of quarterly results
+    three_month_hours = 2191
+    one_month_hours = 730 #actually 730.5 
+    quarter_numbers = []
+    quarter_return_rates = []
+    quarter_trades = []
+    quarter_hit_rates = []
+    baseline_return_rates = []
+
+    monthly_return_rates = []
+
+    # calculate the total number of quarters in the dataset
+    # calculate the total number of quarters in the dataset
+    total_quarters = max(list(sampled_data['quarter']))
+    # total_quarters = math.floor(len(sampled_data.index)/three_month_hours)
+    # total_months = math.floor(len(sampled_data.index)/one_month_hours)
+
+    # # calculate quarter intervals
+    # quarter_intervals = [three_month_hours*x for x in range(0, total_quarters)]
+    # monthly_intervals = [one_month_hours*x for x in range(0, total_months)]
+
+    # # convert to get the corresponding timestamps
+    # quarter_intervals = [sampled_data.iloc[x]['timestamp'] for x in quarter_intervals]
+    # monthly_intervals = [sampled_data.iloc[x]['timestamp'] for x in monthly_intervals]
+    
+    current_price = sampled_data['price'][0]
+    baseline_position_size = starting_capital/current_price
+    baseline_initial = current_price
+
+    ma1 = sampled_data.price.rolling(ma1_length).mean()
+    ma2 = sampled_data.price.rolling(ma2_length).mean()
+
+    #truncate the data so they all are aligned 
+    ma1 = list(ma1[ma2_length:])
+    ma2 = list(ma2[ma2_length:])
+    sampled_data = sampled_data[ma2_length:]
+    last_average_higher = "None"
+
+    # set up shorting mechanism
+    short_position = None
+    short_results = []
+
+    # set up volume data
+    thirty_day_volume = 0
+    volume_data = []
+
+    # set up tax information, when the year changes, we check if we gained or lost for the year, and then put that aside for taxes
+    sampled_data['timestamp'] = pd.to_datetime(sampled_data['timestamp'])
+
+    past_year = sampled_data.iloc[0]['timestamp'].year
+    annual_change = 0
+    past_quarter = 1
+    
+    #now run through each moment in the data and check if there is a crossover
+    for x in range(0, len(sampled_data['price'])):
+
+        # calculate the fee using the thirty_day_volume
+        if not fixed_fee:
+            fee = find_fee(thirty_day_volume)
+
+        #get the current price
+        current_price = sampled_data.iloc[x]['price']
+        current_quarter = sampled_data.iloc[x]['quarter']
+
+        if x == 0:
+            #baseline_initial = current_price
+            #baseline_position_size = starting_capital/current_price
+            quarter_initial = current_price
+
+            monthly_initial_balance = starting_capital
+            quarter_initial_balance = starting_capital
+            quarter_baseline_initial_balance = starting_capital
+
+            annual_baseline_balance = starting_capital
+
+        # if the year has changed, calculate how much has happened
+        if annual_taxes == True:
+            current_year = sampled_data.iloc[x]['timestamp'].year
+            if current_year != past_year:
+                # the year has changed
+                if short_position == True:
+                    short_delta = (purchase_price*position_size - current_price*position_size)
+                    current_balance = (purchase_price*position_size + short_delta + fiat)
+                else:
+                    current_balance = current_price*position_size + fiat
+
+                annual_change = current_balance - annual_baseline_balance
+
+                # if we had a gain that year, you need to pay taxes
+                if annual_change > 0:
+                    taxes_due = annual_change*tax_percentage
+                    
+                    # if currently holding a position, will need to sell some of it to make up for the taxes...(since fiat is probably low)
+                    if position_size != 0:
+                        taxes_due = annual_change*tax_percentage - fiat #use all fiat first
+                        amount_to_sell = taxes_due/current_price # find out how many shares will cover the amount due
+                        position_size = position_size - amount_to_sell # reduce that many shares from the amount due
+                    else:
+                        fiat = fiat - taxes_due
+                
+                # reset the new amount
+                annual_baseline_balance = position_size*current_price + fiat
+            
+            past_year = current_year
+        
+        # if a new month begins, calculate the return for that month (for sharpe ratio calculations)
+        # if sampled_data.iloc[x]['timestamp'] in monthly_intervals:
+        #     monthly_return_rate = ((fiat + current_price*position_size)/monthly_initial_balance) - 1
+        #     monthly_return_rates.append(monthly_return_rate)
+        #     monthly_initial_balance = fiat + current_price*position_size
+
+        # If a new quarter begins, calculate metrics for the quarter
+        if current_quarter != past_quarter:
+            quarter_return_rate = ((fiat + current_price*position_size)/quarter_initial_balance) - 1
+            quarter_return_rates.append(quarter_return_rate)
+            quarter_trades.append(trades)
+            baseline_return_rate = ((baseline_position_size*current_price)/quarter_baseline_initial_balance) - 1
+            baseline_return_rates.append(baseline_return_rate)
+
+            if (losses + wins) > 0:
+                hit_rate = wins/(losses + wins)
+            else:
+                hit_rate = "N/A"
+
+            quarter_hit_rates.append(hit_rate)
+
+            # reset initial price for the quarter
+            quarter_initial = current_price
+
+            # reset number of trades, losses, wins
+            trades = 0
+            losses = 0
+            wins = 0
+
+            # calculate the new initial portfolio worth to be used for the new quarter
+            quarter_initial_balance = fiat + current_price*position_size
+            quarter_baseline_initial_balance = current_price*baseline_position_size
+        
+        past_quarter = current_quarter
+            
+        #keep track of which one was higher previously
+        if ma1[x] > ma2[x]:
+            current_average_higher = "MA1"
+        elif ma1[x] < ma2[x]:
+            current_average_higher = "MA2"
+        else:
+            current_average_higher = "None"
+
+        if x == 0:
+            pass
+            #moves.append("Pass")
+        else:
+            #begin the trading mechanism
+
+            #if the shorter average crosses over the longer average - BUY
+            if current_average_higher == "MA1" and last_average_higher == "MA2":
+                if shorting_allowed == True:
+                    if short_position == True:
+                        # if there is a short position, exit out of it
+                        short_delta = (purchase_price*position_size - current_price*position_size) # calculate the delta for the short
+                        short_results.append(short_delta)
+                        fiat = fiat + (purchase_price*position_size + short_delta)*(1 - fee) # sell the position and the short
+                        position_size = 0 # set the position to zero
+                    
+                    short_position = False
+
+
+                #add the btc amount to the position
+                position_size = position_size + (order_sizing*fiat*(1 - fee))/current_price #add the btc purchased
+                
+                # record the volume information (the amount purchased)
+                volume_data.append([
+                    0,(order_sizing*fiat*(1 - fee))/current_price
+                ])
+
+                fiat = fiat - order_sizing*fiat #subtract the amount of capital used
+                #moves.append("Buy")
+                trades = trades + 1
+                purchase_price = current_price
+
+                
+
+            #if the shorter average goes under the longer average - SELL
+            elif current_average_higher == "MA2" and last_average_higher == "MA1":
+                fiat = fiat + position_size*current_price*(1 - fee)
+                position_size = 0
+
+                # record the volume information (the amount sold)
+                volume_data.append([
+                    0,position_size*current_price*(1 - fee)
+                ])
+
+                if shorting_allowed == True:
+                    position_size = (order_sizing*fiat*(1 - fee))/current_price
+                    fiat = fiat - position_size*current_price
+                    short_position = True
+                    purchase_price = current_price
+                    #moves.append("Short-Sell")
+                else:
+                    pass
+                    purchase_price = 0
+                    #moves.append("Sell")
+
+                trades = trades + 1
+
+                # record whether the trade was profitable
+                if purchase_price < current_price:
+                    wins = wins + 1 
+                else:
+                    losses = losses + 1
+                
+
+            else:
+                pass
+                #moves.append("Pass")
+
+        if shorting_allowed == True:
+            #record the portfolio information
+            if short_position == False or short_position == None:
+                if record_balance == True:
+                    portfolio_balance.append(position_size*current_price + fiat)
+            if short_position == True:
+                short_delta = (purchase_price*position_size - current_price*position_size)
+                if record_balance == True:
+                    portfolio_balance.append(purchase_price*position_size + short_delta + fiat)
+        else:
+            #record the portfolio information
+            if record_balance == True:
+                portfolio_balance.append(position_size*current_price + fiat)
+            
+        if record_balance == True:
+            baseline_balance.append(baseline_position_size*current_price)
+        
+        #record which moving average was higher this moment
+        last_average_higher = current_average_higher
+
+        # go through the volume data
+        thirty_day_volume = 0 # re-calculate the current thirty_day_volume
+        new_volume_data = []
+        for volume_data_entry in volume_data:
+            if volume_data_entry[0] < 720: # 720 hours in thirty days
+                thirty_day_volume = thirty_day_volume + volume_data_entry[1]
+                new_volume_data.append([volume_data_entry[0] + 1, volume_data_entry[1]])
+        
+        volume_data = new_volume_data
+
+    
+    # compute final results
+    baseline_final = current_price
+    baseline_return_rate = (baseline_final/baseline_initial) - 1    
+    final_return_rate = ((position_size*current_price + fiat)/starting_capital) - 1
+    if (losses + wins) > 0:
+        hit_rate = wins/(losses + wins)
+    else:
+        hit_rate = "N/A"
+
+    # calculate sharpe ratio (using 0% as the risk-free return benchmark)
+    #sharpe_ratio = (statistics.mean(monthly_return_rates)-0)/(statistics.stdev(monthly_return_rates)*np.sqrt(12))
+    sharpe_ratio = None
+
+    plot_data = "Could not generate plot_data: display_results and/or record_balance was set to False."
+
+    # calculate quarters_beating_baseline
+    count = 0
+    for x in range(0, len(quarter_return_rates)):
+        # we round so that a difference of 0.0000000001, etc. won't bring it over the edge.
+        if round(quarter_return_rates[x],2) > round(baseline_return_rates[x],2):
+            count = count + 1
+    
+    quarters_beating_baseline = round(count/len(quarter_return_rates), 2)
+
+    # return the results
+    backtest_results = {"final_return_rate" : final_return_rate,
+               "hit_rate": hit_rate,
+               "baseline_return_rate": baseline_return_rate,
+               "quarter_return_rates": quarter_return_rates, 
+               "quarter_trades": quarter_trades,
+               "quarter_hit_rates": quarter_hit_rates,
+               "baseline_return_rates": baseline_return_rates,
+               "balance_data": plot_data,
+               "sharpe_ratio": sharpe_ratio,
+               "quarters_beating_baseline": quarters_beating_baseline,
+               "strategy_quarterly_stdev": statistics.stdev(quarter_return_rates),
+               "baseline_quarterly_stdev": statistics.stdev(baseline_return_rates)
+
+    }
+    
+    return backtest_results
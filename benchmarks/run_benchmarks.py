@@ -0,0 +1,400 @@
+"""
+Repeatable benchmarks of the loaders, backtesters and sweeps of crypto_backtesting on seeded synthetic data.
+
+    python -m benchmarks --output benchmark_results.json
+    python -m benchmarks --quick --filter backtest --compare benchmark_results.json
+
+Every benchmark runs in a fresh process, so the peak RSS it reports is its own (plus, for sweeps, the peak of
+its worker processes). The startup benchmarks time a cold import of the library and how long a new pool worker
+takes to run its first task. The results are written as JSON together with the commit and package versions, and
+--compare prints how much slower or faster each benchmark got against an earlier results file.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import crypto_backtesting as cb
+from benchmarks.synthetic_data import synthetic_backtest_data, synthetic_ohlcv, write_bitcoin_data_directory
+
+# bumped whenever the layout of the results file changes
+BENCHMARK_FORMAT_VERSION = 1
+
+# hourly bars the backtesters and sweeps run on, 2019 to 2023 has about as many
+BACKTEST_BARS = 5 * 8760
+
+# minute bars of the minute-level backtests (bar_minutes=1), 2014 to 2023 has about as many
+MINUTE_BACKTEST_BARS = 10 * 525600
+
+# the pandas reference engine walks the dataframe bar by bar and takes seconds per thousand bars, so it runs on
+# three quarters (the quarterly statistics need at least two)
+PANDAS_ENGINE_BARS = 3 * 2191
+
+# backtester benchmark modes: (shorting_allowed, fixed_fee, annual_taxes)
+BACKTEST_MODES = [(shorting_allowed, fixed_fee, annual_taxes) for shorting_allowed in [False, True]
+                  for fixed_fee in [True, False] for annual_taxes in [False, True]]
+
+SWEEP_WORKER_COUNTS = [1, 2, 4]
+
+# ru_maxrss is in kilobytes on linux and in bytes on macos
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# what the cold import benchmark runs in a fresh interpreter, it fails if importing the library loads plotting
+IMPORT_CHECK = "import sys, crypto_backtesting; sys.exit('matplotlib' in sys.modules or 'seaborn' in sys.modules)"
+
+# pool start methods the worker startup benchmark is run with (when the platform has them)
+WORKER_START_METHODS = ["fork", "spawn"]
+
+
+def worker_ready():
+    """
+    First task of the worker startup benchmark, by the time it runs the worker has imported the library.
+    """
+    return os.getpid()
+
+
+def benchmark_cases(quick=False):
+    """
+    Every benchmark as a (name, parameters) pair, parameters are passed to setup_benchmark().
+
+    Arguments:
+        quick: smaller datasets and sweeps, for a quick look rather than for comparing commits
+    """
+    scale = 4 if quick else 1
+    cases = []
+
+    cases.append(("startup/import", {"kind": "import"}))
+    for start_method in WORKER_START_METHODS:
+        if start_method in multiprocessing.get_all_start_methods():
+            cases.append(("startup/worker/" + start_method, {"kind": "worker", "start_method": start_method}))
+
+    minutes = 525600 // scale
+    cases.append(("load/merge_and_convert_to_hourly", {"kind": "merge", "minutes": minutes, "hours": 8760 // scale}))
+    minute_days = 28 // scale
+    cases.append(("load/get_bitcoin_data/cold", {"kind": "get_bitcoin_data", "cached": False, "minute_days": minute_days}))
+    cases.append(("load/get_bitcoin_data/cached", {"kind": "get_bitcoin_data", "cached": True, "minute_days": minute_days}))
+    cases.append(("load/get_bitcoin_minute_data/cold", {"kind": "get_bitcoin_minute_data", "cached": False,
+                                                        "minute_days": minute_days}))
+    cases.append(("load/get_bitcoin_minute_data/cached", {"kind": "get_bitcoin_minute_data", "cached": True,
+                                                          "minute_days": minute_days}))
+
+    for strategy in ["simple moving average crossover", "mean reversion"]:
+        for engine in ["array", "pandas"]:
+            bars = BACKTEST_BARS // scale if engine == "array" else PANDAS_ENGINE_BARS
+            for shorting_allowed, fixed_fee, annual_taxes in BACKTEST_MODES:
+                name = "backtest/{}/{}/{}/{}/{}".format(strategy.replace(" ", "_"), engine,
+                                                         "short" if shorting_allowed else "long",
+                                                         "fixed_fee" if fixed_fee else "volume_fee",
+                                                         "taxes" if annual_taxes else "no_taxes")
+                cases.append((name, {"kind": "backtest", "strategy": strategy, "engine": engine, "bars": bars,
+                                     "shorting_allowed": shorting_allowed, "fixed_fee": fixed_fee,
+                                     "annual_taxes": annual_taxes, "bar_minutes": 60}))
+        # one run straight on minute bars, in the float32 layout get_bitcoin_minute_data() returns
+        name = "backtest/{}/array/minute".format(strategy.replace(" ", "_"))
+        cases.append((name, {"kind": "backtest", "strategy": strategy, "engine": "array",
+                             "bars": MINUTE_BACKTEST_BARS // scale, "shorting_allowed": True, "fixed_fee": False,
+                             "annual_taxes": True, "bar_minutes": 1}))
+
+    # drawing should take about as long for an hourly as for a minute history (see cb.plot_balance_data())
+    for freq, bars in [("hourly", BACKTEST_BARS), ("minute", BACKTEST_BARS * 60)]:
+        cases.append(("plot/balance_data/" + freq, {"kind": "plot", "bars": bars // scale}))
+
+    for strategy in ["simple moving average crossover", "mean reversion"]:
+        for workers in SWEEP_WORKER_COUNTS:
+            name = "sweep/{}/workers_{}".format(strategy.replace(" ", "_"), workers)
+            cases.append((name, {"kind": "sweep", "strategy": strategy, "workers": workers,
+                                 "bars": BACKTEST_BARS // scale, "num_runs": 256 // scale}))
+
+    return cases
+
+
+def setup_benchmark(parameters, seed, directory):
+    """
+    Prepare the data of a benchmark.
+
+    Returns:
+        run: function that runs the benchmark once
+        bars: how many bars one run processes (input rows for the loaders, bars times runs for sweeps)
+    """
+    kind = parameters['kind']
+
+    if kind == "import":
+        command = [sys.executable, "-c", IMPORT_CHECK]
+        run = lambda: subprocess.run(command, cwd=REPOSITORY, check=True)
+        return run, 1
+
+    if kind == "worker":
+        context = multiprocessing.get_context(parameters['start_method'])
+
+        def run():
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                return pool.submit(worker_ready).result()
+        return run, 1
+
+    if kind == "merge":
+        minute_data = synthetic_ohlcv(parameters['minutes'], "min", "2018-01-01", seed)
+        hourly_data = synthetic_ohlcv(parameters['hours'], "h", "2019-01-01", seed + 1)
+        # merge_and_convert_to_hourly() changes its arguments, so every run gets fresh copies
+        run = lambda: cb.merge_and_convert_to_hourly(minute_data.copy(), hourly_data.copy())
+        return run, len(minute_data) + len(hourly_data)
+
+    if kind == "get_bitcoin_data":
+        data_directory = os.path.join(directory, "data")
+        cache_directory = os.path.join(directory, "cache")
+        paths = write_bitcoin_data_directory(data_directory, seed, parameters['minute_days'])
+        cb.BITCOIN_DATA_DIRECTORY = data_directory
+        years = list(range(2014, 2024))
+        rows = 0
+        for path in paths:
+            with open(path, "rb") as handle:
+                rows = rows + sum(1 for line in handle)
+        if parameters['cached']:
+            cb.get_bitcoin_data(years, use_cache=True, cache_directory=cache_directory)
+        run = lambda: cb.get_bitcoin_data(years, use_cache=parameters['cached'], cache_directory=cache_directory)
+        return run, rows
+
+    if kind == "get_bitcoin_minute_data":
+        data_directory = os.path.join(directory, "data")
+        cache_directory = os.path.join(directory, "cache")
+        paths = write_bitcoin_data_directory(data_directory, seed, parameters['minute_days'])
+        cb.BITCOIN_DATA_DIRECTORY = data_directory
+        years = cb.MINUTE_DATA_YEARS
+        rows = 0
+        for path in paths[:len(years)]:
+            with open(path, "rb") as handle:
+                rows = rows + sum(1 for line in handle)
+        if parameters['cached']:
+            cb.get_bitcoin_minute_data(years, use_cache=True, cache_directory=cache_directory)
+        run = lambda: cb.get_bitcoin_minute_data(years, use_cache=parameters['cached'],
+                                                 cache_directory=cache_directory)
+        return run, rows
+
+    if kind == "plot":
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        rng = np.random.default_rng(seed)
+        baseline = 10000 * np.exp(np.cumsum(rng.normal(0, 0.008, parameters['bars'])))
+        balance_data = {"time": pd.date_range("2019-01-01", periods=parameters['bars'], freq="min").to_numpy(),
+                        "Baseline": baseline,
+                        "SMA Crossover": baseline * np.exp(np.cumsum(rng.normal(0, 0.002, parameters['bars']))),
+                        "MA1": pd.Series(baseline).rolling(48, min_periods=1).mean().to_numpy(),
+                        "MA2": pd.Series(baseline).rolling(168, min_periods=1).mean().to_numpy()}
+
+        def run():
+            cb.plot_balance_data(balance_data)
+            plt.gcf().canvas.draw()
+            plt.close("all")
+        return run, parameters['bars']
+
+    if kind == "backtest" and parameters['bar_minutes'] == 1:
+        crypto_df = synthetic_backtest_data(parameters['bars'], freq="min", seed=seed)
+        crypto_df['price'] = crypto_df['price'].astype(cb.MINUTE_PRICE_DTYPE)
+    else:
+        crypto_df = synthetic_backtest_data(parameters['bars'], seed=seed)
+
+    if kind == "backtest":
+        if parameters['strategy'] == "simple moving average crossover":
+            run = lambda: cb.sma_crossover_backtester(crypto_df, 1, 20, 100, 10000, False,
+                                                      parameters['shorting_allowed'], parameters['fixed_fee'], False,
+                                                      False, parameters['annual_taxes'], 0.3, 0.001,
+                                                      engine=parameters['engine'],
+                                                      bar_minutes=parameters['bar_minutes'])
+        else:
+            run = lambda: cb.mean_reversion_backtester(crypto_df, 1, 100, 10000, 0.02, 0.02, 0.05,
+                                                       parameters['shorting_allowed'], parameters['fixed_fee'], False,
+                                                       False, False, parameters['annual_taxes'], 0.3, 0.001,
+                                                       engine=parameters['engine'],
+                                                       bar_minutes=parameters['bar_minutes'])
+        return run, parameters['bars']
+
+    if kind == "sweep":
+        run = lambda: cb.run_multiple_backtests(False, parameters['num_runs'], True, crypto_df, parameters['strategy'],
+                                                sampler="sobol", seed=seed, max_workers=parameters['workers'])
+        return run, parameters['bars'] * parameters['num_runs']
+
+    raise Exception("Error:", kind, "is not a valid benchmark kind.")
+
+
+def run_benchmark(name, parameters, seed, repeats, connection):
+    """
+    Run one benchmark in this (fresh) process and send its measurements over connection.
+    """
+    warnings.simplefilter("ignore")
+    directory = tempfile.mkdtemp(prefix="crypto_backtesting_benchmark_")
+    try:
+        run, bars = setup_benchmark(parameters, seed, directory)
+        times = []
+        for x in range(repeats):
+            start_time = time.perf_counter()
+            output = run()
+            times.append(time.perf_counter() - start_time)
+            # the backtesters report invalid input by returning a message
+            if isinstance(output, str):
+                raise Exception(output)
+
+        best = min(times)
+        connection.send({
+            "name": name,
+            "parameters": parameters,
+            "repeats": repeats,
+            "wall_seconds": times,
+            "best_seconds": best,
+            "median_seconds": float(np.median(times)),
+            "bars": bars,
+            "bars_per_second": bars / best if best > 0 else None,
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT,
+            "peak_children_rss_bytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * RSS_UNIT
+        })
+    except Exception as error:
+        connection.send({"name": name, "parameters": parameters, "error": repr(error)})
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        connection.close()
+
+
+def benchmark_environment():
+    """
+    Commit, package versions and machine the benchmarks ran on.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPOSITORY, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPOSITORY,
+                               capture_output=True, text=True).stdout.strip() != ""
+    except OSError:
+        commit, dirty = None, None
+
+    return {
+        "commit": commit or None,
+        "dirty": dirty,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def run_benchmarks(output_path=None, quick=False, repeats=3, seed=0, name_filter=None, verbose=True):
+    """
+    Run the benchmarks (each one in a fresh process) and write the results as JSON.
+
+    Arguments:
+        output_path: JSON file to write, default = None (only return the results)
+        quick: smaller datasets and sweeps, default = False
+        repeats: how many times every benchmark runs, default = 3
+        seed: seed of the synthetic data, default = 0
+        name_filter: only run the benchmarks with this in their name, default = None (all of them)
+        verbose: print every result as it comes in, default = True
+    Returns:
+        results: dictionary with the 'environment' and the list of 'benchmarks'
+    """
+    context = multiprocessing.get_context("spawn")
+    results = {"format_version": BENCHMARK_FORMAT_VERSION, "environment": benchmark_environment(), "quick": quick,
+               "seed": seed, "benchmarks": []}
+
+    for name, parameters in benchmark_cases(quick):
+        if name_filter is not None and name_filter not in name:
+            continue
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_benchmark, args=(name, parameters, seed, repeats, sender))
+        process.start()
+        sender.close()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = {"name": name, "parameters": parameters, "error": "benchmark process exited with code " + str(process.exitcode)}
+        process.join()
+        results['benchmarks'].append(result)
+
+        if verbose:
+            if "error" in result:
+                print("{:<75} failed: {}".format(name, result['error']))
+            else:
+                print("{:<75} {:>9.4f} s {:>14,.0f} bars/s {:>8.1f} MB".format(name, result['best_seconds'],
+                                                                           result['bars_per_second'],
+                                                                           result['peak_rss_bytes'] / 2**20))
+
+    if output_path is not None:
+        with open(output_path, "w") as handle:
+            json.dump(results, handle, indent=2)
+
+    return results
+
+
+def compare_benchmarks(baseline, results, threshold=0.1):
+    """
+    Compare the best times of two benchmark runs.
+
+    Arguments:
+        baseline, results: results dictionaries (see run_benchmarks()) or paths of their JSON files
+        threshold: relative change below which a benchmark counts as unchanged, default = 0.1
+    Returns:
+        comparison: pandas dataframe with one row per benchmark in both, the 'baseline_seconds', 'seconds',
+            their 'ratio' (above 1 is slower) and a 'change' of "slower", "faster" or "unchanged"
+    """
+    runs = []
+    for run in [baseline, results]:
+        if isinstance(run, str):
+            with open(run) as handle:
+                run = json.load(handle)
+        runs.append({benchmark['name']: benchmark for benchmark in run['benchmarks'] if "error" not in benchmark})
+
+    rows = []
+    for name, benchmark in runs[1].items():
+        if name not in runs[0]:
+            continue
+        ratio = benchmark['best_seconds'] / runs[0][name]['best_seconds']
+        if ratio > 1 + threshold:
+            change = "slower"
+        elif ratio < 1 / (1 + threshold):
+            change = "faster"
+        else:
+            change = "unchanged"
+        rows.append({"name": name, "baseline_seconds": runs[0][name]['best_seconds'],
+                     "seconds": benchmark['best_seconds'], "ratio": ratio, "change": change})
+
+    comparison = pd.DataFrame(rows, columns=["name", "baseline_seconds", "seconds", "ratio", "change"])
+
+    return comparison
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark crypto_backtesting on synthetic data.")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file to write the results to")
+    parser.add_argument("--quick", action="store_true", help="smaller datasets and sweeps")
+    parser.add_argument("--repeats", type=int, default=3, help="runs of every benchmark, the best one counts")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--filter", default=None, help="only run benchmarks with this in their name")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change that counts as a regression")
+    arguments = parser.parse_args(arguments)
+
+    results = run_benchmarks(arguments.output, arguments.quick, arguments.repeats, arguments.seed, arguments.filter)
+
+    if arguments.compare is not None:
+        comparison = compare_benchmarks(arguments.compare, results, arguments.threshold)
+        with pd.option_context("display.width", 200, "display.max_rows", None, "display.max_colwidth", 80):
+            print(comparison.to_string(index=False))
+        if (comparison['change'] == "slower").any():
+            return 1
+
+    return 0
@@ -0,0 +1,170 @@
+"""
+Seeded synthetic bitcoin-like price data for the benchmarks: OHLCV bars of any length and resolution, backtest
+ready dataframes, and files in the formats get_bitcoin_data() reads.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import crypto_backtesting as cb
+
+# volatility of one hour of returns, about what bitcoin showed from 2019 to 2023
+HOURLY_VOLATILITY = 0.008
+
+# share of bars left out, like the gaps in the real data (about 10 of 36,000 hours from 2019 to 2023)
+GAP_FRACTION = 0.0003
+
+BAR_MINUTES = {"h": 60, "min": 1}
+
+
+def synthetic_ohlcv(bars, freq="h", start="2014-01-01", seed=0, start_price=500.0, volatility=None, drift=0.0,
+                    gap_fraction=GAP_FRACTION):
+    """
+    Random walk OHLCV bars with volatility clustering (a slowly wandering log volatility), so strategies see
+    calm and wild stretches like they do on real prices. The same arguments always give the same bars.
+
+    Arguments:
+        bars: number of bars
+        freq: "h" for hourly or "min" for minute bars, default = "h"
+        start: timestamp of the first bar, default = "2014-01-01"
+        seed: seed of the random generator, default = 0
+        start_price: open of the first bar, default = 500.0
+        volatility: standard deviation of the log return of one bar, default = None (HOURLY_VOLATILITY scaled
+            to the bar length)
+        drift: mean log return of one bar, default = 0.0
+        gap_fraction: share of the bars that are left out, default = GAP_FRACTION
+    Returns:
+        ohlcv: pandas dataframe with columns 'timestamp', 'open', 'high', 'low', 'close', 'volume'
+    """
+    if freq not in BAR_MINUTES:
+        raise Exception("Error:", freq, "is not valid, please select either 'h' or 'min'.")
+    if volatility is None:
+        volatility = HOURLY_VOLATILITY * np.sqrt(BAR_MINUTES[freq] / 60)
+
+    rng = np.random.default_rng(seed)
+
+    # log volatility follows a slow AR(1) process around 0
+    persistence = 1 - 1 / (24 * 60 / BAR_MINUTES[freq])
+    shocks = rng.normal(0, np.sqrt(1 - persistence**2) * 0.5, bars)
+    log_volatility = np.empty(bars)
+    level = 0.0
+    for x in range(bars):
+        level = persistence * level + shocks[x]
+        log_volatility[x] = level
+    bar_volatility = volatility * np.exp(log_volatility)
+
+    returns = drift + bar_volatility * rng.standard_normal(bars)
+    close = start_price * np.exp(np.cumsum(returns))
+    open_prices = np.r_[start_price, close[:-1]]
+    high = np.maximum(open_prices, close) * np.exp(np.abs(rng.normal(0, bar_volatility / 2)))
+    low = np.minimum(open_prices, close) * np.exp(-np.abs(rng.normal(0, bar_volatility / 2)))
+    # busier markets trade more
+    volume = close * rng.lognormal(np.log(50), 0.5, bars) * (1 + np.abs(returns) / volatility) * BAR_MINUTES[freq] / 60
+
+    ohlcv = pd.DataFrame({
+        "timestamp": pd.date_range(start, periods=bars, freq=freq),
+        "open": open_prices.round(2),
+        "high": high.round(2),
+        "low": low.round(2),
+        "close": close.round(2),
+        "volume": volume.round(2)
+    })
+    if gap_fraction > 0:
+        ohlcv = ohlcv[rng.random(bars) >= gap_fraction].reset_index(drop=True)
+
+    return ohlcv
+
+
+def synthetic_backtest_data(bars, freq="h", start="2019-01-01", seed=0):
+    """
+    Synthetic dataframe laid out like the notebooks prepare get_bitcoin_data()'s output for the backtesters:
+    one row per bar (gaps are rows with NaN prices), a 'quarter' column, and the open as the 'price'.
+
+    Arguments:
+        bars: number of bars
+        freq: "h" or "min", default = "h"
+        start: timestamp of the first bar, default = "2019-01-01"
+        seed: seed of the random generator, default = 0
+    Returns:
+        crypto_df: pandas dataframe with 'timestamp', OHLCV, 'quarter' and 'price' columns
+    """
+    ohlcv = synthetic_ohlcv(bars, freq, start, seed)
+    timestamps = pd.date_range(start, periods=bars, freq=freq)
+    crypto_df = ohlcv.set_index("timestamp").reindex(timestamps).rename_axis("timestamp").reset_index()
+    crypto_df = cb.add_quarter_annotation(crypto_df)
+    crypto_df['price'] = crypto_df['open']
+
+    return crypto_df
+
+
+def write_minute_file(ohlcv, path):
+    """
+    Write minute bars as a Bitfinex minute file (epoch ms, open, close, high, low, volume, no header).
+    """
+    minute_file = pd.DataFrame({
+        "time": ohlcv['timestamp'].to_numpy().astype("datetime64[ms]").astype(np.int64),
+        "open": ohlcv['open'],
+        "close": ohlcv['close'],
+        "high": ohlcv['high'],
+        "low": ohlcv['low'],
+        "volume": ohlcv['volume']
+    })
+    minute_file.to_csv(path, header=False, index=False)
+
+
+def write_hourly_file(ohlcv, path):
+    """
+    Write hourly bars as a CryptoDataDownload csv (a banner line, a header, newest bar first).
+    """
+    hourly_file = pd.DataFrame({
+        "unix": ohlcv['timestamp'].to_numpy().astype("datetime64[ms]").astype(np.int64),
+        "date": ohlcv['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+        "symbol": "BTC/USD",
+        "open": ohlcv['open'],
+        "high": ohlcv['high'],
+        "low": ohlcv['low'],
+        "close": ohlcv['close'],
+        "Volume USD": ohlcv['volume'],
+        "Volume BTC": (ohlcv['volume'] / ohlcv['close']).round(8)
+    }).iloc[::-1]
+
+    with open(path, "w") as handle:
+        handle.write("https://www.CryptoDataDownload.com\n")
+        hourly_file.to_csv(handle, index=False)
+
+
+def write_bitcoin_data_directory(directory, seed=0, minute_days_per_year=365, hourly_start="2018-01-01",
+                                 hourly_end="2024-01-01"):
+    """
+    Fill directory with synthetic price files named like the ones get_bitcoin_data() reads: a minute file
+    for every year in MINUTE_DATA_YEARS and the hourly csv, continuing one random walk.
+
+    Arguments:
+        directory: where to write the files (used as BITCOIN_DATA_DIRECTORY)
+        seed: seed of the random generator, default = 0
+        minute_days_per_year: how many days of minute bars to write per year (from January 1st), fewer
+            makes smaller files, default = 365
+        hourly_start, hourly_end: range of the hourly file, default = 2018 to 2023
+    Returns:
+        paths: list of the files written
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    price = 500.0
+    for offset, year in enumerate(cb.MINUTE_DATA_YEARS):
+        minutes = minute_days_per_year * 24 * 60
+        ohlcv = synthetic_ohlcv(minutes, "min", str(year) + "-01-01", seed + offset, start_price=price)
+        price = ohlcv['close'].iloc[-1]
+        path = os.path.join(directory, str(year) + ".txt")
+        write_minute_file(ohlcv, path)
+        paths.append(path)
+
+    hours = int((pd.Timestamp(hourly_end) - pd.Timestamp(hourly_start)) / pd.Timedelta(hours=1))
+    ohlcv = synthetic_ohlcv(hours, "h", hourly_start, seed + len(cb.MINUTE_DATA_YEARS), start_price=price)
+    path = os.path.join(directory, cb.HOURLY_DATA_FILE)
+    write_hourly_file(ohlcv, path)
+    paths.append(path)
+
+    return paths
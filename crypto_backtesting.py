@@ -1,11 +1,29 @@
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import math
+import os
+import pickle
 import random
+import shutil
+import sqlite3
+import queue
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import warnings
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 import statistics 
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import Process
+from multiprocessing.managers import BaseManager, DictProxy
+from bisect import bisect_left
+from collections import OrderedDict, deque
 
 def merge_and_convert_to_hourly(minute_data, hourly_data):
     # Convert timestamp column to datetime format
@@ -22,7 +40,8 @@ def merge_and_convert_to_hourly(minute_data, hourly_data):
     latest_minute_timestamp = minute_data['timestamp'].max()
 
     # Filter hourly_data to only include data from after the latest timestamp in minute_data
-    hourly_data = hourly_data[hourly_data['timestamp'] > latest_minute_timestamp]
+    if pd.notna(latest_minute_timestamp):
+        hourly_data = hourly_data[hourly_data['timestamp'] > latest_minute_timestamp]
 
     # Combine the two dataframes
     combined_data = pd.concat([minute_data, hourly_data])
@@ -50,34 +69,550 @@ def merge_and_convert_to_hourly(minute_data, hourly_data):
 
     return combined_data
 
-def add_quarter_annotation(crypto_df):
-    # add quarters to the data
+# how many minute rows to hold in memory at once while streaming a minute file
+MINUTE_DATA_CHUNKSIZE = 500000
+
+MILLISECONDS_PER_HOUR = 3600000
+MILLISECONDS_PER_MINUTE = 60000
 
-    # Make sure the 'Datetime' column is in datetime format
-    crypto_df['Datetime'] = pd.to_datetime(crypto_df['timestamp'])
 
-    # Calculate the start date and year of the first entry
-    start_date = crypto_df['Datetime'].min()
-    start_year = start_date.year
+def aggregate_minute_chunk(timestamps, open_prices, close_prices, high_prices, low_prices, volumes):
+    """
+    Collapse a chunk of minute bars into one partial hourly bar per hour.
 
-    # Create a function to calculate the quarter
-    def calculate_quarter(row):
-        months_passed = (row['Datetime'].year - start_year) * 12 + row['Datetime'].month - start_date.month
-        return (months_passed // 3) + 1
+    Besides the OHLCV values every partial bar keeps the timestamps of its first and last minute, so partial
+    bars of the same hour coming from different chunks (or files) can be combined later on.
+
+    Arguments:
+        timestamps: int64 numpy array of epoch milliseconds (in any order)
+        open_prices, close_prices, high_prices, low_prices, volumes: float64 numpy arrays
+    Returns:
+        partial_bars: dict of numpy arrays 'hour', 'first_timestamp', 'last_timestamp', 'open', 'high',
+            'low', 'close', 'volume' sorted by hour
+    """
+    order = np.argsort(timestamps, kind="stable")
+    timestamps = timestamps[order]
+    hours = timestamps // MILLISECONDS_PER_HOUR
+
+    starts = np.flatnonzero(np.r_[True, hours[1:] != hours[:-1]])
+    ends = np.r_[starts[1:], len(hours)] - 1
+
+    partial_bars = {
+        "hour": hours[starts],
+        "first_timestamp": timestamps[starts],
+        "last_timestamp": timestamps[ends],
+        "open": open_prices[order][starts],
+        "high": np.fmax.reduceat(high_prices[order], starts),
+        "low": np.fmin.reduceat(low_prices[order], starts),
+        "close": close_prices[order][ends],
+        "volume": np.add.reduceat(volumes[order], starts)
+    }
+
+    return partial_bars
+
+
+def combine_partial_bars(partial_bars):
+    """
+    Combine partial hourly bars of the same hour, the open comes from the partial bar that starts first and
+    the close from the one that ends last.
+
+    Arguments:
+        partial_bars: list of dicts generated by aggregate_minute_chunk() or combine_partial_bars()
+    Returns:
+        partial_bars: a single dict in the same format with one bar per hour
+    """
+    combined = {column: np.concatenate([bars[column] for bars in partial_bars]) for column in partial_bars[0]}
+
+    # both orders group the bars by hour, the first puts the earliest start first, the second the latest end last
+    by_start = np.lexsort((combined['first_timestamp'], combined['hour']))
+    by_end = np.lexsort((combined['last_timestamp'], combined['hour']))
+
+    hours = combined['hour'][by_start]
+    starts = np.flatnonzero(np.r_[True, hours[1:] != hours[:-1]])
+    ends = np.r_[starts[1:], len(hours)] - 1
+
+    return {
+        "hour": hours[starts],
+        "first_timestamp": combined['first_timestamp'][by_start][starts],
+        "last_timestamp": combined['last_timestamp'][by_end][ends],
+        "open": combined['open'][by_start][starts],
+        "high": np.fmax.reduceat(combined['high'][by_start], starts),
+        "low": np.fmin.reduceat(combined['low'][by_start], starts),
+        "close": combined['close'][by_end][ends],
+        "volume": np.add.reduceat(combined['volume'][by_start], starts)
+    }
+
+
+def read_minute_chunks(paths, chunksize=MINUTE_DATA_CHUNKSIZE, byte_ranges=None):
+    """
+    Read 1 minute Bitfinex files (epoch ms, open, close, high, low, volume, no header) chunksize rows at a time.
+
+    Arguments:
+        paths: list of minute data files
+        chunksize: number of rows to read at a time
+        byte_ranges: optional list with, for every path, a list of (start, end) byte ranges to read instead of
+            the whole file (None reads the whole file)
+    Yields:
+        chunk: pandas dataframe with int64 column 0 (epoch ms) and float64 columns 1 to 5
+    """
+    sources = []
+    for i, path in enumerate(paths):
+        if byte_ranges is None or byte_ranges[i] is None:
+            sources.append((path, None, None))
+        else:
+            sources.extend([(path, start, end) for start, end in byte_ranges[i]])
+
+    for path, start, end in sources:
+        if start is None:
+            handle = open(path, "rb")
+        else:
+            handle = io.BufferedReader(ByteRangeReader(path, start, end))
+
+        with handle:
+            chunks = pd.read_csv(handle, header=None, usecols=[0, 1, 2, 3, 4, 5], chunksize=chunksize,
+                                 dtype={0: np.int64, 1: np.float64, 2: np.float64, 3: np.float64, 4: np.float64, 5: np.float64})
+            for chunk in chunks:
+                if len(chunk) > 0:
+                    yield chunk
+
+
+def stream_minute_data_to_hourly(paths, chunksize=MINUTE_DATA_CHUNKSIZE, byte_ranges=None):
+    """
+    Read 1 minute Bitfinex files (epoch ms, open, close, high, low, volume, no header) in chunks and fold
+    them into hourly OHLCV bars, so memory use depends on the chunk size rather than the length of the history.
+
+    Rows may be in any order within and across files, an hour that is split across chunks or files is
+    combined correctly (first open, highest high, lowest low, last close, total volume).
+
+    Arguments:
+        paths: list of minute data files
+        chunksize: number of rows to read at a time
+        byte_ranges: optional list with, for every path, a list of (start, end) byte ranges to read instead of
+            the whole file (None reads the whole file)
+    Returns:
+        hourly_data: pandas dataframe with columns 'timestamp', 'open', 'high', 'low', 'close', 'volume'
+            with one row per hour that has minute data
+    """
+    hourly_bars = []
+    for chunk in read_minute_chunks(paths, chunksize, byte_ranges):
+        partial_bars = aggregate_minute_chunk(chunk[0].to_numpy(), chunk[1].to_numpy(), chunk[2].to_numpy(),
+                                              chunk[3].to_numpy(), chunk[4].to_numpy(), chunk[5].to_numpy())
+
+        # keep the running aggregate to (about) one bar per hour
+        hourly_bars = [combine_partial_bars(hourly_bars + [partial_bars])]
+
+    columns = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+    if not hourly_bars:
+        hourly_data = pd.DataFrame({column: np.array([], dtype=np.float64) for column in columns})
+        hourly_data['timestamp'] = hourly_data['timestamp'].astype("datetime64[ns]")
+        return hourly_data
+
+    bars = hourly_bars[0]
+    hourly_data = pd.DataFrame({
+        "timestamp": pd.to_datetime(bars['hour']*MILLISECONDS_PER_HOUR, unit="ms"),
+        "open": bars['open'],
+        "high": bars['high'],
+        "low": bars['low'],
+        "close": bars['close'],
+        "volume": bars['volume']
+    }, columns=columns)
+
+    return hourly_data
+
+
+def find_change_bars(values, initial=None):
+    """
+    Find the bars where a value differs from the one on the bar before it.
+
+    Arguments:
+        values: numpy array (quarters, years, ...)
+        initial: value the first bar is compared against, if None the first bar never counts as a change
+    Returns:
+        list of bar indices
+    """
+    change_bars = (np.flatnonzero(values[1:] != values[:-1]) + 1).tolist()
+    if initial is not None and len(values) > 0 and values[0] != initial:
+        change_bars.insert(0, 0)
+
+    return change_bars
+
+
+def build_calendar_index(timestamps):
+    """
+    Compute the year, month and quarter of every bar in one vectorized pass, along with the bars where each
+    year, month and quarter starts.
+
+    Quarters are three month blocks numbered from 1, counted from the month of the earliest timestamp
+    (so they only line up with calendar quarters if the data starts in January, April, July or October).
+
+    Arguments:
+        timestamps: datetime64 values (numpy array, pandas series or index)
+    Returns:
+        calendar: dict with int64 arrays 'year', 'month' and 'quarter', and lists 'year_starts',
+            'month_starts' and 'quarter_starts' of the bars where a new one begins (bar 0 is not included)
+    """
+    # months since January 1970
+    months = np.asarray(timestamps, dtype="datetime64[ns]").astype("datetime64[M]").astype(np.int64)
+
+    year = months // 12 + 1970
+    month = months % 12 + 1
+    if len(months) > 0:
+        quarter = (months - months.min()) // 3 + 1
+    else:
+        quarter = months.copy()
+
+    calendar = {
+        "year": year,
+        "month": month,
+        "quarter": quarter,
+        "year_starts": find_change_bars(year),
+        "month_starts": find_change_bars(months),
+        "quarter_starts": find_change_bars(quarter)
+    }
+
+    return calendar
+
+
+def add_quarter_annotation(crypto_df):
+    # add quarters to the data (see build_calendar_index() for how they are numbered)
+    crypto_df['quarter'] = build_calendar_index(pd.to_datetime(crypto_df['timestamp']))['quarter']
 
-    # Apply the function to create the 'quarter' column
-    crypto_df['quarter'] = crypto_df.apply(calculate_quarter, axis=1)
-    
-    # make sure the quarter assignments look right...
     return crypto_df
 
 
-def get_bitcoin_data(years):
+# where get_bitcoin_data() reads its price data from and keeps its cache
+BITCOIN_DATA_DIRECTORY = "BTC_1min_bitfinex"
+BITCOIN_CACHE_DIRECTORY = os.path.join(BITCOIN_DATA_DIRECTORY, "cache")
+
+# minute data from 2014 to 2019 and hourly data from 2018 to 2023
+MINUTE_DATA_YEARS = [2014, 2015, 2016, 2017, 2018, 2019]
+HOURLY_DATA_FILE = "2018_2023.csv"
+
+# minute data is only used before this year, the hourly data covers the rest
+MINUTE_DATA_END_YEAR = 2019
+
+# bump this when the layout of the cached data changes
+BITCOIN_CACHE_VERSION = 5
+
+
+def file_fingerprint(path, previous_fingerprint=None):
+    """
+    Describe a source file by its size, modification time and sha256 hash.
+
+    Arguments:
+        path: path of the file
+        previous_fingerprint: fingerprint stored earlier, if the size and modification time still match
+            its hash is reused instead of reading the whole file again
+    Returns:
+        fingerprint: dict with 'path', 'size', 'mtime' and 'sha256'
+    """
+    stat = os.stat(path)
+
+    if previous_fingerprint is not None and previous_fingerprint['size'] == stat.st_size \
+            and previous_fingerprint['mtime'] == stat.st_mtime_ns:
+        return previous_fingerprint
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+
+    return {"path": path, "size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": sha256.hexdigest()}
+
+
+def read_bitcoin_data_cache(cache_path, source_files, copy=True):
+    """
+    Load a cached get_bitcoin_data() result if none of its source files changed since it was written.
+
+    The columns are stored as .npy files and memory-mapped, so a warm start does not parse any text.
+
+    Arguments:
+        cache_path: directory of the cache entry
+        source_files: paths of the files the cached data was built from
+        copy: load the columns into memory, otherwise the dataframe keeps reading them from the memory-mapped
+            (read-only) files, default = True
+    Returns:
+        crypto_df: pandas dataframe of price data, or None if there is no valid cache entry
+    """
+    manifest_path = os.path.join(cache_path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    if manifest.get("version") != BITCOIN_CACHE_VERSION:
+        return None
+    if [fingerprint['path'] for fingerprint in manifest['sources']] != list(source_files):
+        return None
+
+    # only files whose size or modification time changed get hashed again
+    fingerprints = []
+    for path, previous_fingerprint in zip(source_files, manifest['sources']):
+        if not os.path.exists(path):
+            return None
+        fingerprint = file_fingerprint(path, previous_fingerprint)
+        if fingerprint['sha256'] != previous_fingerprint['sha256']:
+            return None
+        fingerprints.append(fingerprint)
+
+    # a file was touched but not changed, remember the new modification time so it isn't hashed again
+    if fingerprints != manifest['sources']:
+        manifest['sources'] = fingerprints
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    columns = {}
+    for column in manifest['columns']:
+        columns[column] = np.load(os.path.join(cache_path, column + ".npy"), mmap_mode="r")
+    if manifest['index'] == "range":
+        index = pd.RangeIndex(len(columns[manifest['columns'][0]]) if columns else 0)
+    else:
+        index = pd.Index(np.load(os.path.join(cache_path, "index.npy"), mmap_mode="r"))
+
+    return pd.DataFrame(columns, index=index, copy=copy)
+
+
+def write_bitcoin_data_cache(cache_path, crypto_df, source_files, years):
+    """
+    Store a get_bitcoin_data() result as one .npy file per column plus a manifest of its source files.
+
+    Arguments:
+        cache_path: directory of the cache entry (replaced if it exists)
+        crypto_df: pandas dataframe of price data
+        source_files: paths of the files crypto_df was built from
+        years: list of years crypto_df covers
+    Returns:
+        None
+    """
+    # a 0 to n - 1 index (the usual one) isn't worth a file
+    default_index = crypto_df.index.equals(pd.RangeIndex(len(crypto_df)))
+    manifest = {
+        "version": BITCOIN_CACHE_VERSION,
+        "years": sorted(years),
+        "columns": list(crypto_df.columns),
+        "index": "range" if default_index else "index.npy",
+        "sources": [file_fingerprint(path) for path in source_files]
+    }
+
+    # write into a temporary directory first so a crash never leaves a half written entry behind
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temporary_path = tempfile.mkdtemp(prefix=".tmp_", dir=os.path.dirname(cache_path))
+    for column in crypto_df.columns:
+        np.save(os.path.join(temporary_path, column + ".npy"), crypto_df[column].to_numpy())
+    if not default_index:
+        np.save(os.path.join(temporary_path, "index.npy"), crypto_df.index.to_numpy())
+    with open(os.path.join(temporary_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(cache_path):
+        shutil.rmtree(cache_path)
+    os.replace(temporary_path, cache_path)
+
+
+class ByteRangeReader(io.RawIOBase):
+    """
+    Read-only file object over bytes [start, end) of a file, so pandas can parse part of a file without
+    reading the rest of it.
+    """
+
+    def __init__(self, path, start, end):
+        self.file = open(path, "rb")
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        size = self.file.readinto(memoryview(buffer)[:size])
+        self.remaining = self.remaining - size
+        return size
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def find_line_offsets(path, line_numbers):
+    """
+    Find the byte offset where each of the given (0-based) lines of a file starts.
+
+    Arguments:
+        path: path of the file
+        line_numbers: list of line numbers, a line number equal to the number of lines gives the file size
+    Returns:
+        offsets: dict of {line number: byte offset}
+    """
+    wanted = sorted(set(line_numbers))
+    offsets = {}
+    next_wanted = 0
+    lines_seen = 0
+    position = 0
+
+    with open(path, "rb") as f:
+        # line 0 starts at byte 0, every other line starts right after a newline
+        while next_wanted < len(wanted) and wanted[next_wanted] == 0:
+            offsets[0] = 0
+            next_wanted = next_wanted + 1
+
+        for block in iter(lambda: f.read(1 << 22), b""):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            while next_wanted < len(wanted) and wanted[next_wanted] - lines_seen <= len(newlines):
+                offsets[wanted[next_wanted]] = position + int(newlines[wanted[next_wanted] - lines_seen - 1]) + 1
+                next_wanted = next_wanted + 1
+            lines_seen = lines_seen + len(newlines)
+            position = position + len(block)
+
+    # the end of a file without a trailing newline
+    for line_number in wanted[next_wanted:]:
+        offsets[line_number] = position
+
+    return offsets
+
+
+def index_price_file(path, hourly_file):
+    """
+    Scan a price file once and record, for every year in it, its first and last timestamp and the byte range
+    its rows occupy, so later loads can read just the years they need.
+
+    Arguments:
+        path: path of the file
+        hourly_file: true for the CryptoDataDownload hourly csv (two header lines, 'date' column),
+            false for a Bitfinex minute file (no header, epoch ms in the first column)
+    Returns:
+        file_index: dict with 'size', 'mtime' and 'years', a dict of {year: {'first', 'last', 'start', 'end'}}
+            with timestamps in epoch ms and byte offsets. 'start' and 'end' are None if the rows of a year are
+            not stored next to each other (the whole file has to be read for it then).
+    """
+    stat = os.stat(path)
+    header_lines = 2 if hourly_file else 0
+
+    if hourly_file:
+        chunks = pd.read_csv(path, skiprows=[0], usecols=['date'], chunksize=MINUTE_DATA_CHUNKSIZE)
+    else:
+        chunks = pd.read_csv(path, header=None, usecols=[0], dtype={0: np.int64}, chunksize=MINUTE_DATA_CHUNKSIZE)
+
+    years = {}
+    row = 0
+    for chunk in chunks:
+        if hourly_file:
+            timestamps = pd.to_datetime(chunk['date'], format='%Y-%m-%d %H:%M:%S').to_numpy()
+        else:
+            timestamps = chunk[0].to_numpy().astype("datetime64[ms]")
+        chunk_years = timestamps.astype("datetime64[Y]").astype(np.int64) + 1970
+        milliseconds = timestamps.astype("datetime64[ms]").astype(np.int64)
+
+        for year in np.unique(chunk_years).tolist():
+            rows = np.flatnonzero(chunk_years == year)
+            entry = years.setdefault(year, {"first": None, "last": None, "first_row": None, "last_row": None, "rows": 0})
+            first = int(milliseconds[rows].min())
+            last = int(milliseconds[rows].max())
+            entry['first'] = first if entry['first'] is None else min(entry['first'], first)
+            entry['last'] = last if entry['last'] is None else max(entry['last'], last)
+            if entry['first_row'] is None:
+                entry['first_row'] = row + int(rows[0])
+            entry['last_row'] = row + int(rows[-1])
+            entry['rows'] = entry['rows'] + len(rows)
+        row = row + len(chunk)
+
+    # a year can only be read on its own if its rows are contiguous
+    line_numbers = []
+    for entry in years.values():
+        if entry['last_row'] - entry['first_row'] + 1 == entry['rows']:
+            line_numbers.extend([header_lines + entry['first_row'], header_lines + entry['last_row'] + 1])
+    offsets = find_line_offsets(path, line_numbers)
+
+    file_index = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "years": {}}
+    for year, entry in years.items():
+        contiguous = entry['last_row'] - entry['first_row'] + 1 == entry['rows']
+        file_index['years'][str(year)] = {
+            "first": entry['first'],
+            "last": entry['last'],
+            "start": offsets[header_lines + entry['first_row']] if contiguous else None,
+            "end": offsets[header_lines + entry['last_row'] + 1] if contiguous else None
+        }
+
+    return file_index
+
+
+def load_price_file_index(paths, hourly_paths, cache_directory=BITCOIN_CACHE_DIRECTORY, use_cache=True):
+    """
+    Get the year index of each price file, from the sidecar index in the cache directory if the file hasn't
+    changed since it was indexed, otherwise by scanning the file again (and updating the sidecar index).
+
+    Arguments:
+        paths: list of existing price files
+        hourly_paths: the subset of paths that are hourly csv files
+        cache_directory: where the sidecar index (file_index.json) is kept
+        use_cache: read and update the sidecar index, otherwise every file is scanned and nothing is written
+            (default = True)
+    Returns:
+        file_indexes: dict of {path: file_index} (see index_price_file())
+    """
+    index_path = os.path.join(cache_directory, "file_index.json")
+    stored = {}
+    if use_cache and os.path.exists(index_path):
+        with open(index_path) as f:
+            stored = json.load(f)
+        if stored.get("version") != BITCOIN_CACHE_VERSION:
+            stored = {}
+    stored_files = stored.get("files", {})
+
+    file_indexes = {}
+    changed = False
+    for path in paths:
+        stat = os.stat(path)
+        file_index = stored_files.get(path)
+        if file_index is None or file_index['size'] != stat.st_size or file_index['mtime'] != stat.st_mtime_ns:
+            file_index = index_price_file(path, path in hourly_paths)
+            changed = True
+        file_indexes[path] = file_index
+
+    if use_cache and changed:
+        stored_files.update(file_indexes)
+        os.makedirs(cache_directory, exist_ok=True)
+        with open(index_path, "w") as f:
+            json.dump({"version": BITCOIN_CACHE_VERSION, "files": stored_files}, f, indent=2)
+
+    return file_indexes
+
+
+def year_byte_ranges(file_index, years):
+    """
+    Byte ranges of a file that hold the given years.
+
+    Arguments:
+        file_index: dict generated by index_price_file()
+        years: list of years
+    Returns:
+        byte_ranges: list of (start, end) tuples (empty if the file has none of the years),
+            or None if the whole file has to be read
+    """
+    byte_ranges = []
+    for year in years:
+        entry = file_index['years'].get(str(year))
+        if entry is None:
+            continue
+        if entry['start'] is None:
+            return None
+        byte_ranges.append((entry['start'], entry['end']))
+
+    return sorted(byte_ranges)
+
+
+def get_bitcoin_data(years, use_cache=True, cache_directory=BITCOIN_CACHE_DIRECTORY):
     """
     Gets bitcoin price data for a set number of years
 
     Arguments:
         years: list of years 
+        use_cache: load the result from an on-disk cache if the source files haven't changed, and write it there
+            after parsing them otherwise (default = True)
+        cache_directory: where the cache is kept, default = BTC_1min_bitfinex/cache
     Returns:
         crypto_df: pandas dataframe of price data
     """
@@ -91,38 +626,94 @@ def get_bitcoin_data(years):
         if year not in valid_years:
             raise Exception(year, "is not available, please select a year from 2014-2023.")
 
-
-    # Load 1 min BTC data from 2013 to 2019
-
-    # handle minute data from 2014 to 2019
-    df2019 = pd.read_csv("BTC_1min_bitfinex/2019.txt", header=None)
-    df2018 = pd.read_csv("BTC_1min_bitfinex/2018.txt", header=None)
-    df2017 = pd.read_csv("BTC_1min_bitfinex/2017.txt", header=None)
-    df2016 = pd.read_csv("BTC_1min_bitfinex/2016.txt", header=None)
-    df2015 = pd.read_csv("BTC_1min_bitfinex/2015.txt", header=None)
-    df2014 = pd.read_csv("BTC_1min_bitfinex/2014.txt", header=None)
-
-    # handle hourly data from 2018 to 2023
-    df2018_2023 = pd.read_csv("BTC_1min_bitfinex/2018_2023.csv", skiprows=[0])
+    # only files that exist are used, the minute files aren't part of the repository
+    minute_files = [os.path.join(BITCOIN_DATA_DIRECTORY, str(year) + ".txt") for year in MINUTE_DATA_YEARS]
+    minute_files = [path for path in minute_files if os.path.exists(path)]
+    hourly_files = [path for path in [os.path.join(BITCOIN_DATA_DIRECTORY, HOURLY_DATA_FILE)] if os.path.exists(path)]
+    source_files = minute_files + hourly_files
+
+    if use_cache:
+        cache_path = os.path.join(cache_directory, "hourly_" + "_".join(str(year) for year in sorted(set(years))))
+        crypto_df = read_bitcoin_data_cache(cache_path, source_files)
+        if crypto_df is not None:
+            return crypto_df
+
+    # look up which years each file holds and where they are in the file
+    file_indexes = load_price_file_index(source_files, hourly_files, cache_directory, use_cache)
+
+    # the hourly data takes over after the last hour of minute data (over all minute files, not just the
+    # ones needed for these years, so the result is the same no matter which years are requested)
+    minute_years = [year for year in years if year < MINUTE_DATA_END_YEAR]
+    latest_minute_timestamp = None
+    for path in minute_files:
+        for year, entry in file_indexes[path]['years'].items():
+            if int(year) < MINUTE_DATA_END_YEAR and (latest_minute_timestamp is None or entry['last'] > latest_minute_timestamp):
+                latest_minute_timestamp = entry['last']
+    if latest_minute_timestamp is not None:
+        latest_minute_timestamp = pd.Timestamp(latest_minute_timestamp, unit="ms").floor('H')
+
+    # loading all years gives one row per hour from the first to the last hour of the files, so hours missing
+    # at the edges of the requested years still get a row if another file has data before or after them
+    first_timestamp = None
+    last_timestamp = None
+    for path in minute_files:
+        for year, entry in file_indexes[path]['years'].items():
+            if int(year) < MINUTE_DATA_END_YEAR:
+                first_timestamp = entry['first'] if first_timestamp is None else min(first_timestamp, entry['first'])
+                last_timestamp = entry['last'] if last_timestamp is None else max(last_timestamp, entry['last'])
+    for path in hourly_files:
+        for entry in file_indexes[path]['years'].values():
+            if latest_minute_timestamp is None or pd.Timestamp(entry['last'], unit="ms") > latest_minute_timestamp:
+                first_timestamp = entry['first'] if first_timestamp is None else min(first_timestamp, entry['first'])
+                last_timestamp = entry['last'] if last_timestamp is None else max(last_timestamp, entry['last'])
+
+    # Load 1 min BTC data from 2014 to 2019, folded into hourly bars a chunk at a time
+    # (removed 2013 data)
+    minute_paths = []
+    minute_byte_ranges = []
+    for path in minute_files:
+        byte_ranges = year_byte_ranges(file_indexes[path], minute_years)
+        if byte_ranges != []:
+            minute_paths.append(path)
+            minute_byte_ranges.append(byte_ranges)
+    crypto_df = stream_minute_data_to_hourly(minute_paths, byte_ranges=minute_byte_ranges)
+    crypto_df = crypto_df[crypto_df['timestamp'].dt.year.isin(minute_years)]
+
+    # handle hourly data from 2018 to 2023, only reading the years that are needed
+    hourly_frames = []
+    for path in hourly_files:
+        byte_ranges = year_byte_ranges(file_indexes[path], years)
+        if byte_ranges is None:
+            hourly_frames.append(pd.read_csv(path, skiprows=[0]))
+        elif byte_ranges:
+            with open(path) as f:
+                f.readline()
+                columns = f.readline().strip().split(",")
+            for start, end in byte_ranges:
+                with io.BufferedReader(ByteRangeReader(path, start, end)) as handle:
+                    hourly_frames.append(pd.read_csv(handle, header=None, names=columns))
+
+    if hourly_frames:
+        df2018_2023 = pd.concat(hourly_frames)
+    else:
+        df2018_2023 = pd.DataFrame(columns=['unix', 'date', 'symbol', 'open', 'high', 'low', 'close', 'Volume USD', 'Volume BTC'])
     df2018_2023['volume'] = df2018_2023['Volume USD']
-    df2018_2023['timestamp'] = df2018_2023['date']
+    df2018_2023['timestamp'] = pd.to_datetime(df2018_2023['date'], format='%Y-%m-%d %H:%M:%S')
     df2018_2023.drop(['unix', 'symbol', 'Volume BTC', 'Volume USD', 'date'], axis=1, inplace=True)
+    if latest_minute_timestamp is not None:
+        df2018_2023 = df2018_2023[df2018_2023['timestamp'] > latest_minute_timestamp]
 
-    # removed 2013 data
-    #df2013 = pd.read_csv("BTC_1min_bitfinex/2013.txt", header=None)
-    #frames = [df2013, df2014, df2015, df2016, df2017, df2018, df2019]
-
-    frames = [df2014, df2015, df2016, df2017, df2018, df2019]
-
-    crypto_df = pd.concat(frames)
-    crypto_df.rename(columns = {0: 'timestamp', 1: 'open', 2: 'close', 3: 'high', 4: 'low', 5: 'volume'}, inplace=True)
-
-    # Convert UTC timestamp to readable 
-    crypto_df['timestamp'] = [datetime.utcfromtimestamp(int(ts)/1000).strftime('%Y-%m-%d %H:%M:%S') for ts in crypto_df['timestamp']]
-
+    if len(crypto_df) == 0 and len(df2018_2023) == 0:
+        raise Exception("No price data available for", years, "in", BITCOIN_DATA_DIRECTORY)
 
     crypto_df = merge_and_convert_to_hourly(crypto_df, df2018_2023)
 
+    # hours without trades have no prices and no volume, like the ones merge_and_convert_to_hourly() adds
+    hours = pd.date_range(pd.Timestamp(first_timestamp, unit="ms").floor('h'),
+                          pd.Timestamp(last_timestamp, unit="ms").floor('h'), freq='h')
+    crypto_df = crypto_df.set_index('timestamp').reindex(hours).rename_axis('timestamp').reset_index()
+    crypto_df['volume'] = crypto_df['volume'].fillna(0)
+
     # fitler out, only select the dates that we want
 
     # Extract the year from the timestamp
@@ -134,11 +725,130 @@ def get_bitcoin_data(years):
     # Drop the 'year' column if you don't need it anymore
     filtered_crypto_df = filtered_crypto_df.drop(columns='year')
 
+    # warn about years that none of the available files cover
+    missing_years = sorted(set(years) - set(filtered_crypto_df['timestamp'].dt.year))
+    if missing_years:
+        warnings.warn("No price data available for " + ", ".join(str(year) for year in missing_years))
+
     # add quarter information to it
-    filtered_crypto_df = add_quarter_annotation(filtered_crypto_df)
+    filtered_crypto_df = add_quarter_annotation(filtered_crypto_df.reset_index(drop=True))
+
+    if use_cache:
+        write_bitcoin_data_cache(cache_path, filtered_crypto_df, source_files, years)
 
     return filtered_crypto_df
 
+
+# minute bars are held in these types, about 30 bytes per minute (5M minutes from 2014 to 2023 take 150 MB)
+MINUTE_PRICE_DTYPE = np.float32
+MINUTE_QUARTER_DTYPE = np.int16
+
+
+def get_bitcoin_minute_data(years, use_cache=True, cache_directory=BITCOIN_CACHE_DIRECTORY):
+    """
+    Gets bitcoin price data at 1 minute resolution for a set number of years, to backtest with bar_minutes=1.
+
+    Only years that have a minute file (BITCOIN_DATA_DIRECTORY/<year>.txt) can be loaded, the hourly csv has
+    nothing finer than hours. There is one row per minute from the first to the last minute of the data, a
+    minute without trades gets the close of the minute before as its prices and no volume (so the moving
+    averages aren't broken up by the many quiet minutes of the early years).
+
+    Prices and volumes are float32 and timestamps datetime64[ms] (int64 epoch milliseconds). With use_cache
+    the columns are memory-mapped from the cache, read-only, rather than loaded into memory.
+
+    Arguments:
+        years: list of years
+        use_cache: load the result from an on-disk cache if the source files haven't changed, and write it there
+            after parsing them otherwise (default = True)
+        cache_directory: where the cache is kept, default = BTC_1min_bitfinex/cache
+    Returns:
+        crypto_df: pandas dataframe with columns 'timestamp', 'open', 'high', 'low', 'close', 'volume' and 'quarter'
+    """
+
+    # validation step
+    valid_years = [2014, 2015, 2016, 2017, 2018, 2019, 2020, 2021, 2022, 2023]
+
+    if not years:
+        raise Exception("No years provided")
+    for year in years:
+        if year not in valid_years:
+            raise Exception(year, "is not available, please select a year from 2014-2023.")
+
+    # a year's rows can spill over into the file of the year next to it, so every minute file is a source
+    minute_files = [os.path.join(BITCOIN_DATA_DIRECTORY, str(year) + ".txt") for year in valid_years]
+    minute_files = [path for path in minute_files if os.path.exists(path)]
+
+    if use_cache:
+        cache_path = os.path.join(cache_directory, "minute_" + "_".join(str(year) for year in sorted(set(years))))
+        crypto_df = read_bitcoin_data_cache(cache_path, minute_files, copy=False)
+        if crypto_df is not None:
+            return crypto_df
+
+    # only read the years that are needed
+    file_indexes = load_price_file_index(minute_files, [], cache_directory, use_cache)
+    minute_paths = []
+    minute_byte_ranges = []
+    for path in minute_files:
+        byte_ranges = year_byte_ranges(file_indexes[path], years)
+        if byte_ranges != []:
+            minute_paths.append(path)
+            minute_byte_ranges.append(byte_ranges)
+
+    timestamps = []
+    prices = {column: [] for column in ["open", "close", "high", "low", "volume"]}
+    for chunk in read_minute_chunks(minute_paths, byte_ranges=minute_byte_ranges):
+        chunk_timestamps = chunk[0].to_numpy()
+        chunk_years = chunk_timestamps.astype("datetime64[ms]").astype("datetime64[Y]").astype(np.int64) + 1970
+        rows = np.isin(chunk_years, years)
+        timestamps.append(chunk_timestamps[rows])
+        for number, column in enumerate(prices, start=1):
+            prices[column].append(chunk[number].to_numpy()[rows].astype(MINUTE_PRICE_DTYPE))
+
+    minutes = np.concatenate(timestamps) // MILLISECONDS_PER_MINUTE if timestamps else np.zeros(0, dtype=np.int64)
+    if len(minutes) == 0:
+        raise Exception("No minute data available for", years, "in", BITCOIN_DATA_DIRECTORY)
+
+    # sort by time and keep the last row of a minute that is in the files more than once
+    order = np.argsort(minutes, kind="stable")
+    minutes = minutes[order]
+    last_rows = np.r_[minutes[1:] != minutes[:-1], True]
+    order = order[last_rows]
+    minutes = minutes[last_rows]
+
+    # one row per minute, the ones without trades take the close of the last minute that had them
+    bars = minutes - minutes[0]
+    count = int(bars[-1]) + 1
+    previous = np.full(count, -1, dtype=np.int64)
+    previous[bars] = np.arange(len(bars))
+    previous = np.maximum.accumulate(previous)
+    traded = np.zeros(count, dtype=bool)
+    traded[bars] = True
+
+    crypto_df = pd.DataFrame({"timestamp": ((minutes[0] + np.arange(count))*MILLISECONDS_PER_MINUTE).astype("datetime64[ms]")})
+    close = np.concatenate(prices['close'])[order][previous]
+    for column in ["open", "high", "low", "close", "volume"]:
+        if column == "close":
+            values = close
+        else:
+            values = np.where(traded, np.concatenate(prices[column])[order][previous], 0 if column == "volume" else close)
+        crypto_df[column] = values.astype(MINUTE_PRICE_DTYPE)
+
+    # the years in between the requested ones aren't part of it
+    crypto_df = crypto_df[crypto_df['timestamp'].dt.year.isin(years)].reset_index(drop=True)
+
+    # warn about years that none of the available files cover
+    missing_years = sorted(set(years) - set(crypto_df['timestamp'].dt.year))
+    if missing_years:
+        warnings.warn("No minute data available for " + ", ".join(str(year) for year in missing_years))
+
+    crypto_df['quarter'] = build_calendar_index(crypto_df['timestamp'])['quarter'].astype(MINUTE_QUARTER_DTYPE)
+
+    if use_cache:
+        write_bitcoin_data_cache(cache_path, crypto_df, minute_files, years)
+        crypto_df = read_bitcoin_data_cache(cache_path, minute_files, copy=False)
+
+    return crypto_df
+
 def plot_quarterly_data(backtest_results):
     '''
     Visualize quarterly data from a backtest run.
@@ -149,6 +859,9 @@ def plot_quarterly_data(backtest_results):
         None
     '''
 
+    # plotting is only imported when something is plotted, so sweeps and their workers never pay for it
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     from matplotlib import rcParams
     rcParams['figure.figsize'] = 15,8
     
@@ -187,115 +900,2045 @@ def plot_quarterly_data(backtest_results):
     plt.show()
 
 
-def mean_reversion_backtester(sampled_data, 
-                            order_sizing, 
-                            ma_length, 
-                            starting_capital,
-                            buy_threshold,
-                            take_profit,
-                            stop_loss,
-                            shorting_allowed,
-                            fixed_fee,
-                            display_results,
-                            record_balance,
-                            show_moving_averages,
-                            annual_taxes,
-                            tax_percentage = 0,
-                            fee=0
-                            ):
-    """ 
+# most points per series a balance plot draws, about two per horizontal pixel of a 15 inch wide figure
+PLOT_MAX_POINTS = 3000
+
+
+def min_max_plot_bars(columns, max_points=PLOT_MAX_POINTS):
+    '''
+    Pick the bars to draw of series too long to plot point by point: the series are split into max_points/2
+    buckets of consecutive bars, and the lowest and highest bar of every series in every bucket is kept (plus
+    the first and last bar). Every peak and trough stays in the plot, so the curve looks the same at the width
+    of a figure while the number of points no longer grows with the length of the history.
+
     Parameters:
-        sampled_data: pandas dataframe that must have columns 'timestamp' and 'price'
-        order_sizing: how much of available capital to use on a given trade (betwen 0 and 1)
-        ma_length: moving average length (in hours)
-        starting_capital: how much capital to start with (USD)
-        buy_threshold: at what % below the moving average to buy (if 5%, should be 0.05)
-        take_profit: at what % gain to sell and take the profit (if 5%, should be 0.05)
-        stop_loss: at what % to sell and stop losses (if 5%, should be 0.05)
-        shorting_allowed: whether or not to short or sell regularly (true or false)
-        fee: the % charged per transaction by the exchange (in %, so 0.01 = 1%)
-        record_balance: whether or not to track the balance over the whole period
-        show_moving_averages: whether or not to show the moving averages in the plot displayed (true or false)
-        annual_taxes: whether or not to take annual taxes on gains (true or false)
-        tax_percentage: if taxes are enabled, what % of taxes to pay on gains (0.01 = 1%), default = 0
+        columns: list of equally long numeric arrays (NaN bars are only kept if a whole bucket is NaN)
+        max_points: most bars kept for every series (the bars of all of them are drawn), default = PLOT_MAX_POINTS
     Returns:
-        backtest_results: dictionary that contains backtest result metrics and balance information 
-    """
-
-    # for figuring out how much a fee is
-    # we are taking the average of maker and taker fees on coinbase pro starting on 6/5/23
-    def find_fee(thirty_day_volume):
-        volume_fee_table = {
-            10000: 0.005,
-            50000: 0.00325,
-            100000: 0.002,
-            1000000: 0.0015,
-            15000000: 0.0013,
-            75000000: 0.0011,
-            250000000: 0.00075,
-            400000000: 0.0004,
-        }
-        
-        for volume, fee in volume_fee_table.items():
-            if thirty_day_volume <= volume:
-                return fee
-        
-        # If the volume is greater than the largest key, return the fee for the largest key
-        return volume_fee_table[400000000]
-    
-    
-    # Ensure inputs are valid
-    if "timestamp" not in sampled_data.columns:
-        return "Could not run ma_crossover_backtester(), 'timestamp' column missing from data."
-    if "price" not in sampled_data.columns:
-        return "Could not run ma_crossover_backtester(), 'price' column missing from data."
-    if starting_capital <= 0:
-        return "Could not run ma_crossover_backtester(), starting_capital must be greater than zero."
-    if order_sizing > 1 or order_sizing <= 0:
-        return "Could not run ma_crossover_backtester(), order_sizing must be between 1 and 0."
-    
-    
-    fiat = starting_capital
-    position_size = 0
-    baseline_position_size = 0
-    portfolio_balance = [] #keeps track of the total portfolio worth
-    baseline_balance = [] #keeps track of the buy and hold balance
-    moves = [] #keep track of buys and sells
-    trades = 0
-    purchase_price = 0
-    wins = 0
-    losses = 0
+        bars: sorted int64 array of the bars to draw
+    '''
+    n = len(columns[0]) if len(columns) > 0 else 0
+    if n <= max_points:
+        return np.arange(n, dtype=np.int64)
 
-    # setup for keeping track of quarterly results
-    three_month_hours = 2191
-    one_month_hours = 730 #actually 730.5 
-    quarter_numbers = []
-    quarter_return_rates = []
-    quarter_trades = []
-    quarter_hit_rates = []
-    baseline_return_rates = []
+    buckets = max(1, max_points // 2)
+    bucket_bars = -(-n // buckets)
+    padding = buckets*bucket_bars - n
 
-    monthly_return_rates = []
+    keep = [np.array([0, n - 1], dtype=np.int64)]
+    starts = np.arange(buckets, dtype=np.int64)*bucket_bars
+    for column in columns:
+        values = np.asarray(column, dtype=np.float64)
+        lowest = np.where(np.isnan(values), np.inf, values)
+        highest = np.where(np.isnan(values), -np.inf, values)
+        lowest = np.concatenate([lowest, np.full(padding, np.inf)]).reshape(buckets, bucket_bars)
+        highest = np.concatenate([highest, np.full(padding, -np.inf)]).reshape(buckets, bucket_bars)
+        keep.append(starts + lowest.argmin(axis=1))
+        keep.append(starts + highest.argmax(axis=1))
 
-    # calculate the total number of quarters in the dataset
-    total_quarters = max(list(sampled_data['quarter']))
-    # total_months = math.floor(len(sampled_data.index)/one_month_hours)
+    bars = np.unique(np.concatenate(keep))
 
-    # calculate quarter intervals
-    # quarter_intervals = [three_month_hours*x for x in range(0, total_quarters)]
-    # monthly_intervals = [one_month_hours*x for x in range(0, total_months)]
+    return bars[bars < n]
 
-    # convert to get the corresponding timestamps
-    # quarter_intervals = [crypto_df.iloc[x]['timestamp'] for x in quarter_intervals]
-    # monthly_intervals = [crypto_df.iloc[x]['timestamp'] for x in monthly_intervals]
-    
-    current_price = sampled_data['price'][0]
-    baseline_position_size = starting_capital/current_price
-    baseline_initial = current_price
 
-    ma = sampled_data.price.rolling(ma_length).mean()
+def plot_balance_data(balance_data, max_points=PLOT_MAX_POINTS):
+    '''
+    Visualize the balances recorded during a backtest run. Long histories are downsampled for drawing (see
+    min_max_plot_bars()), balance_data itself is left at full resolution.
 
-    #truncate the data so they all are aligned 
+    Parameters:
+        balance_data: dict of balance columns generated by the backtesters with record_balance=True
+        max_points: most bars drawn for every series, None draws every bar, default = PLOT_MAX_POINTS
+    Returns:
+        None
+    '''
+
+    import matplotlib.pyplot as plt
+    from matplotlib import rcParams
+    rcParams['figure.figsize'] = 15,8
+
+    if max_points is not None:
+        bars = min_max_plot_bars([values for name, values in balance_data.items() if name != "time"], max_points)
+        balance_data = {name: np.asarray(values)[bars] for name, values in balance_data.items()}
+
+    pd.DataFrame(balance_data).plot(x = "time")
+    plt.xticks(rotation="vertical")
+    plt.show()
+
+
+# thirty day trading volume (USD) -> fee, the fee applies up to and including that volume
+# we are taking the average of maker and taker fees on coinbase pro starting on 6/5/23
+VOLUME_FEE_TABLE = {
+    10000: 0.005,
+    50000: 0.00325,
+    100000: 0.002,
+    1000000: 0.0015,
+    15000000: 0.0013,
+    75000000: 0.0011,
+    250000000: 0.00075,
+    400000000: 0.0004,
+}
+
+
+class FeeSchedule:
+    """
+    Volume based fee tiers, looked up with a binary search over the sorted volume breakpoints.
+
+    Parameters:
+        fee_table: dict of {thirty day volume (USD): fee}, default = VOLUME_FEE_TABLE. Volumes above the
+            largest breakpoint pay the fee of the largest breakpoint.
+        window: how many bars the trading volume is summed over, default = 720 (thirty days of hourly bars)
+    """
+
+    def __init__(self, fee_table=None, window=720):
+        if fee_table is None:
+            fee_table = VOLUME_FEE_TABLE
+        if not fee_table:
+            raise Exception("fee_table must have at least one volume tier.")
+
+        self.breakpoints = sorted(fee_table)
+        self.fees = [fee_table[volume] for volume in self.breakpoints]
+        self.window = window
+
+    def find_fee(self, thirty_day_volume):
+        index = bisect_left(self.breakpoints, thirty_day_volume)
+
+        # If the volume is greater than the largest breakpoint, use the fee for the largest breakpoint
+        if index == len(self.breakpoints):
+            index = index - 1
+
+        return self.fees[index]
+
+    def for_bar_minutes(self, bar_minutes):
+        """
+        The same fee tiers with the window (in hourly bars) converted to bars of bar_minutes minutes.
+        """
+        return FeeSchedule(dict(zip(self.breakpoints, self.fees)), hours_to_bars(self.window, bar_minutes))
+
+
+# expiries between two full re-sums of a RollingVolume's total
+ROLLING_VOLUME_RESUM_EVERY = 1024
+
+
+class RollingVolume:
+    """
+    Trading volume over a rolling window of bars (the thirty day volume that fees are based on).
+
+    Trades are kept in a deque in the order they happened, keyed by the bar they happened on, so expiring
+    old trades only ever looks at the front of the deque. The total is a running (Kahan compensated) sum:
+    trades are added to it and expired trades subtracted from it, so a call costs O(1) amortized no matter
+    how many trades are in the window. Every `resum_every` expiries the live trades are summed again, so
+    rounding errors can't pile up over a long run (the total stays within a few ulps of the exact sum).
+
+    Parameters:
+        window: how many bars a trade counts towards the volume, default = 720 (thirty days of hourly bars)
+        resum_every: expiries between two full re-sums of the total, default = ROLLING_VOLUME_RESUM_EVERY
+    """
+
+    def __init__(self, window=720, resum_every=ROLLING_VOLUME_RESUM_EVERY):
+        self.window = window
+        self.resum_every = resum_every
+        self.entries = deque()
+        self.total = 0.0
+        self.compensation = 0.0
+        self.expiries = 0
+
+    def accumulate(self, amount):
+        # kahan summation, compensation holds the low order bits lost in the last addition
+        corrected = amount - self.compensation
+        total = self.total + corrected
+        self.compensation = (total - self.total) - corrected
+        self.total = total
+
+    def add(self, bar, amount):
+        self.entries.append((bar, amount))
+        self.accumulate(amount)
+
+    def volume(self, bar):
+        """
+        Volume of the trades made within `window` bars before `bar` (not counting trades on `bar` itself).
+        """
+        while self.entries and self.entries[0][0] < bar - self.window:
+            self.accumulate(-self.entries.popleft()[1])
+            self.expiries = self.expiries + 1
+
+            if self.expiries >= self.resum_every:
+                self.total = math.fsum([entry[1] for entry in self.entries])
+                self.compensation = 0.0
+                self.expiries = 0
+
+        # an empty window is exactly zero, not whatever rounding is left over
+        if not self.entries:
+            self.total = 0.0
+            self.compensation = 0.0
+
+        return self.total
+
+
+DEFAULT_FEE_SCHEDULE = FeeSchedule()
+
+# length of the bars (in minutes) that moving average lengths and fee windows are given in
+HOUR_MINUTES = 60
+
+
+def hours_to_bars(hours, bar_minutes):
+    """
+    Number of bar_minutes minute bars that span as much time as hours hourly bars (at least one, 0 stays 0).
+    """
+    if hours <= 0:
+        return hours
+
+    return max(1, int(round(hours*HOUR_MINUTES/bar_minutes)))
+
+
+class AbortCriteria:
+    """
+    Conditions that stop a backtest early, for sweeps where hopeless parameter sets don't need to run to the
+    last bar. A stopped run returns its results up to the bar it stopped on, flagged as aborted.
+
+    Parameters:
+        max_drawdown: stop once the portfolio is worth this much less than its highest value so far
+            (0.5 = 50% below the peak), default = None
+        min_equity: stop once the portfolio is worth less than this (USD), default = None
+        max_trades: stop once more than this many trades were made, default = None
+    """
+
+    def __init__(self, max_drawdown=None, min_equity=None, max_trades=None):
+        if max_drawdown is not None and (max_drawdown <= 0 or max_drawdown > 1):
+            raise Exception("max_drawdown must be between 0 and 1.")
+
+        self.max_drawdown = max_drawdown
+        self.min_equity = min_equity
+        self.max_trades = max_trades
+
+    def tracks_equity(self):
+        return self.max_drawdown is not None or self.min_equity is not None
+
+    def find_breach(self, equity, peak):
+        """
+        Find the first bar where the portfolio value breaks the drawdown or equity limit.
+
+        Arguments:
+            equity: float64 numpy array of portfolio values for consecutive bars
+            peak: highest portfolio value before the first of them
+        Returns:
+            index: position in equity of the first breach, None if there is none
+            reason: "max_drawdown" or "min_equity", None if there is no breach
+            peak: highest portfolio value up to the end of equity (NaN prices are skipped)
+        """
+        peaks = np.fmax(np.fmax.accumulate(equity), peak)
+
+        index = None
+        reason = None
+        if self.min_equity is not None:
+            breaches = np.flatnonzero(equity < self.min_equity)
+            if len(breaches) > 0:
+                index, reason = breaches[0], "min_equity"
+        if self.max_drawdown is not None:
+            breaches = np.flatnonzero(equity < peaks*(1 - self.max_drawdown))
+            if len(breaches) > 0 and (index is None or breaches[0] < index):
+                index, reason = breaches[0], "max_drawdown"
+
+        if index is not None:
+            index = int(index)
+
+        return index, reason, peaks[-1]
+
+
+def extract_backtest_arrays(sampled_data):
+    """
+    Pull the columns the backtesters walk over into contiguous numpy arrays.
+
+    Arguments:
+        sampled_data: pandas dataframe with 'timestamp', 'price' and 'quarter' columns
+    Returns:
+        price: float64 array of prices
+        quarter: int64 array of quarter numbers
+        timestamps: datetime64[ns] array of timestamps
+    """
+    price = np.ascontiguousarray(sampled_data['price'].to_numpy(dtype=np.float64))
+    quarter = np.ascontiguousarray(sampled_data['quarter'].to_numpy(dtype=np.int64))
+
+    timestamps = sampled_data['timestamp']
+    if not pd.api.types.is_datetime64_any_dtype(timestamps):
+        timestamps = pd.to_datetime(timestamps)
+    # the view drops the (empty) dtype metadata pandas attaches, which np.save warns about
+    timestamps = np.ascontiguousarray(timestamps.to_numpy(dtype="datetime64[ns]")).view("datetime64[ns]")
+
+    return price, quarter, timestamps
+
+
+def find_period_starts(quarter, timestamps, months=False):
+    """
+    Precompute the bars where quarters and years start.
+
+    Arguments:
+        quarter: int64 array of quarter numbers
+        timestamps: datetime64 array of timestamps
+        months: also return the bars where months start, default = False
+    Returns:
+        quarter_starts: list of bars where the quarter number changes (the first bar counts too unless
+            it is quarter 1, the backtesters always start out in quarter 1)
+        year_starts: list of bars where a new calendar year begins
+        month_starts: list of bars where a new calendar month begins (only when months is true)
+    """
+    calendar = build_calendar_index(timestamps)
+    if months:
+        return find_change_bars(quarter, 1), calendar['year_starts'], calendar['month_starts']
+
+    return find_change_bars(quarter, 1), calendar['year_starts']
+
+
+# besides a number of bars, the backtesters' balance_stride can record only the first bar of every month or quarter
+BALANCE_PERIODS = ["month", "quarter"]
+
+# types the backtesters can record the balance in, float32 takes half the memory and keeps about 7 significant digits
+BALANCE_DTYPES = ["float64", "float32"]
+
+# balance_data of a run that didn't record its balance
+NO_BALANCE_DATA = "Could not generate plot_data: record_balance was set to False."
+
+
+def valid_balance_stride(balance_stride):
+    """
+    Whether balance_stride is a positive number of bars or one of BALANCE_PERIODS.
+    """
+    if isinstance(balance_stride, str):
+        return balance_stride in BALANCE_PERIODS
+
+    return isinstance(balance_stride, (int, np.integer)) and not isinstance(balance_stride, bool) and balance_stride >= 1
+
+
+def find_balance_bars(balance_stride, quarter, timestamps, month_starts=None):
+    """
+    Find the bars a backtest records the balance of.
+
+    Arguments:
+        balance_stride: record every balance_stride-th bar, or only the first bar of every "month" or "quarter"
+        quarter: int64 array of quarter numbers
+        timestamps: datetime64 array of timestamps
+        month_starts: the bars where months start if they are already known (see find_period_starts()), default = None
+    Returns:
+        balance_bars: sorted int64 array of bars, starting with bar 0
+    """
+    if len(timestamps) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if balance_stride == "month":
+        starts = month_starts if month_starts is not None else build_calendar_index(timestamps)['month_starts']
+    elif balance_stride == "quarter":
+        starts = find_change_bars(np.asarray(quarter))
+    else:
+        return np.arange(0, len(timestamps), balance_stride, dtype=np.int64)
+
+    return np.asarray([0] + starts, dtype=np.int64)
+
+
+def find_period_change_bars(quarter, timestamps):
+    """
+    Find the bars where the quarter number and the calendar year change over the whole dataset, so the
+    period starts of any truncated copy of it can be looked up with offset_period_starts().
+
+    Arguments:
+        quarter: int64 array of quarter numbers
+        timestamps: datetime64 array of timestamps
+    Returns:
+        quarter_changes: int64 array of bars where the quarter number changes (bar 0 is not included)
+        year_changes: int64 array of bars where a new calendar year begins (bar 0 is not included)
+    """
+    quarter_changes = np.asarray(find_change_bars(quarter), dtype=np.int64)
+    year_changes = np.asarray(build_calendar_index(timestamps)['year_starts'], dtype=np.int64)
+
+    return quarter_changes, year_changes
+
+
+def offset_period_starts(quarter, quarter_changes, year_changes, offset):
+    """
+    Same as find_period_starts(quarter[offset:], timestamps[offset:]), but looked up in the change bars of the
+    whole dataset instead of scanning the truncated arrays again.
+
+    Arguments:
+        quarter: int64 array of quarter numbers
+        quarter_changes, year_changes: arrays generated by find_period_change_bars()
+        offset: how many bars are cut off the start
+    Returns:
+        quarter_starts, year_starts: lists of bars, relative to offset
+    """
+    quarter_starts = (quarter_changes[np.searchsorted(quarter_changes, offset, side='right'):] - offset).tolist()
+    year_starts = (year_changes[np.searchsorted(year_changes, offset, side='right'):] - offset).tolist()
+    if offset < len(quarter) and quarter[offset] != 1:
+        quarter_starts.insert(0, 0)
+
+    return quarter_starts, year_starts
+
+
+def dataset_fingerprint(price, quarter, timestamps):
+    """
+    sha256 of the arrays generated by extract_backtest_arrays(), identifies a dataset in stored results.
+    """
+    digest = hashlib.sha256()
+    for values in [price, quarter, timestamps]:
+        digest.update(np.ascontiguousarray(values).tobytes())
+
+    return digest.hexdigest()
+
+
+def moving_average(price, length):
+    """
+    Simple moving average of a price array, computed the same way as the backtesters' pandas rolling mean.
+
+    Arguments:
+        price: float64 numpy array of prices
+        length: moving average length (in bars)
+    Returns:
+        float64 numpy array (NaN for the first length - 1 bars)
+    """
+    return pd.Series(price).rolling(length).mean().to_numpy(dtype=np.float64)
+
+
+# default memory budget for the moving averages a MovingAverageCache keeps around, a sweep on a process pool
+# or a BacktestCluster splits it between its workers (see open_sweep_executor())
+MOVING_AVERAGE_CACHE_BYTES = 256 * 1024 * 1024
+
+
+class MovingAverageCache:
+    """
+    Serves simple moving averages of one price array. A prefix sum of the prices is computed once, after that
+    any length costs one subtraction and one division per bar instead of a pandas rolling window. The most
+    recently used averages are kept (least recently used first out) as long as they fit in max_bytes.
+
+    The prefix sum is accumulated in extended precision (np.longdouble) and kept as two float64 arrays (the
+    rounded sum and its rounding error), so the averages come out within about one ulp of exact. They agree
+    with pandas' rolling mean to within rounding (~1e-15 relative) but are not bit-identical to it, so a
+    crossover of two averages that are tied to within rounding can come out the other way. Windows that
+    contain a NaN price are NaN, like pandas.
+
+    Arguments:
+        price: float64 numpy array of prices
+        max_bytes: memory budget for the memoized averages, default = MOVING_AVERAGE_CACHE_BYTES
+    Safe to share between threads.
+    """
+
+    def __init__(self, price, max_bytes=MOVING_AVERAGE_CACHE_BYTES):
+        price = np.asarray(price, dtype=np.float64)
+        missing = np.isnan(price)
+
+        price_sums = np.concatenate([[0], np.cumsum(np.where(missing, 0, price), dtype=np.longdouble)])
+        self.price_sums = price_sums.astype(np.float64)
+        self.price_sum_errors = (price_sums - self.price_sums).astype(np.float64)
+        self.missing_counts = np.concatenate([[0], np.cumsum(missing, dtype=np.int64)]) if missing.any() else None
+
+        self.length = len(price)
+        self.max_bytes = max_bytes
+        self.averages = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def compute(self, length):
+        """
+        Moving average of the given length, without touching the memoized averages.
+        """
+        average = np.full(self.length, np.nan)
+        if length <= 0 or length > self.length:
+            return average
+
+        window_sums = self.price_sums[length:] - self.price_sums[:-length]
+        window_sums += self.price_sum_errors[length:] - self.price_sum_errors[:-length]
+        window_sums /= length
+        if self.missing_counts is not None:
+            window_sums[self.missing_counts[length:] != self.missing_counts[:-length]] = np.nan
+        average[length - 1:] = window_sums
+
+        return average
+
+    def get(self, length):
+        """
+        Moving average of the given length (NaN for the first length - 1 bars), as a read-only array.
+        """
+        with self.lock:
+            average = self.averages.get(length)
+            if average is not None:
+                self.hits += 1
+                self.averages.move_to_end(length)
+                return average
+            self.misses += 1
+
+        # computed outside the lock, so threads sharing the cache only wait on each other for the bookkeeping
+        average = self.compute(length)
+        average.setflags(write=False)
+
+        with self.lock:
+            if average.nbytes <= self.max_bytes and length not in self.averages:
+                self.averages[length] = average
+                self.cached_bytes += average.nbytes
+                while self.cached_bytes > self.max_bytes:
+                    evicted_length, evicted = self.averages.popitem(last=False)
+                    self.cached_bytes -= evicted.nbytes
+
+        return average
+
+
+# phases of an array engine backtest that a BacktestProfile times, in the order they come up
+PROFILE_PHASES = ["moving_averages", "period_starts", "signal_evaluation", "event_search", "balance_recording",
+                  "abort_checks", "tax_handling", "quarterly_bookkeeping", "volume_window", "fee_lookup",
+                  "trade_execution", "summary"]
+
+
+class BacktestProfile:
+    """
+    Time spent and calls made in every phase of array engine backtests (see PROFILE_PHASES), and the arrays and
+    buffers they allocated, for finding out where a slow sweep spends its time. Everything recorded into a
+    profile adds up, so one profile can cover a single run, a batch of runs or a whole sweep (see merge()).
+
+    Profiling is opt-in: the engine only checks whether it was handed a profile, it never calls the clock
+    when it wasn't.
+
+    Allocations are counted by name:
+        portfolio_balance, baseline_balance: the balance arrays of runs that record their balance
+        equity_segments: portfolio values computed for the bars between two events
+        volume_data: trades added to the rolling volume window that fees are based on
+        moving_averages: moving averages computed for a run (not the ones taken from a MovingAverageCache)
+    """
+
+    def __init__(self):
+        self.runs = 0
+        self.seconds = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.calls = dict.fromkeys(PROFILE_PHASES, 0)
+        self.allocations = {}
+        self.allocated_bytes = {}
+
+    def add(self, phase, seconds, calls=1):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def allocate(self, name, nbytes=0, count=1):
+        self.allocations[name] = self.allocations.get(name, 0) + count
+        self.allocated_bytes[name] = self.allocated_bytes.get(name, 0) + nbytes
+
+    def merge(self, profile):
+        """
+        Add another profile, or the dictionary its to_dict() made (what the backtesters return), to this one.
+        """
+        if isinstance(profile, BacktestProfile):
+            profile = profile.to_dict()
+
+        self.runs = self.runs + profile['runs']
+        for phase, timing in profile['phases'].items():
+            self.add(phase, timing['seconds'], timing['calls'])
+        for name, allocation in profile['allocations'].items():
+            self.allocate(name, allocation['bytes'], allocation['count'])
+
+    def to_dict(self):
+        """
+        Returns:
+            profile: dictionary of 'runs' (simulations recorded), 'seconds' (time spent in all phases),
+                'phases' (seconds, calls and share of the time of every phase that was called) and
+                'allocations' (count and bytes of every kind of allocation)
+        """
+        total_seconds = sum(self.seconds.values())
+        phases = {}
+        for phase, seconds in self.seconds.items():
+            if self.calls[phase] > 0:
+                phases[phase] = {"seconds": seconds, "calls": self.calls[phase],
+                                 "share": seconds/total_seconds if total_seconds > 0 else 0.0}
+
+        allocations = {name: {"count": count, "bytes": self.allocated_bytes[name]}
+                       for name, count in self.allocations.items()}
+
+        return {"runs": self.runs, "seconds": total_seconds, "phases": phases, "allocations": allocations}
+
+
+# monthly returns are annualized with the square root of this
+MONTHS_PER_YEAR = 12
+
+DAYS_PER_YEAR = 365.25
+
+# bars an EquityMetrics collects before measuring them in one vectorized step
+EQUITY_METRICS_BUFFER_BARS = 4096
+
+
+def monthly_return_ratios(monthly_returns):
+    """
+    Returns:
+        sharpe_ratio, sortino_ratio: annualized ratios of a float64 array of monthly returns, see
+            EquityMetrics.results() (NaN when they can't be computed)
+    """
+    sharpe_ratio = np.nan
+    sortino_ratio = np.nan
+    if len(monthly_returns) >= 2:
+        mean_return = monthly_returns.mean()
+        deviation = monthly_returns.std(ddof=1)
+        downside_deviation = np.sqrt(np.mean(np.minimum(monthly_returns, 0)**2))
+        if deviation > 0:
+            sharpe_ratio = float(mean_return/deviation*np.sqrt(MONTHS_PER_YEAR))
+        if downside_deviation > 0:
+            sortino_ratio = float(mean_return/downside_deviation*np.sqrt(MONTHS_PER_YEAR))
+
+    return sharpe_ratio, sortino_ratio
+
+
+def annual_return_ratios(growth, years, max_drawdown):
+    """
+    Returns:
+        annual_return_rate, calmar_ratio: of a curve that grew by a factor of growth over years with the
+            given max_drawdown, see EquityMetrics.results() (NaN when they can't be computed)
+    """
+    annual_return_rate = growth**(1/years) - 1 if years > 0 and growth > 0 else np.nan
+    calmar_ratio = annual_return_rate/max_drawdown if max_drawdown > 0 else np.nan
+
+    return annual_return_rate, calmar_ratio
+
+
+class EquityMetrics:
+    """
+    Risk metrics of an equity curve that is fed to it in consecutive pieces, so runs that don't record their
+    balance can still be measured: besides a small buffer it only keeps the running peak, the worst drawdown so
+    far and the equity at the end of every month and quarter. Measuring a curve in pieces gives exactly the same
+    metrics as measuring all of it at once (see risk_metrics()).
+
+    Bars with a NaN equity (gaps in the price data) are taken to hold the equity of the bar before them.
+
+    Parameters:
+        starting_equity: equity before the first bar
+        month_starts, quarter_starts: sorted lists of bars where a new month / quarter begins
+    """
+
+    def __init__(self, starting_equity, month_starts, quarter_starts):
+        self.starting_equity = starting_equity
+        self.month_starts = month_starts
+        self.quarter_starts = quarter_starts
+        # the last bar of every month and quarter, except the ones still running at the end of the curve
+        self.month_ends = np.asarray([x - 1 for x in month_starts if x > 0], dtype=np.int64)
+        self.quarter_ends = np.asarray([x - 1 for x in quarter_starts if x > 0], dtype=np.int64)
+        self.month_end_equity = []
+        self.quarter_end_equity = []
+
+        self.bars = 0
+        self.last_equity = starting_equity
+        self.peak = starting_equity
+        self.peak_bar = -1
+        self.max_drawdown = 0.0
+        self.max_drawdown_duration = 0
+
+        self.buffer = np.empty(EQUITY_METRICS_BUFFER_BARS)
+        self.buffered = 0
+
+    def append(self, equity):
+        """
+        Add the equity of the next bar.
+        """
+        if self.buffered == len(self.buffer):
+            self.flush()
+        self.buffer[self.buffered] = equity
+        self.buffered = self.buffered + 1
+
+    def update(self, equity):
+        """
+        Add the equity of the next len(equity) bars.
+        """
+        if self.buffered + len(equity) > len(self.buffer):
+            self.flush()
+        if len(equity) > len(self.buffer):
+            self.measure(equity)
+        else:
+            self.buffer[self.buffered:self.buffered + len(equity)] = equity
+            self.buffered = self.buffered + len(equity)
+
+    def flush(self):
+        if self.buffered > 0:
+            self.measure(self.buffer[:self.buffered])
+            self.buffered = 0
+
+    def measure(self, equity):
+        """
+        Measure the next len(equity) bars in one vectorized step (anything buffered has to be flushed first).
+        """
+        count = len(equity)
+        if count == 0:
+            return
+        start = self.bars
+
+        valid = ~np.isnan(equity)
+        if not valid.all():
+            filled = np.maximum.accumulate(np.where(valid, np.arange(count), -1))
+            equity = np.where(filled >= 0, equity[filled], self.last_equity)
+
+        # the running peak carries on from the bars before, drawdowns are measured from it. A short position can
+        # lose more than the peak equity, falling below zero still only counts as losing all of it (a drawdown of 1)
+        peaks = np.maximum.accumulate(equity)
+        np.maximum(peaks, self.peak, out=peaks)
+        self.max_drawdown = max(self.max_drawdown, min(1.0, float((1 - equity/peaks).max())))
+
+        # the longest drawdown is the longest gap between two bars where the curve is at its peak
+        peak_bars = np.flatnonzero(equity >= peaks) + start
+        gaps = np.diff(np.concatenate(([self.peak_bar], peak_bars, [start + count])))
+        self.max_drawdown_duration = max(self.max_drawdown_duration, int(gaps.max()) - 1)
+        if len(peak_bars) > 0:
+            self.peak_bar = int(peak_bars[-1])
+
+        for period_ends, period_end_equity in [(self.month_ends, self.month_end_equity),
+                                               (self.quarter_ends, self.quarter_end_equity)]:
+            ended = np.searchsorted(period_ends, start + count)
+            period_end_equity.extend(equity[period_ends[len(period_end_equity):ended] - start].tolist())
+
+        self.bars = start + count
+        self.last_equity = float(equity[-1])
+        self.peak = float(peaks[-1])
+
+    def period_returns(self, period_ends, period_end_equity):
+        equity = [self.starting_equity] + period_end_equity
+        # the period running at the end of the curve counts too
+        if len(period_end_equity) == 0 or period_ends[len(period_end_equity) - 1] != self.bars - 1:
+            equity.append(self.last_equity)
+        equity = np.asarray(equity, dtype=np.float64)
+
+        return equity[1:]/equity[:-1] - 1
+
+    def results(self, years, exposed_bars=None):
+        """
+        Parameters:
+            years: time the curve spans, in years (for annualizing the return)
+            exposed_bars: bars that a position was held on, default = None (exposure is not known)
+        Returns:
+            metrics: dictionary of
+                monthly_return_rates, quarterly_return_rates: returns from the end of one month / quarter to the
+                    end of the next, from the starting equity to the end of the curve
+                sharpe_ratio: mean over standard deviation of the monthly returns, annualized (0% risk-free rate)
+                sortino_ratio: mean of the monthly returns over their downside deviation, annualized
+                max_drawdown: largest fall from a peak, as a fraction of the peak (0.25 = 25%). Equity that falls
+                    to or below zero (a short losing more than the account) is a drawdown of 1, so it never exceeds 1
+                max_drawdown_duration: most bars spent below a previous peak
+                annual_return_rate: compounded return per year
+                calmar_ratio: annual_return_rate over max_drawdown
+                exposure: share of the bars a position was held on
+            ratios that can't be computed (too few months, no drawdown, ...) are NaN
+        """
+        self.flush()
+        monthly_returns = self.period_returns(self.month_ends, self.month_end_equity)
+        quarterly_returns = self.period_returns(self.quarter_ends, self.quarter_end_equity)
+
+        sharpe_ratio, sortino_ratio = monthly_return_ratios(monthly_returns)
+        annual_return_rate, calmar_ratio = annual_return_ratios(self.last_equity/self.starting_equity, years,
+                                                                self.max_drawdown)
+
+        metrics = {
+            "monthly_return_rates": monthly_returns.tolist(),
+            "quarterly_return_rates": quarterly_returns.tolist(),
+            "sharpe_ratio": sharpe_ratio,
+            "sortino_ratio": sortino_ratio,
+            "max_drawdown": self.max_drawdown,
+            "max_drawdown_duration": self.max_drawdown_duration,
+            "annual_return_rate": annual_return_rate,
+            "calmar_ratio": calmar_ratio,
+            "exposure": exposed_bars/self.bars if exposed_bars is not None and self.bars > 0 else np.nan
+        }
+
+        return metrics
+
+
+def measure_held_positions(equity_metrics, price, position_starts, position_sizes, fiats, short_helds):
+    """
+    Feed an EquityMetrics the equity curve of the positions a simulation held, computed from them a chunk of
+    EQUITY_METRICS_BUFFER_BARS bars at a time (with the same arithmetic as simulate_backtest(), so the equity is
+    identical to the recorded balance). This way a run only keeps one entry per event instead of one per bar.
+
+    Parameters:
+        equity_metrics: EquityMetrics to feed the equity to
+        price: float64 numpy array of the prices of the bars to measure
+        position_starts: sorted list of the bars where the portfolio changed, starting with 0
+        position_sizes, fiats, short_helds: lists of the portfolio from each of those bars on, short_held is
+            purchase_price*position_size of a short position and NaN for a long one
+    """
+    starts = np.asarray(position_starts, dtype=np.int64)
+    ends = np.append(starts[1:], len(price))
+    position_size = np.asarray(position_sizes, dtype=np.float64)
+    fiat = np.asarray(fiats, dtype=np.float64)
+    short_held = np.asarray(short_helds, dtype=np.float64)
+
+    for chunk_start in range(0, len(price), EQUITY_METRICS_BUFFER_BARS):
+        chunk_end = min(chunk_start + EQUITY_METRICS_BUFFER_BARS, len(price))
+        first = np.searchsorted(ends, chunk_start, side='right')
+        last = np.searchsorted(starts, chunk_end, side='left')
+        lengths = np.minimum(ends[first:last], chunk_end) - np.maximum(starts[first:last], chunk_start)
+
+        chunk_price = price[chunk_start:chunk_end]
+        chunk_position_size = np.repeat(position_size[first:last], lengths)
+        chunk_fiat = np.repeat(fiat[first:last], lengths)
+        equity = chunk_position_size*chunk_price + chunk_fiat
+
+        chunk_short_held = short_held[first:last]
+        if not np.isnan(chunk_short_held).all():
+            held = np.repeat(chunk_short_held, lengths)
+            short = ~np.isnan(held)
+            equity[short] = (held + (held - chunk_price*chunk_position_size) + chunk_fiat)[short]
+
+        equity_metrics.measure(equity)
+
+
+def record_held_positions(balance, price, balance_bars, position_starts, position_sizes, fiats, short_helds):
+    """
+    Write the equity of the positions a simulation held on balance_bars into a preallocated balance array,
+    looking up the position of each bar a chunk of EQUITY_METRICS_BUFFER_BARS bars at a time (with the same
+    arithmetic as simulate_backtest(), so a float64 balance is identical to recording every bar).
+
+    Parameters:
+        balance: float64 or float32 array as long as balance_bars to write into
+        price: float64 numpy array of the prices of the simulated bars
+        balance_bars: sorted int64 array of bars to record, all of them below len(price)
+        position_starts, position_sizes, fiats, short_helds: position log of the simulation, see measure_held_positions()
+    """
+    starts = np.asarray(position_starts, dtype=np.int64)
+    position_size = np.asarray(position_sizes, dtype=np.float64)
+    fiat = np.asarray(fiats, dtype=np.float64)
+    short_held = np.asarray(short_helds, dtype=np.float64)
+
+    for chunk_start in range(0, len(balance_bars), EQUITY_METRICS_BUFFER_BARS):
+        chunk_end = min(chunk_start + EQUITY_METRICS_BUFFER_BARS, len(balance_bars))
+        bars = balance_bars[chunk_start:chunk_end]
+        held_from = np.searchsorted(starts, bars, side='right') - 1
+
+        chunk_price = price[bars]
+        chunk_position_size = position_size[held_from]
+        chunk_fiat = fiat[held_from]
+        equity = chunk_position_size*chunk_price + chunk_fiat
+
+        chunk_short_held = short_held[held_from]
+        short = ~np.isnan(chunk_short_held)
+        if short.any():
+            held = chunk_short_held
+            equity[short] = (held + (held - chunk_price*chunk_position_size) + chunk_fiat)[short]
+
+        balance[chunk_start:chunk_end] = equity
+
+
+def risk_metrics(equity, starting_equity, month_starts, quarter_starts, years, exposed_bars=None):
+    """
+    Risk metrics of a whole equity curve in one vectorized pass, see EquityMetrics.results() for what they are.
+
+    Parameters:
+        equity: float64 array of the equity on every bar
+        starting_equity: equity before the first bar
+        month_starts, quarter_starts: sorted lists of bars where a new month / quarter begins
+        years: time the curve spans, in years
+        exposed_bars: bars that a position was held on, default = None
+    Returns:
+        metrics: dictionary generated by EquityMetrics.results()
+    """
+    equity_metrics = EquityMetrics(starting_equity, month_starts, quarter_starts)
+    equity_metrics.measure(np.asarray(equity, dtype=np.float64))
+
+    return equity_metrics.results(years, exposed_bars)
+
+
+def span_in_years(timestamps, last_bar):
+    """
+    Time from the first bar to last_bar, in years.
+    """
+    if last_bar <= 0:
+        return 0.0
+
+    return float((timestamps[last_bar] - timestamps[0]) / np.timedelta64(1, 'D')) / DAYS_PER_YEAR
+
+
+class BaselineRisk:
+    """
+    Risk metrics of the buy and hold baseline of one dataset, for runs that skip a different number of bars at
+    its start (the length of their moving averages). The baseline's equity only depends on the prices, so the
+    lowest equity and the worst drawdown from every bar to the end of the dataset are computed once per starting
+    capital, after which a run only has to look up the equity at the end of its months. This gives exactly the
+    same metrics as measuring the run's baseline curve with risk_metrics().
+
+    Parameters:
+        price: float64 numpy array of the prices of the dataset
+        baseline_initial: price the baseline bought in at
+    """
+
+    def __init__(self, price, baseline_initial):
+        self.price = price
+        self.baseline_initial = baseline_initial
+        # (equity, lowest equity from each bar on, worst drawdown from each bar on) by starting capital
+        self.curves = {}
+
+    def curve(self, starting_capital):
+        if starting_capital not in self.curves:
+            equity = (starting_capital/self.baseline_initial)*self.price
+            valid = ~np.isnan(equity)
+            if not valid.all():
+                equity = equity[np.maximum.accumulate(np.where(valid, np.arange(len(equity)), 0))]
+
+            lowest = np.minimum.accumulate(equity[::-1])[::-1]
+            drawdown = np.maximum.accumulate((1 - lowest/equity)[::-1])[::-1]
+            self.curves[starting_capital] = (equity, lowest, drawdown)
+
+        return self.curves[starting_capital]
+
+    def results(self, offset, bars, starting_capital, month_ends, years):
+        """
+        Parameters:
+            offset: bars of the dataset the run skipped
+            bars: bars the run measured after them
+            starting_capital: equity before the first bar
+            month_ends: int64 array of the last bar of every month (counted from offset), see EquityMetrics
+            years: time the run spans, in years
+        Returns:
+            metrics: dictionary of the monthly_return_rates, sharpe_ratio, sortino_ratio, max_drawdown and
+                calmar_ratio of the baseline, see EquityMetrics.results(). None when the run stopped before the
+                end of the dataset or starts on a gap in the prices, measure those with risk_metrics()
+        """
+        if bars == 0 or offset + bars != len(self.price) or np.isnan(self.price[offset]):
+            return None
+
+        equity, lowest, drawdown = self.curve(starting_capital)
+        max_drawdown = min(1.0, max(float(drawdown[offset]), float(1 - lowest[offset]/starting_capital)))
+
+        period_equity = [starting_capital] + equity[offset + month_ends].tolist()
+        # the month running at the end of the curve counts too
+        if len(month_ends) == 0 or month_ends[-1] != bars - 1:
+            period_equity.append(float(equity[-1]))
+        period_equity = np.asarray(period_equity, dtype=np.float64)
+        monthly_returns = period_equity[1:]/period_equity[:-1] - 1
+
+        sharpe_ratio, sortino_ratio = monthly_return_ratios(monthly_returns)
+        calmar_ratio = annual_return_ratios(float(equity[-1])/starting_capital, years, max_drawdown)[1]
+
+        return {
+            "monthly_return_rates": monthly_returns.tolist(),
+            "sharpe_ratio": sharpe_ratio,
+            "sortino_ratio": sortino_ratio,
+            "max_drawdown": max_drawdown,
+            "calmar_ratio": calmar_ratio
+        }
+
+
+# entries of backtest_results filled in by backtest_risk_metrics() (None when the risk wasn't measured)
+RISK_METRICS = ["monthly_return_rates", "sharpe_ratio", "sortino_ratio", "max_drawdown", "max_drawdown_duration",
+                "calmar_ratio", "exposure", "baseline_monthly_return_rates", "baseline_sharpe_ratio",
+                "baseline_sortino_ratio", "baseline_max_drawdown", "baseline_calmar_ratio"]
+
+
+def backtest_risk_metrics(equity_metrics, exposed_bars, baseline_equity, timestamps, baseline_risk=None, offset=0):
+    """
+    The risk metrics both backtesters add to backtest_results, for the strategy and the buy and hold baseline.
+
+    Parameters:
+        equity_metrics: EquityMetrics that was fed the strategy's equity curve
+        exposed_bars: bars the strategy held a position on
+        baseline_equity: float64 array of the baseline's equity on the same bars
+        timestamps: datetime64 array of the timestamps of the bars
+        baseline_risk: BaselineRisk of the dataset the bars were taken from, to look the baseline's metrics
+            up in instead of measuring baseline_equity, default = None
+        offset: bars of that dataset skipped before the first bar, default = 0
+    Returns:
+        dictionary of the RISK_METRICS entries of backtest_results
+    """
+    equity_metrics.flush()
+    years = span_in_years(timestamps, equity_metrics.bars - 1)
+    strategy = equity_metrics.results(years, exposed_bars)
+    baseline = None
+    if baseline_risk is not None:
+        baseline = baseline_risk.results(offset, equity_metrics.bars, equity_metrics.starting_equity,
+                                         equity_metrics.month_ends, years)
+    if baseline is None:
+        baseline = risk_metrics(baseline_equity, equity_metrics.starting_equity, equity_metrics.month_starts,
+                                equity_metrics.quarter_starts, years)
+
+    return {
+        "monthly_return_rates": strategy['monthly_return_rates'],
+        "sharpe_ratio": strategy['sharpe_ratio'],
+        "sortino_ratio": strategy['sortino_ratio'],
+        "max_drawdown": strategy['max_drawdown'],
+        "max_drawdown_duration": strategy['max_drawdown_duration'],
+        "calmar_ratio": strategy['calmar_ratio'],
+        "exposure": strategy['exposure'],
+        "baseline_monthly_return_rates": baseline['monthly_return_rates'],
+        "baseline_sharpe_ratio": baseline['sharpe_ratio'],
+        "baseline_sortino_ratio": baseline['sortino_ratio'],
+        "baseline_max_drawdown": baseline['max_drawdown'],
+        "baseline_calmar_ratio": baseline['calmar_ratio']
+    }
+
+
+def simulate_backtest(price,
+                      quarter_starts,
+                      year_starts,
+                      buy_bars,
+                      sell_bars,
+                      alternate_signals,
+                      record_volume,
+                      order_sizing,
+                      starting_capital,
+                      baseline_position_size,
+                      shorting_allowed,
+                      fixed_fee,
+                      fee,
+                      annual_taxes,
+                      tax_percentage,
+                      record_balance,
+                      fee_schedule = None,
+                      abort_criteria = None,
+                      profile = None,
+                      month_starts = None,
+                      balance_bars = None,
+                      balance_dtype = "float64"
+                      ):
+    """
+    Array-backed simulation core shared by both backtesters.
+
+    Instead of visiting every bar, the simulation jumps from event to event (trade signals, quarter starts
+    and year starts). Between events nothing about the portfolio changes, so the balance for those bars is
+    written in one vectorized step. The bookkeeping at each event is done in the same order and with the
+    same arithmetic as the per-bar loop, so the results are identical.
+
+    Parameters:
+        price: float64 numpy array of prices
+        quarter_starts: sorted list of bars where a new quarter begins
+        year_starts: sorted list of bars where a new year begins
+        buy_bars: sorted list of bars where the buy signal fires
+        sell_bars: sorted list of bars where the sell signal fires
+        alternate_signals: if true, only look for a sell after a buy and vice versa (mean reversion),
+            otherwise every signal is acted on (sma crossover)
+        record_volume: whether purchases count towards the thirty day volume used for fees
+        fee_schedule: FeeSchedule used when fixed_fee is false, default = DEFAULT_FEE_SCHEDULE
+        abort_criteria: AbortCriteria to stop the run early, default = None (always run to the last bar)
+        profile: BacktestProfile to record the time spent per phase and the allocations in, default = None
+        month_starts: sorted list of bars where a new month begins, measures the risk of the equity curve when
+            given (streaming it through an EquityMetrics when the balance isn't recorded), default = None
+        balance_bars: sorted int64 array of the bars to record the balance of (see find_balance_bars()), default
+            = None (every bar)
+        balance_dtype: "float64" or "float32", the type of the recorded balances, default = "float64"
+        (remaining parameters are the same as the backtesters)
+    Returns:
+        simulation: dictionary with the final portfolio state, quarterly results and balances. 'last_bar' is
+            the bar the run ended on, when the run was aborted 'abort_reason' says why (otherwise None) and
+            the balance after 'last_bar' is NaN. 'exposed_bars' counts the bars a position was held on and
+            'equity_metrics' is the EquityMetrics of the run (None without month_starts). The balances are
+            recorded on 'balance_bars' (None when every bar is). 'wins' and 'losses' count the last quarter
+            only (like the backtesters' hit_rate), 'total_wins' and 'total_losses' the whole run
+    """
+    n = len(price)
+    prices = price.tolist()
+
+    fiat = starting_capital
+    position_size = 0
+    purchase_price = 0
+    trades = 0
+    wins = 0
+    losses = 0
+    total_wins = 0
+    total_losses = 0
+    short_position = None
+    holding = False # whether the last move was a buy
+
+    quarter_initial_balance = starting_capital
+    quarter_baseline_initial_balance = starting_capital
+    annual_baseline_balance = starting_capital
+
+    quarter_return_rates = []
+    quarter_trades = []
+    quarter_hit_rates = []
+    baseline_return_rates = []
+
+    if fee_schedule is None:
+        fee_schedule = DEFAULT_FEE_SCHEDULE
+    rolling_volume = RollingVolume(fee_schedule.window)
+
+    # a float64 balance of every bar is written as the simulation goes, any other balance is looked up in the
+    # position log once the run is over (see record_held_positions())
+    compact_balance = record_balance == True and (balance_bars is not None or balance_dtype != "float64")
+    records_every_bar = record_balance == True and not compact_balance
+    if records_every_bar:
+        portfolio_balance = np.empty(n)
+        baseline_balance = baseline_position_size*price
+    elif compact_balance:
+        if balance_bars is None:
+            balance_bars = np.arange(n, dtype=np.int64)
+        portfolio_balance = np.empty(len(balance_bars), dtype=balance_dtype)
+        baseline_balance = np.empty(len(balance_bars), dtype=balance_dtype)
+        baseline_balance[:] = baseline_position_size*price[balance_bars]
+    else:
+        portfolio_balance = None
+        baseline_balance = None
+
+    # every phase is only timed when there is a profile, so a run without one never calls the clock
+    profiling = profile is not None
+    if profiling:
+        clock = time.perf_counter
+        profile.runs = profile.runs + 1
+        if record_balance == True:
+            profile.allocate("portfolio_balance", portfolio_balance.nbytes)
+            profile.allocate("baseline_balance", baseline_balance.nbytes)
+
+    if not annual_taxes:
+        year_starts = []
+
+    # early abort bookkeeping, the portfolio value is only computed bar by bar if a limit needs it
+    tracks_equity = abort_criteria is not None and abort_criteria.tracks_equity()
+    max_trades = abort_criteria.max_trades if abort_criteria is not None else None
+    equity_peak = starting_capital
+    total_trades = 0
+    abort_reason = None
+    last_bar = n - 1
+
+    # without a balance to measure at the end, the equity of every bar is streamed into equity_metrics: the
+    # equity computed for the abort checks, or else the positions held between events (see measure_held_positions())
+    equity_metrics = None
+    if month_starts is not None:
+        equity_metrics = EquityMetrics(starting_capital, month_starts, quarter_starts)
+    streams_equity = equity_metrics is not None and not records_every_bar and tracks_equity
+    measures_positions = equity_metrics is not None and not records_every_bar and not tracks_equity
+    logs_positions = measures_positions or compact_balance
+    position_starts = [0]
+    position_sizes = [0]
+    fiats = [starting_capital]
+    short_helds = [np.nan]
+    exposed_bars = 0
+
+    quarter_index = 0
+    year_index = 0
+    buy_index = 0
+    sell_index = 0
+    segment_start = 0
+
+    while True:
+        if profiling:
+            started = clock()
+
+        next_quarter = quarter_starts[quarter_index] if quarter_index < len(quarter_starts) else n
+        next_year = year_starts[year_index] if year_index < len(year_starts) else n
+
+        # find the next bar where a trade happens
+        while buy_index < len(buy_bars) and buy_bars[buy_index] < segment_start:
+            buy_index = buy_index + 1
+        while sell_index < len(sell_bars) and sell_bars[sell_index] < segment_start:
+            sell_index = sell_index + 1
+        next_buy = buy_bars[buy_index] if buy_index < len(buy_bars) else n
+        next_sell = sell_bars[sell_index] if sell_index < len(sell_bars) else n
+        if alternate_signals:
+            if holding:
+                next_buy = n
+            else:
+                next_sell = n
+
+        x = min(next_quarter, next_year, next_buy, next_sell)
+
+        if profiling:
+            profile.add("event_search", clock() - started)
+
+        if position_size != 0:
+            exposed_bars = exposed_bars + x - segment_start
+
+        # the portfolio did not change since the last event, record the balance in one go
+        if (records_every_bar or tracks_equity) and x > segment_start:
+            if profiling:
+                started = clock()
+
+            if short_position == True:
+                held = purchase_price*position_size
+                equity = held + (held - price[segment_start:x]*position_size) + fiat
+            else:
+                equity = position_size*price[segment_start:x] + fiat
+
+            if profiling:
+                profile.add("balance_recording", clock() - started)
+                profile.allocate("equity_segments", equity.nbytes)
+
+            if tracks_equity:
+                if profiling:
+                    started = clock()
+                breach, reason, equity_peak = abort_criteria.find_breach(equity, equity_peak)
+                if profiling:
+                    profile.add("abort_checks", clock() - started)
+                if breach is not None:
+                    abort_reason = reason
+                    last_bar = segment_start + breach
+                    if position_size != 0:
+                        exposed_bars = exposed_bars - (x - last_bar - 1)
+                    if records_every_bar:
+                        portfolio_balance[segment_start:last_bar + 1] = equity[:breach + 1]
+                        portfolio_balance[last_bar + 1:] = np.nan
+                    elif streams_equity:
+                        equity_metrics.update(equity[:breach + 1])
+                    break
+
+            if records_every_bar or streams_equity:
+                if profiling:
+                    started = clock()
+                if records_every_bar:
+                    portfolio_balance[segment_start:x] = equity
+                else:
+                    equity_metrics.update(equity)
+                if profiling:
+                    profile.add("balance_recording", clock() - started, calls=0)
+
+        if x >= n:
+            break
+
+        current_price = prices[x]
+
+        # if the year has changed, take out taxes on the gains
+        if x == next_year:
+            if profiling:
+                started = clock()
+
+            if short_position == True:
+                short_delta = (purchase_price*position_size - current_price*position_size)
+                current_balance = (purchase_price*position_size + short_delta + fiat)
+            else:
+                current_balance = current_price*position_size + fiat
+
+            annual_change = current_balance - annual_baseline_balance
+
+            if annual_change > 0:
+                taxes_due = annual_change*tax_percentage
+
+                if position_size != 0:
+                    taxes_due = annual_change*tax_percentage - fiat
+                    amount_to_sell = taxes_due/current_price
+                    position_size = position_size - amount_to_sell
+                else:
+                    fiat = fiat - taxes_due
+
+            annual_baseline_balance = position_size*current_price + fiat
+            year_index = year_index + 1
+
+            if profiling:
+                profile.add("tax_handling", clock() - started)
+
+        # If a new quarter begins, calculate metrics for the quarter
+        if x == next_quarter:
+            if profiling:
+                started = clock()
+
+            quarter_return_rates.append(((fiat + current_price*position_size)/quarter_initial_balance) - 1)
+            quarter_trades.append(trades)
+            baseline_return_rates.append(((baseline_position_size*current_price)/quarter_baseline_initial_balance) - 1)
+
+            if (losses + wins) > 0:
+                quarter_hit_rates.append(wins/(losses + wins))
+            else:
+                quarter_hit_rates.append("N/A")
+
+            trades = 0
+            total_losses = total_losses + losses
+            total_wins = total_wins + wins
+            losses = 0
+            wins = 0
+
+            quarter_initial_balance = fiat + current_price*position_size
+            quarter_baseline_initial_balance = current_price*baseline_position_size
+            quarter_index = quarter_index + 1
+
+            if profiling:
+                profile.add("quarterly_bookkeeping", clock() - started)
+
+        if x == next_buy or x == next_sell:
+            # calculate the fee using the thirty_day_volume
+            if not fixed_fee and profiling:
+                started = clock()
+                volume = rolling_volume.volume(x)
+                profile.add("volume_window", clock() - started)
+                started = clock()
+                fee = fee_schedule.find_fee(volume)
+                profile.add("fee_lookup", clock() - started)
+            elif not fixed_fee:
+                fee = fee_schedule.find_fee(rolling_volume.volume(x))
+
+            if profiling:
+                started = clock()
+
+            if x == next_buy:
+                if shorting_allowed == True:
+                    if short_position == True:
+                        # if there is a short position, exit out of it
+                        short_delta = (purchase_price*position_size - current_price*position_size)
+                        fiat = fiat + (purchase_price*position_size + short_delta)*(1 - fee)
+                        position_size = 0
+                    short_position = False
+
+                position_size = position_size + (order_sizing*fiat*(1 - fee))/current_price
+                if record_volume:
+                    rolling_volume.add(x, (order_sizing*fiat*(1 - fee))/current_price)
+
+                fiat = fiat - order_sizing*fiat
+                trades = trades + 1
+                purchase_price = current_price
+                holding = True
+            else:
+                fiat = fiat + position_size*current_price*(1 - fee)
+                position_size = 0
+                if record_volume:
+                    rolling_volume.add(x, position_size*current_price*(1 - fee))
+
+                if shorting_allowed == True:
+                    position_size = (order_sizing*fiat*(1 - fee))/current_price
+                    fiat = fiat - position_size*current_price
+                    short_position = True
+                    purchase_price = current_price
+                else:
+                    purchase_price = 0
+
+                trades = trades + 1
+
+                # record whether the trade was profitable
+                if purchase_price < current_price:
+                    wins = wins + 1
+                else:
+                    losses = losses + 1
+                holding = False
+
+            total_trades = total_trades + 1
+
+            if profiling:
+                profile.add("trade_execution", clock() - started)
+                if record_volume:
+                    profile.allocate("volume_data")
+
+        if position_size != 0:
+            exposed_bars = exposed_bars + 1
+
+        if logs_positions:
+            position_starts.append(x)
+            position_sizes.append(position_size)
+            fiats.append(fiat)
+            short_helds.append(purchase_price*position_size if short_position == True else np.nan)
+
+        # the state after this bar holds until the next event
+        if records_every_bar or tracks_equity:
+            if profiling:
+                started = clock()
+
+            if short_position == True:
+                held = purchase_price*position_size
+                equity = held + (held - price[x]*position_size) + fiat
+            else:
+                equity = position_size*price[x] + fiat
+            if records_every_bar:
+                portfolio_balance[x] = equity
+            elif streams_equity:
+                equity_metrics.append(equity)
+
+            if profiling:
+                profile.add("balance_recording", clock() - started)
+
+            if tracks_equity:
+                if profiling:
+                    started = clock()
+                breach, reason, equity_peak = abort_criteria.find_breach(np.array([equity]), equity_peak)
+                if profiling:
+                    profile.add("abort_checks", clock() - started)
+                if breach is not None:
+                    abort_reason = reason
+
+        if abort_reason is None and max_trades is not None and total_trades > max_trades:
+            abort_reason = "max_trades"
+
+        if abort_reason is not None:
+            last_bar = x
+            if records_every_bar:
+                portfolio_balance[x + 1:] = np.nan
+            break
+
+        segment_start = x + 1
+
+    # an aborted run closes its last (partial) quarter on the bar it stopped, so its trades still count
+    if abort_reason is not None:
+        current_price = prices[last_bar]
+        quarter_return_rates.append(((fiat + current_price*position_size)/quarter_initial_balance) - 1)
+        quarter_trades.append(trades)
+        baseline_return_rates.append(((baseline_position_size*current_price)/quarter_baseline_initial_balance) - 1)
+        if (losses + wins) > 0:
+            quarter_hit_rates.append(wins/(losses + wins))
+        else:
+            quarter_hit_rates.append("N/A")
+
+    if equity_metrics is not None and records_every_bar:
+        equity_metrics.measure(portfolio_balance[:last_bar + 1])
+    elif measures_positions:
+        measure_held_positions(equity_metrics, price[:last_bar + 1], position_starts, position_sizes, fiats, short_helds)
+
+    if compact_balance:
+        if profiling:
+            started = clock()
+        recorded = np.searchsorted(balance_bars, last_bar, side='right')
+        record_held_positions(portfolio_balance, price, balance_bars[:recorded], position_starts, position_sizes,
+                              fiats, short_helds)
+        portfolio_balance[recorded:] = np.nan
+        if profiling:
+            profile.add("balance_recording", clock() - started)
+
+    simulation = {
+        "fiat": fiat,
+        "position_size": position_size,
+        "wins": wins,
+        "losses": losses,
+        "total_wins": total_wins + wins,
+        "total_losses": total_losses + losses,
+        "quarter_return_rates": [np.float64(x) for x in quarter_return_rates],
+        "quarter_trades": quarter_trades,
+        "quarter_hit_rates": quarter_hit_rates,
+        "baseline_return_rates": [np.float64(x) for x in baseline_return_rates],
+        "portfolio_balance": portfolio_balance,
+        "baseline_balance": baseline_balance,
+        "balance_bars": balance_bars if compact_balance else None,
+        "last_bar": last_bar,
+        "abort_reason": abort_reason,
+        "exposed_bars": exposed_bars,
+        "equity_metrics": equity_metrics
+    }
+
+    return simulation
+
+
+def summarize_backtest(simulation, price, baseline_initial, starting_capital, timestamps=None, baseline_risk=None,
+                       offset=0):
+    """
+    Turn the output of simulate_backtest() into the backtest_results metrics shared by both backtesters.
+
+    Parameters:
+        simulation: dict generated by simulate_backtest()
+        price: float64 numpy array of prices that was simulated
+        baseline_initial: price the buy and hold baseline bought in at
+        starting_capital: how much capital the run started with (USD)
+        timestamps: datetime64 array of the timestamps of price, needed for the risk metrics, default = None
+        baseline_risk: BaselineRisk of the dataset price is the end of, default = None (the baseline is measured
+            from price)
+        offset: bars of that dataset skipped before price, default = 0
+    Returns:
+        backtest_results: dictionary of backtest result metrics (without balance_data). Aborted runs are
+            measured up to the bar they stopped on, 'aborted' flags them and 'abort_bar' is that bar
+            (relative to price). The RISK_METRICS are None unless the simulation measured its equity curve
+            and timestamps are given
+    """
+    aborted = simulation['abort_reason'] is not None
+    current_price = price[simulation['last_bar']]
+    quarter_return_rates = simulation['quarter_return_rates']
+    baseline_return_rates = simulation['baseline_return_rates']
+    wins = simulation['wins']
+    losses = simulation['losses']
+
+    baseline_return_rate = (current_price/baseline_initial) - 1
+    final_return_rate = ((simulation['position_size']*current_price + simulation['fiat'])/starting_capital) - 1
+    if (losses + wins) > 0:
+        hit_rate = wins/(losses + wins)
+    else:
+        hit_rate = "N/A"
+
+    # calculate quarters_beating_baseline
+    count = 0
+    for x in range(0, len(quarter_return_rates)):
+        # we round so that a difference of 0.0000000001, etc. won't bring it over the edge.
+        if round(quarter_return_rates[x],2) > round(baseline_return_rates[x],2):
+            count = count + 1
+
+    quarters_beating_baseline = round(count/len(quarter_return_rates), 2)
+
+    # a run aborted in its first quarter only has one quarter to measure
+    if aborted and len(quarter_return_rates) < 2:
+        strategy_quarterly_stdev = np.nan
+        baseline_quarterly_stdev = np.nan
+    else:
+        strategy_quarterly_stdev = statistics.stdev(quarter_return_rates)
+        baseline_quarterly_stdev = statistics.stdev(baseline_return_rates)
+
+    backtest_results = {"final_return_rate" : final_return_rate,
+               "hit_rate": hit_rate,
+               "baseline_return_rate": baseline_return_rate,
+               "quarter_return_rates": quarter_return_rates,
+               "quarter_trades": simulation['quarter_trades'],
+               "quarter_hit_rates": simulation['quarter_hit_rates'],
+               "baseline_return_rates": baseline_return_rates,
+               "balance_data": None,
+               "sharpe_ratio": None,
+               "quarters_beating_baseline": quarters_beating_baseline,
+               "strategy_quarterly_stdev": strategy_quarterly_stdev,
+               "baseline_quarterly_stdev": baseline_quarterly_stdev,
+               "aborted": aborted,
+               "abort_bar": simulation['last_bar'] if aborted else None,
+               "abort_reason": simulation['abort_reason']
+    }
+
+    if simulation['equity_metrics'] is not None and timestamps is not None:
+        baseline_equity = (starting_capital/baseline_initial)*price[:simulation['last_bar'] + 1]
+        backtest_results.update(backtest_risk_metrics(simulation['equity_metrics'], simulation['exposed_bars'],
+                                                      baseline_equity, timestamps, baseline_risk, offset))
+    else:
+        backtest_results.update(dict.fromkeys(RISK_METRICS))
+
+    return backtest_results
+
+
+def sma_crossover_arrays(price,
+                         quarter,
+                         timestamps,
+                         ma1,
+                         ma2,
+                         ma2_length,
+                         baseline_initial,
+                         order_sizing,
+                         starting_capital,
+                         shorting_allowed,
+                         fixed_fee,
+                         record_balance,
+                         annual_taxes,
+                         tax_percentage = 0,
+                         fee = 0,
+                         fee_schedule = None,
+                         abort_criteria = None,
+                         profile = None,
+                         balance_stride = 1,
+                         balance_dtype = "float64",
+                         baseline_risk = None
+                         ):
+    """
+    Run the sma crossover strategy on numpy arrays (no dataframe needed, so sweep workers can run it on
+    read-only views of a shared dataset).
+
+    Parameters:
+        price, quarter, timestamps: arrays generated by extract_backtest_arrays()
+        ma1, ma2: moving averages of price (see moving_average()), the first ma2_length bars are skipped
+        baseline_initial: price the buy and hold baseline buys in at
+        profile: BacktestProfile to record the time spent per phase in, default = None
+        baseline_risk: BaselineRisk of price and baseline_initial to measure the baseline with, default = None
+            (one is made for this call)
+        (remaining parameters are the same as sma_crossover_backtester())
+    Returns:
+        backtest_results: dictionary of backtest result metrics (balance_data is None, abort_bar counts
+            from the start of price, before the first ma2_length bars are skipped)
+        simulation: dict generated by simulate_backtest()
+    """
+    baseline_position_size = starting_capital/baseline_initial
+    if baseline_risk is None:
+        baseline_risk = BaselineRisk(price, baseline_initial)
+    if profile is not None:
+        started = time.perf_counter()
+
+    ma1 = ma1[ma2_length:]
+    ma2 = ma2[ma2_length:]
+    price = price[ma2_length:]
+    timestamps = timestamps[ma2_length:]
+    quarter_starts, year_starts, month_starts = find_period_starts(quarter[ma2_length:], timestamps, months=True)
+    balance_bars = None
+    if record_balance == True and balance_stride != 1:
+        balance_bars = find_balance_bars(balance_stride, quarter[ma2_length:], timestamps, month_starts)
+
+    if profile is not None:
+        profile.add("period_starts", time.perf_counter() - started)
+        started = time.perf_counter()
+
+    # 1 when ma1 is higher, 2 when ma2 is higher, 0 when neither is
+    average_higher = np.where(ma1 > ma2, 1, np.where(ma1 < ma2, 2, 0))
+    buy_bars = (np.flatnonzero((average_higher[1:] == 1) & (average_higher[:-1] == 2)) + 1).tolist()
+    sell_bars = (np.flatnonzero((average_higher[1:] == 2) & (average_higher[:-1] == 1)) + 1).tolist()
+
+    if profile is not None:
+        profile.add("signal_evaluation", time.perf_counter() - started)
+
+    simulation = simulate_backtest(price,
+                                   quarter_starts = quarter_starts,
+                                   year_starts = year_starts,
+                                   buy_bars = buy_bars,
+                                   sell_bars = sell_bars,
+                                   alternate_signals = False,
+                                   record_volume = True,
+                                   order_sizing = order_sizing,
+                                   starting_capital = starting_capital,
+                                   baseline_position_size = baseline_position_size,
+                                   shorting_allowed = shorting_allowed,
+                                   fixed_fee = fixed_fee,
+                                   fee = fee,
+                                   annual_taxes = annual_taxes,
+                                   tax_percentage = tax_percentage,
+                                   record_balance = record_balance,
+                                   fee_schedule = fee_schedule,
+                                   abort_criteria = abort_criteria,
+                                   profile = profile,
+                                   month_starts = month_starts,
+                                   balance_bars = balance_bars,
+                                   balance_dtype = balance_dtype)
+
+    if profile is not None:
+        started = time.perf_counter()
+    backtest_results = summarize_backtest(simulation, price, baseline_initial, starting_capital, timestamps,
+                                          baseline_risk, ma2_length)
+    if backtest_results['aborted']:
+        backtest_results['abort_bar'] = backtest_results['abort_bar'] + ma2_length
+    if profile is not None:
+        profile.add("summary", time.perf_counter() - started)
+
+    return backtest_results, simulation
+
+
+def sma_crossover_array_backtest(sampled_data,
+                                 order_sizing,
+                                 ma1_length,
+                                 ma2_length,
+                                 starting_capital,
+                                 display_results,
+                                 shorting_allowed,
+                                 fixed_fee,
+                                 record_balance,
+                                 show_moving_averages,
+                                 annual_taxes,
+                                 tax_percentage = 0,
+                                 fee = 0,
+                                 fee_schedule = None,
+                                 ma_cache = None,
+                                 abort_criteria = None,
+                                 profile = False,
+                                 balance_stride = 1,
+                                 balance_dtype = "float64"
+                                 ):
+    """
+    engine="array" implementation of sma_crossover_backtester(), see there for the parameters.
+    """
+    baseline_initial = float(sampled_data['price'][0])
+    price, quarter, timestamps = extract_backtest_arrays(sampled_data)
+
+    backtest_profile = BacktestProfile() if profile else None
+    if profile:
+        started = time.perf_counter()
+    if ma_cache is None:
+        ma1 = moving_average(price, ma1_length)
+        ma2 = moving_average(price, ma2_length)
+        if profile:
+            backtest_profile.allocate("moving_averages", ma1.nbytes + ma2.nbytes, count=2)
+    else:
+        ma1 = ma_cache.get(ma1_length)
+        ma2 = ma_cache.get(ma2_length)
+
+    if profile:
+        backtest_profile.add("moving_averages", time.perf_counter() - started)
+
+    backtest_results, simulation = sma_crossover_arrays(price, quarter, timestamps, ma1, ma2, ma2_length,
+                                                        baseline_initial, order_sizing, starting_capital,
+                                                        shorting_allowed, fixed_fee, record_balance, annual_taxes,
+                                                        tax_percentage, fee, fee_schedule, abort_criteria,
+                                                        backtest_profile, balance_stride, balance_dtype)
+    if profile:
+        backtest_results['profile'] = backtest_profile.to_dict()
+
+    if record_balance == True:
+        balance_bars = simulation['balance_bars']
+        if balance_bars is None:
+            balance_bars = slice(None)
+        baseline_position_size = starting_capital/baseline_initial
+        balance_data = {"time": timestamps[ma2_length:][balance_bars],
+                        "Baseline": simulation['baseline_balance'],
+                        "SMA Crossover": simulation['portfolio_balance']}
+        if show_moving_averages:
+            balance_data["MA1"] = (ma1[ma2_length:][balance_bars]*baseline_position_size).astype(balance_dtype)
+            balance_data["MA2"] = (ma2[ma2_length:][balance_bars]*baseline_position_size).astype(balance_dtype)
+        if display_results == True:
+            plot_balance_data(balance_data)
+    else:
+        balance_data = NO_BALANCE_DATA
+
+    backtest_results['balance_data'] = balance_data
+
+    return backtest_results
+
+
+def mean_reversion_signal_bars(price, ma, buy_threshold, take_profit, stop_loss):
+    """
+    Find the bars where the mean reversion buy and sell conditions hold.
+
+    Arguments:
+        price: float64 numpy array of prices
+        ma: float64 numpy array of the moving average, aligned with price
+        buy_threshold, take_profit, stop_loss: same as mean_reversion_backtester()
+    Returns:
+        buy_bars: list of bars where the price is buy_threshold below the moving average
+        sell_bars: list of bars where the take profit or stop loss level is crossed
+    """
+    buy_signal = price <= ma*(1-buy_threshold)
+    sell_signal = (price >= ma*(1+take_profit)) | (price <= ma*(1-stop_loss))
+
+    # no trading happens on the first bar
+    buy_bars = (np.flatnonzero(buy_signal[1:]) + 1).tolist()
+    sell_bars = (np.flatnonzero(sell_signal[1:]) + 1).tolist()
+
+    return buy_bars, sell_bars
+
+
+def mean_reversion_arrays(price,
+                          quarter,
+                          timestamps,
+                          ma,
+                          ma_length,
+                          baseline_initial,
+                          order_sizing,
+                          starting_capital,
+                          thresholds,
+                          shorting_allowed,
+                          fixed_fee,
+                          record_balance,
+                          annual_taxes,
+                          tax_percentage = 0,
+                          fee = 0,
+                          fee_schedule = None,
+                          abort_criteria = None,
+                          profile = None,
+                          balance_stride = 1,
+                          balance_dtype = "float64",
+                          baseline_risk = None
+                          ):
+    """
+    Run the mean reversion strategy on numpy arrays for many (buy_threshold, take_profit, stop_loss) triples
+    that share one moving average. The price, moving average and quarter and year boundaries are sliced and
+    computed once for the whole batch, each triple then only costs its signal masks and its trades.
+
+    Parameters:
+        price, quarter, timestamps: arrays generated by extract_backtest_arrays()
+        ma: moving average of price (see moving_average()), the first ma_length bars are skipped
+        baseline_initial: price the buy and hold baseline buys in at
+        thresholds: list (or n x 3 array) of (buy_threshold, take_profit, stop_loss) triples
+        profile: BacktestProfile to record the time spent per phase in (adding up all of the triples), default = None
+        baseline_risk: BaselineRisk of price and baseline_initial to measure the baseline with, default = None
+            (one is made for this call)
+        (remaining parameters are the same as mean_reversion_backtester())
+    Returns:
+        runs: list of (backtest_results, simulation) tuples, one per triple (balance_data is None, abort_bar
+            counts from the start of price, before the first ma_length bars are skipped)
+    """
+    baseline_position_size = starting_capital/baseline_initial
+    if baseline_risk is None:
+        baseline_risk = BaselineRisk(price, baseline_initial)
+    if profile is not None:
+        started = time.perf_counter()
+
+    ma = ma[ma_length:]
+    price = price[ma_length:]
+    timestamps = timestamps[ma_length:]
+    quarter_starts, year_starts, month_starts = find_period_starts(quarter[ma_length:], timestamps, months=True)
+    balance_bars = None
+    if record_balance == True and balance_stride != 1:
+        balance_bars = find_balance_bars(balance_stride, quarter[ma_length:], timestamps, month_starts)
+
+    if profile is not None:
+        profile.add("period_starts", time.perf_counter() - started)
+
+    runs = []
+    for buy_threshold, take_profit, stop_loss in thresholds:
+        if profile is not None:
+            started = time.perf_counter()
+        buy_bars, sell_bars = mean_reversion_signal_bars(price, ma, buy_threshold, take_profit, stop_loss)
+        if profile is not None:
+            profile.add("signal_evaluation", time.perf_counter() - started)
+
+        simulation = simulate_backtest(price,
+                                       quarter_starts = quarter_starts,
+                                       year_starts = year_starts,
+                                       buy_bars = buy_bars,
+                                       sell_bars = sell_bars,
+                                       alternate_signals = True,
+                                       record_volume = False,
+                                       order_sizing = order_sizing,
+                                       starting_capital = starting_capital,
+                                       baseline_position_size = baseline_position_size,
+                                       shorting_allowed = shorting_allowed,
+                                       fixed_fee = fixed_fee,
+                                       fee = fee,
+                                       annual_taxes = annual_taxes,
+                                       tax_percentage = tax_percentage,
+                                       record_balance = record_balance,
+                                       fee_schedule = fee_schedule,
+                                       abort_criteria = abort_criteria,
+                                       profile = profile,
+                                       month_starts = month_starts,
+                                       balance_bars = balance_bars,
+                                       balance_dtype = balance_dtype)
+
+        if profile is not None:
+            started = time.perf_counter()
+        backtest_results = summarize_backtest(simulation, price, baseline_initial, starting_capital, timestamps,
+                                              baseline_risk, ma_length)
+        if backtest_results['aborted']:
+            backtest_results['abort_bar'] = backtest_results['abort_bar'] + ma_length
+        if profile is not None:
+            profile.add("summary", time.perf_counter() - started)
+        runs.append((backtest_results, simulation))
+
+    return runs
+
+
+def mean_reversion_threshold_batch(sampled_data,
+                                   order_sizing,
+                                   ma_length,
+                                   starting_capital,
+                                   thresholds,
+                                   shorting_allowed,
+                                   fixed_fee,
+                                   annual_taxes,
+                                   tax_percentage = 0,
+                                   fee = 0,
+                                   fee_schedule = None,
+                                   ma_cache = None,
+                                   abort_criteria = None,
+                                   profile = None
+                                   ):
+    """
+    Run mean reversion backtests for many (buy_threshold, take_profit, stop_loss) triples that share one
+    moving average, computing the moving average and everything else that doesn't depend on the thresholds
+    only once (see mean_reversion_arrays()).
+
+    Parameters:
+        sampled_data: pandas dataframe that must have columns 'timestamp', 'price' and 'quarter'
+        thresholds: list (or n x 3 array) of (buy_threshold, take_profit, stop_loss) triples
+        ma_cache: MovingAverageCache built on sampled_data's prices to take the moving average from, default = None
+        abort_criteria: AbortCriteria to stop runs early, default = None
+        profile: BacktestProfile to record the time spent per phase in (adding up all of the triples), default = None
+        (remaining parameters are the same as mean_reversion_backtester())
+    Returns:
+        results: list of backtest_results dictionaries, one per triple, identical to what
+            mean_reversion_backtester() returns for that triple with record_balance=False
+    """
+    baseline_initial = float(sampled_data['price'][0])
+    price, quarter, timestamps = extract_backtest_arrays(sampled_data)
+
+    if profile is not None:
+        started = time.perf_counter()
+    ma = moving_average(price, ma_length) if ma_cache is None else ma_cache.get(ma_length)
+    if profile is not None:
+        if ma_cache is None:
+            profile.allocate("moving_averages", ma.nbytes)
+        profile.add("moving_averages", time.perf_counter() - started)
+
+    runs = mean_reversion_arrays(price, quarter, timestamps, ma, ma_length, baseline_initial, order_sizing,
+                                 starting_capital, thresholds, shorting_allowed, fixed_fee, False, annual_taxes,
+                                 tax_percentage, fee, fee_schedule, abort_criteria, profile)
+
+    results = [run[0] for run in runs]
+    for backtest_results in results:
+        backtest_results['balance_data'] = NO_BALANCE_DATA
+
+    return results
+
+
+def mean_reversion_array_backtest(sampled_data,
+                                  order_sizing,
+                                  ma_length,
+                                  starting_capital,
+                                  buy_threshold,
+                                  take_profit,
+                                  stop_loss,
+                                  shorting_allowed,
+                                  fixed_fee,
+                                  display_results,
+                                  record_balance,
+                                  show_moving_averages,
+                                  annual_taxes,
+                                  tax_percentage = 0,
+                                  fee = 0,
+                                  fee_schedule = None,
+                                  ma_cache = None,
+                                  abort_criteria = None,
+                                  profile = False,
+                                  balance_stride = 1,
+                                  balance_dtype = "float64"
+                                  ):
+    """
+    engine="array" implementation of mean_reversion_backtester(), see there for the parameters.
+    """
+    baseline_initial = float(sampled_data['price'][0])
+    price, quarter, timestamps = extract_backtest_arrays(sampled_data)
+
+    backtest_profile = BacktestProfile() if profile else None
+    if profile:
+        started = time.perf_counter()
+    ma = moving_average(price, ma_length) if ma_cache is None else ma_cache.get(ma_length)
+
+    if profile:
+        if ma_cache is None:
+            backtest_profile.allocate("moving_averages", ma.nbytes)
+        backtest_profile.add("moving_averages", time.perf_counter() - started)
+
+    backtest_results, simulation = mean_reversion_arrays(price, quarter, timestamps, ma, ma_length, baseline_initial,
+                                                         order_sizing, starting_capital,
+                                                         [(buy_threshold, take_profit, stop_loss)], shorting_allowed,
+                                                         fixed_fee, record_balance, annual_taxes, tax_percentage,
+                                                         fee, fee_schedule, abort_criteria, backtest_profile,
+                                                         balance_stride, balance_dtype)[0]
+    if profile:
+        backtest_results['profile'] = backtest_profile.to_dict()
+
+    if record_balance == True:
+        balance_bars = simulation['balance_bars']
+        if balance_bars is None:
+            balance_bars = slice(None)
+        balance_data = {"time": timestamps[ma_length:][balance_bars],
+                        "Mean Reversion": simulation['portfolio_balance'],
+                        "Baseline": simulation['baseline_balance']}
+        if display_results == True:
+            plot_balance_data(balance_data)
+    else:
+        balance_data = NO_BALANCE_DATA
+
+    backtest_results['balance_data'] = balance_data
+
+    return backtest_results
+
+
+def mean_reversion_backtester(sampled_data, 
+                            order_sizing, 
+                            ma_length, 
+                            starting_capital,
+                            buy_threshold,
+                            take_profit,
+                            stop_loss,
+                            shorting_allowed,
+                            fixed_fee,
+                            display_results,
+                            record_balance,
+                            show_moving_averages,
+                            annual_taxes,
+                            tax_percentage = 0,
+                            fee=0,
+                            engine="array",
+                            fee_schedule=None,
+                            ma_cache=None,
+                            abort_criteria=None,
+                            result_store=None,
+                            profile=False,
+                            balance_stride=1,
+                            balance_dtype="float64",
+                            bar_minutes=60
+                            ):
+    """ 
+    Parameters:
+        sampled_data: pandas dataframe that must have columns 'timestamp' and 'price'
+        order_sizing: how much of available capital to use on a given trade (betwen 0 and 1)
+        ma_length: moving average length (in hours)
+        starting_capital: how much capital to start with (USD)
+        buy_threshold: at what % below the moving average to buy (if 5%, should be 0.05)
+        take_profit: at what % gain to sell and take the profit (if 5%, should be 0.05)
+        stop_loss: at what % to sell and stop losses (if 5%, should be 0.05)
+        shorting_allowed: whether or not to short or sell regularly (true or false)
+        fee: the % charged per transaction by the exchange (in %, so 0.01 = 1%)
+        record_balance: whether or not to track the balance over the whole period
+        show_moving_averages: whether or not to show the moving averages in the plot displayed (true or false)
+        annual_taxes: whether or not to take annual taxes on gains (true or false)
+        tax_percentage: if taxes are enabled, what % of taxes to pay on gains (0.01 = 1%), default = 0
+        engine: "array" runs the numpy array-backed simulation core, "pandas" walks the dataframe bar by bar
+            (the original implementation, kept as a reference). Both return identical results. default = "array"
+        fee_schedule: FeeSchedule with the volume fee tiers used when fixed_fee is false, default = DEFAULT_FEE_SCHEDULE
+        ma_cache: MovingAverageCache built on sampled_data's prices, the array engine takes its moving averages
+            from it instead of computing them with pandas (handy when running many backtests on one dataset), default = None
+        abort_criteria: AbortCriteria to stop the run early when a drawdown, equity or trade limit is hit (array
+            engine only). Stopped runs are flagged with 'aborted' and the 'abort_bar' they stopped on, default = None
+        result_store: BacktestResultStore to look the result up in before running and to save it to after,
+            only used when display_results, record_balance and profile are false, default = None
+        profile: time every phase of the run and count its allocations (array engine only), the results get a
+            'profile' section (see BacktestProfile.to_dict()), default = False
+        balance_stride: with record_balance, record the balance of every balance_stride-th bar, or only of the
+            first bar of every "month" or "quarter", default = 1 (every bar)
+        balance_dtype: "float64" or "float32", the type of the recorded balances, default = "float64"
+        bar_minutes: length of the bars of sampled_data in minutes (1 for get_bitcoin_minute_data()), the moving
+            average lengths and the fee window are given in hours and converted to bars of this length, default = 60
+    Returns:
+        backtest_results: dictionary that contains backtest result metrics and balance information. With
+            record_balance, 'balance_data' is a dict of numpy arrays: the 'time' of the recorded bars and the
+            balance of the strategy and of the 'Baseline' on them (pd.DataFrame(balance_data) makes it a table)
+    """
+
+    if fee_schedule is None:
+        fee_schedule = DEFAULT_FEE_SCHEDULE
+    
+    
+    # Ensure inputs are valid
+    if "timestamp" not in sampled_data.columns:
+        return "Could not run ma_crossover_backtester(), 'timestamp' column missing from data."
+    if "price" not in sampled_data.columns:
+        return "Could not run ma_crossover_backtester(), 'price' column missing from data."
+    if starting_capital <= 0:
+        return "Could not run ma_crossover_backtester(), starting_capital must be greater than zero."
+    if order_sizing > 1 or order_sizing <= 0:
+        return "Could not run ma_crossover_backtester(), order_sizing must be between 1 and 0."
+    if engine not in ["array", "pandas"]:
+        return "Could not run ma_crossover_backtester(), engine must be either 'array' or 'pandas'."
+    if ma_cache is not None and ma_cache.length != len(sampled_data.index):
+        return "Could not run ma_crossover_backtester(), ma_cache was built for a different dataset."
+    if abort_criteria is not None and engine != "array":
+        return "Could not run ma_crossover_backtester(), abort_criteria is only supported by the 'array' engine."
+    if profile and engine != "array":
+        return "Could not run ma_crossover_backtester(), profile is only supported by the 'array' engine."
+    if not valid_balance_stride(balance_stride):
+        return "Could not run ma_crossover_backtester(), balance_stride must be a positive number of bars, 'month' or 'quarter'."
+    if balance_dtype not in BALANCE_DTYPES:
+        return "Could not run ma_crossover_backtester(), balance_dtype must be either 'float64' or 'float32'."
+    if bar_minutes <= 0:
+        return "Could not run ma_crossover_backtester(), bar_minutes must be greater than zero."
+
+    # from here on the lengths are in bars (stored results are keyed by them too)
+    if bar_minutes != HOUR_MINUTES:
+        fee_schedule = fee_schedule.for_bar_minutes(bar_minutes)
+        ma_length = hours_to_bars(ma_length, bar_minutes)
+
+    # a profiled run is always simulated, a stored result has nothing to profile (and no recorded balance)
+    if result_store is not None and display_results == False and record_balance != True and not profile:
+        settings = backtest_settings(fee_schedule, abort_criteria, order_sizing=order_sizing, ma_length=ma_length,
+                                     starting_capital=starting_capital, buy_threshold=buy_threshold,
+                                     take_profit=take_profit, stop_loss=stop_loss, shorting_allowed=shorting_allowed,
+                                     fixed_fee=fixed_fee, annual_taxes=annual_taxes, tax_percentage=tax_percentage,
+                                     fee=fee, ma_cache=ma_cache is not None)
+        key = backtest_result_key("mean reversion", settings, sampled_data)
+        backtest_results = result_store.get(key)
+        if backtest_results is None:
+            backtest_results = mean_reversion_backtester(sampled_data, order_sizing, ma_length, starting_capital,
+                                                         buy_threshold, take_profit, stop_loss, shorting_allowed,
+                                                         fixed_fee, display_results, record_balance,
+                                                         show_moving_averages, annual_taxes, tax_percentage, fee,
+                                                         engine, fee_schedule, ma_cache, abort_criteria)
+            result_store.put(key, "mean reversion", backtest_results)
+        return backtest_results
+
+    if engine == "array":
+        return mean_reversion_array_backtest(sampled_data, order_sizing, ma_length, starting_capital, buy_threshold,
+                                             take_profit, stop_loss, shorting_allowed, fixed_fee, display_results,
+                                             record_balance, show_moving_averages, annual_taxes, tax_percentage, fee,
+                                             fee_schedule, ma_cache, abort_criteria, profile, balance_stride,
+                                             balance_dtype)
+    
+    
+    fiat = starting_capital
+    position_size = 0
+    baseline_position_size = 0
+    moves = [] #keep track of buys and sells
+    trades = 0
+    purchase_price = 0
+    wins = 0
+    losses = 0
+
+    # setup for keeping track of quarterly results
+    three_month_hours = 2191
+    one_month_hours = 730 #actually 730.5 
+    quarter_numbers = []
+    quarter_return_rates = []
+    quarter_trades = []
+    quarter_hit_rates = []
+    baseline_return_rates = []
+
+    monthly_return_rates = []
+
+    # calculate the total number of quarters in the dataset
+    total_quarters = max(list(sampled_data['quarter']))
+    # total_months = math.floor(len(sampled_data.index)/one_month_hours)
+
+    # calculate quarter intervals
+    # quarter_intervals = [three_month_hours*x for x in range(0, total_quarters)]
+    # monthly_intervals = [one_month_hours*x for x in range(0, total_months)]
+
+    # convert to get the corresponding timestamps
+    # quarter_intervals = [crypto_df.iloc[x]['timestamp'] for x in quarter_intervals]
+    # monthly_intervals = [crypto_df.iloc[x]['timestamp'] for x in monthly_intervals]
+    
+    current_price = sampled_data['price'][0]
+    baseline_position_size = starting_capital/current_price
+    baseline_initial = current_price
+
+    ma = sampled_data.price.rolling(ma_length).mean()
+
+    #truncate the data so they all are aligned 
     ma = list(ma[ma_length:])
     sampled_data = sampled_data[ma_length:]
     last_average_higher = "None"
@@ -305,12 +2948,26 @@ def mean_reversion_backtester(sampled_data,
     short_results = []
 
     # set up volume data
-    thirty_day_volume = 0
-    volume_data = []
+    rolling_volume = RollingVolume(fee_schedule.window)
 
     # set up tax information, when the year changes, we check if we gained or lost for the year, and then put that aside for taxes
     sampled_data['timestamp'] = pd.to_datetime(sampled_data['timestamp'])
 
+    # set up the risk metrics, the portfolio value of every hour is streamed into equity_metrics
+    timestamps = sampled_data['timestamp'].to_numpy(dtype="datetime64[ns]")
+    equity_metrics = EquityMetrics(starting_capital, build_calendar_index(timestamps)['month_starts'],
+                                   find_change_bars(sampled_data['quarter'].to_numpy(), 1))
+    exposed_bars = 0
+
+    # the balance of every recorded bar is written into preallocated arrays
+    if record_balance == True:
+        balance_bars = find_balance_bars(balance_stride, sampled_data['quarter'].to_numpy(), timestamps)
+        portfolio_balance = np.empty(len(balance_bars), dtype=balance_dtype) #keeps track of the total portfolio worth
+        baseline_balance = np.empty(len(balance_bars), dtype=balance_dtype) #keeps track of the buy and hold balance
+        baseline_balance[:] = baseline_position_size*sampled_data['price'].to_numpy(dtype=np.float64)[balance_bars]
+        balance_bars = balance_bars.tolist()
+        next_balance = 0
+
     past_year = sampled_data.iloc[0]['timestamp'].year
     annual_change = 0
     past_quarter = 1
@@ -320,7 +2977,7 @@ def mean_reversion_backtester(sampled_data,
 
         # calculate the fee using the thirty_day_volume
         if not fixed_fee:
-            fee = find_fee(thirty_day_volume)
+            fee = fee_schedule.find_fee(rolling_volume.volume(x))
 
         #get the current price
         current_price = sampled_data.iloc[x]['price']
@@ -367,12 +3024,6 @@ def mean_reversion_backtester(sampled_data,
             
             past_year = current_year
         
-        # if a new month begins, calculate the return for that month (for sharpe ratio calculations)
-        # if sampled_data.iloc[x]['timestamp'] in monthly_intervals:
-        #     monthly_return_rate = ((fiat + current_price*position_size)/monthly_initial_balance) - 1
-        #     monthly_return_rates.append(monthly_return_rate)
-        #     monthly_initial_balance = fiat + current_price*position_size
-
         # If a new quarter begins, calculate metrics for the quarter
         if current_quarter != past_quarter:
             quarter_return_rate = ((fiat + current_price*position_size)/quarter_initial_balance) - 1
@@ -458,29 +3109,21 @@ def mean_reversion_backtester(sampled_data,
         if shorting_allowed == True:
             #record the portfolio information
             if short_position == False or short_position == None:
-                if record_balance == True:
-                    portfolio_balance.append(position_size*current_price + fiat)
+                balance = position_size*current_price + fiat
             if short_position == True:
                 short_delta = (purchase_price*position_size - current_price*position_size)
-                if record_balance == True:
-                    portfolio_balance.append(purchase_price*position_size + short_delta + fiat)
+                balance = purchase_price*position_size + short_delta + fiat
         else:
             #record the portfolio information
-            if record_balance == True:
-                portfolio_balance.append(position_size*current_price + fiat)
-            
-        if record_balance == True:
-            baseline_balance.append(baseline_position_size*current_price)
-
-        # go through the volume data
-        thirty_day_volume = 0 # re-calculate the current thirty_day_volume
-        new_volume_data = []
-        for volume_data_entry in volume_data:
-            if volume_data_entry[0] < 720: # 720 hours in thirty days
-                thirty_day_volume = thirty_day_volume + volume_data_entry[1]
-                new_volume_data.append([volume_data_entry[0] + 1, volume_data_entry[1]])
-        
-        volume_data = new_volume_data
+            balance = position_size*current_price + fiat
+
+        if record_balance == True and next_balance < len(balance_bars) and balance_bars[next_balance] == x:
+            portfolio_balance[next_balance] = balance
+            next_balance = next_balance + 1
+        equity_metrics.append(balance)
+        if position_size != 0:
+            exposed_bars = exposed_bars + 1
+
         
     
     # compute final results
@@ -492,20 +3135,18 @@ def mean_reversion_backtester(sampled_data,
     else:
         hit_rate = "N/A"
 
-    # calculate sharpe ratio (using 0% as the risk-free return benchmark)
-    #sharpe_ratio = (statistics.mean(monthly_return_rates)-0)/(statistics.stdev(monthly_return_rates)*np.sqrt(12))
-    sharpe_ratio = None
-
-    if display_results == True and record_balance == True:
-        plot_data = pd.DataFrame()
-        plot_data['time'] = sampled_data['timestamp']
-        plot_data['Mean Reversion'] = portfolio_balance
-        plot_data['Baseline'] = baseline_balance
-        plot_data.plot(x = "time")
-        plt.xticks(rotation="vertical")
-        plt.show()
+    # calculate the sharpe ratio (using 0% as the risk-free return benchmark), drawdowns, ... from the portfolio value
+    risk = backtest_risk_metrics(equity_metrics, exposed_bars,
+                                 baseline_position_size*sampled_data['price'].to_numpy(dtype=np.float64), timestamps)
+
+    if record_balance == True:
+        balance_data = {"time": timestamps[balance_bars],
+                        "Mean Reversion": portfolio_balance,
+                        "Baseline": baseline_balance}
+        if display_results == True:
+            plot_balance_data(balance_data)
     else:
-        plot_data = "Could not generate plot_data: display_results and/or record_balance was set to False."
+        balance_data = NO_BALANCE_DATA
 
     # calculate quarters_beating_baseline
     count = 0
@@ -524,13 +3165,17 @@ def mean_reversion_backtester(sampled_data,
                "quarter_trades": quarter_trades,
                "quarter_hit_rates": quarter_hit_rates,
                "baseline_return_rates": baseline_return_rates,
-               "balance_data": plot_data,
-               "sharpe_ratio": sharpe_ratio,
+               "balance_data": balance_data,
+               "sharpe_ratio": risk['sharpe_ratio'],
                 "quarters_beating_baseline": quarters_beating_baseline,
                "strategy_quarterly_stdev": statistics.stdev(quarter_return_rates),
-               "baseline_quarterly_stdev": statistics.stdev(baseline_return_rates)
+               "baseline_quarterly_stdev": statistics.stdev(baseline_return_rates),
+               "aborted": False,
+               "abort_bar": None,
+               "abort_reason": None
 
     }
+    backtest_results.update(risk)
     
     return backtest_results
 
@@ -547,7 +3192,16 @@ def sma_crossover_backtester(sampled_data,
                             show_moving_averages,
                             annual_taxes,
                             tax_percentage = 0,
-                            fee=0
+                            fee=0,
+                            engine="array",
+                            fee_schedule=None,
+                            ma_cache=None,
+                            abort_criteria=None,
+                            result_store=None,
+                            profile=False,
+                            balance_stride=1,
+                            balance_dtype="float64",
+                            bar_minutes=60
                             ):
     """ 
     Parameters:
@@ -556,7 +3210,8 @@ def sma_crossover_backtester(sampled_data,
         ma1_length: moving average 1 length (in hours)
         ma2_length: moving average 2 length (in hours, must be longer than ma1_length)
         starting_capital: how much capital to start with (USD)
-        display_results: plot the portfolio value over time (true or false)
+        display_results: plot the portfolio value over time (true or false), long histories are drawn
+            downsampled (see plot_balance_data()), balance_data keeps every recorded bar
         shorting_allowed: whether or not to short or sell regularly (true or false)
         fixed_fee: whether to use volume based fee or a fixed fee (true or false)
         fee: if fixed fee, the % charged per transaction by the exchange (0.01 = 1%), default = 0
@@ -564,38 +3219,31 @@ def sma_crossover_backtester(sampled_data,
         show_moving_averages: whether or not to show the moving averages in the plot displayed (true or false)
         annual_taxes: whether or not to take annual taxes on gains (true or false)
         tax_percentage: if taxes are enabled, what % of taxes to pay on gains (0.01 = 1%), default = 0
+        engine: "array" runs the numpy array-backed simulation core, "pandas" walks the dataframe bar by bar
+            (the original implementation, kept as a reference). Both return identical results. default = "array"
+        fee_schedule: FeeSchedule with the volume fee tiers used when fixed_fee is false, default = DEFAULT_FEE_SCHEDULE
+        ma_cache: MovingAverageCache built on sampled_data's prices, the array engine takes its moving averages
+            from it instead of computing them with pandas (handy when running many backtests on one dataset), default = None
+        abort_criteria: AbortCriteria to stop the run early when a drawdown, equity or trade limit is hit (array
+            engine only). Stopped runs are flagged with 'aborted' and the 'abort_bar' they stopped on, default = None
+        result_store: BacktestResultStore to look the result up in before running and to save it to after,
+            only used when display_results, record_balance and profile are false, default = None
+        profile: time every phase of the run and count its allocations (array engine only), the results get a
+            'profile' section (see BacktestProfile.to_dict()), default = False
+        balance_stride: with record_balance, record the balance of every balance_stride-th bar, or only of the
+            first bar of every "month" or "quarter", default = 1 (every bar)
+        balance_dtype: "float64" or "float32", the type of the recorded balances, default = "float64"
+        bar_minutes: length of the bars of sampled_data in minutes (1 for get_bitcoin_minute_data()), the moving
+            average lengths and the fee window are given in hours and converted to bars of this length, default = 60
     Returns:
-        backtest_results: dictionary that contains backtest result metrics and balance information 
-    """
-
-    # for figuring out how much a fee is
-    # we are taking the average of maker and taker fees on coinbase pro starting on 6/5/23
-    def find_fee(thirty_day_volume):
-        volume_fee_table = {
-            10000: 0.005,
-            50000: 0.00325,
-            100000: 0.002,
-            1000000: 0.0015,
-            15000000: 0.0013,
-            75000000: 0.0011,
-            250000000: 0.00075,
-            400000000: 0.0004,
-        }
-        
-        for volume, fee in volume_fee_table.items():
-            if thirty_day_volume <= volume:
-                return fee
-        
-        # If the volume is greater than the largest key, return the fee for the largest key
-        return volume_fee_table[400000000]
+        backtest_results: dictionary that contains backtest result metrics and balance information. With
+            record_balance, 'balance_data' is a dict of numpy arrays: the 'time' of the recorded bars and the
+            balance of the strategy and of the 'Baseline' on them (pd.DataFrame(balance_data) makes it a table)
+    """
+
+    if fee_schedule is None:
+        fee_schedule = DEFAULT_FEE_SCHEDULE
 
-    
-    import math 
-    import statistics 
-    import numpy as np
-    from matplotlib import rcParams
-    rcParams['figure.figsize'] = 15,8
-    
     # Ensure inputs are valid
     if "timestamp" not in sampled_data.columns:
         return "Could not run ma_crossover_backtester(), 'timestamp' column missing from data."
@@ -607,13 +3255,55 @@ def sma_crossover_backtester(sampled_data,
         return "Could not run ma_crossover_backtester(), starting_capital must be greater than zero."
     if order_sizing > 1 or order_sizing <= 0:
         return "Could not run ma_crossover_backtester(), order_sizing must be between 1 and 0."
+    if engine not in ["array", "pandas"]:
+        return "Could not run ma_crossover_backtester(), engine must be either 'array' or 'pandas'."
+    if ma_cache is not None and ma_cache.length != len(sampled_data.index):
+        return "Could not run ma_crossover_backtester(), ma_cache was built for a different dataset."
+    if abort_criteria is not None and engine != "array":
+        return "Could not run ma_crossover_backtester(), abort_criteria is only supported by the 'array' engine."
+    if profile and engine != "array":
+        return "Could not run ma_crossover_backtester(), profile is only supported by the 'array' engine."
+    if not valid_balance_stride(balance_stride):
+        return "Could not run ma_crossover_backtester(), balance_stride must be a positive number of bars, 'month' or 'quarter'."
+    if balance_dtype not in BALANCE_DTYPES:
+        return "Could not run ma_crossover_backtester(), balance_dtype must be either 'float64' or 'float32'."
+    if bar_minutes <= 0:
+        return "Could not run ma_crossover_backtester(), bar_minutes must be greater than zero."
+
+    # from here on the lengths are in bars (stored results are keyed by them too)
+    if bar_minutes != HOUR_MINUTES:
+        fee_schedule = fee_schedule.for_bar_minutes(bar_minutes)
+        ma1_length = hours_to_bars(ma1_length, bar_minutes)
+        ma2_length = hours_to_bars(ma2_length, bar_minutes)
+
+    # a profiled run is always simulated, a stored result has nothing to profile (and no recorded balance)
+    if result_store is not None and display_results == False and record_balance != True and not profile:
+        settings = backtest_settings(fee_schedule, abort_criteria, order_sizing=order_sizing, ma1_length=ma1_length,
+                                     ma2_length=ma2_length, starting_capital=starting_capital,
+                                     shorting_allowed=shorting_allowed, fixed_fee=fixed_fee,
+                                     annual_taxes=annual_taxes, tax_percentage=tax_percentage, fee=fee,
+                                     ma_cache=ma_cache is not None)
+        key = backtest_result_key("simple moving average crossover", settings, sampled_data)
+        backtest_results = result_store.get(key)
+        if backtest_results is None:
+            backtest_results = sma_crossover_backtester(sampled_data, order_sizing, ma1_length, ma2_length,
+                                                        starting_capital, display_results, shorting_allowed,
+                                                        fixed_fee, record_balance, show_moving_averages,
+                                                        annual_taxes, tax_percentage, fee, engine, fee_schedule,
+                                                        ma_cache, abort_criteria)
+            result_store.put(key, "simple moving average crossover", backtest_results)
+        return backtest_results
+
+    if engine == "array":
+        return sma_crossover_array_backtest(sampled_data, order_sizing, ma1_length, ma2_length, starting_capital,
+                                            display_results, shorting_allowed, fixed_fee, record_balance,
+                                            show_moving_averages, annual_taxes, tax_percentage, fee, fee_schedule,
+                                            ma_cache, abort_criteria, profile, balance_stride, balance_dtype)
     
     
     fiat = starting_capital
     position_size = 0
     baseline_position_size = 0
-    portfolio_balance = [] #keeps track of the total portfolio worth
-    baseline_balance = [] #keeps track of the buy and hold balance
     moves = [] #keep track of buys and sells
     trades = 0
     purchase_price = 0
@@ -663,12 +3353,26 @@ def sma_crossover_backtester(sampled_data,
     short_results = []
 
     # set up volume data
-    thirty_day_volume = 0
-    volume_data = []
+    rolling_volume = RollingVolume(fee_schedule.window)
 
     # set up tax information, when the year changes, we check if we gained or lost for the year, and then put that aside for taxes
     sampled_data['timestamp'] = pd.to_datetime(sampled_data['timestamp'])
 
+    # set up the risk metrics, the portfolio value of every hour is streamed into equity_metrics
+    timestamps = sampled_data['timestamp'].to_numpy(dtype="datetime64[ns]")
+    equity_metrics = EquityMetrics(starting_capital, build_calendar_index(timestamps)['month_starts'],
+                                   find_change_bars(sampled_data['quarter'].to_numpy(), 1))
+    exposed_bars = 0
+
+    # the balance of every recorded bar is written into preallocated arrays
+    if record_balance == True:
+        balance_bars = find_balance_bars(balance_stride, sampled_data['quarter'].to_numpy(), timestamps)
+        portfolio_balance = np.empty(len(balance_bars), dtype=balance_dtype) #keeps track of the total portfolio worth
+        baseline_balance = np.empty(len(balance_bars), dtype=balance_dtype) #keeps track of the buy and hold balance
+        baseline_balance[:] = baseline_position_size*sampled_data['price'].to_numpy(dtype=np.float64)[balance_bars]
+        balance_bars = balance_bars.tolist()
+        next_balance = 0
+
     past_year = sampled_data.iloc[0]['timestamp'].year
     annual_change = 0
     past_quarter = 1
@@ -678,7 +3382,7 @@ def sma_crossover_backtester(sampled_data,
 
         # calculate the fee using the thirty_day_volume
         if not fixed_fee:
-            fee = find_fee(thirty_day_volume)
+            fee = fee_schedule.find_fee(rolling_volume.volume(x))
 
         #get the current price
         current_price = sampled_data.iloc[x]['price']
@@ -725,12 +3429,6 @@ def sma_crossover_backtester(sampled_data,
             
             past_year = current_year
         
-        # if a new month begins, calculate the return for that month (for sharpe ratio calculations)
-        # if sampled_data.iloc[x]['timestamp'] in monthly_intervals:
-        #     monthly_return_rate = ((fiat + current_price*position_size)/monthly_initial_balance) - 1
-        #     monthly_return_rates.append(monthly_return_rate)
-        #     monthly_initial_balance = fiat + current_price*position_size
-
         # If a new quarter begins, calculate metrics for the quarter
         if current_quarter != past_quarter:
             quarter_return_rate = ((fiat + current_price*position_size)/quarter_initial_balance) - 1
@@ -791,9 +3489,7 @@ def sma_crossover_backtester(sampled_data,
                 position_size = position_size + (order_sizing*fiat*(1 - fee))/current_price #add the btc purchased
                 
                 # record the volume information (the amount purchased)
-                volume_data.append([
-                    0,(order_sizing*fiat*(1 - fee))/current_price
-                ])
+                rolling_volume.add(x, (order_sizing*fiat*(1 - fee))/current_price)
 
                 fiat = fiat - order_sizing*fiat #subtract the amount of capital used
                 #moves.append("Buy")
@@ -808,9 +3504,7 @@ def sma_crossover_backtester(sampled_data,
                 position_size = 0
 
                 # record the volume information (the amount sold)
-                volume_data.append([
-                    0,position_size*current_price*(1 - fee)
-                ])
+                rolling_volume.add(x, position_size*current_price*(1 - fee))
 
                 if shorting_allowed == True:
                     position_size = (order_sizing*fiat*(1 - fee))/current_price
@@ -825,120 +3519,724 @@ def sma_crossover_backtester(sampled_data,
 
                 trades = trades + 1
 
-                # record whether the trade was profitable
-                if purchase_price < current_price:
-                    wins = wins + 1 
-                else:
-                    losses = losses + 1
-                
+                # record whether the trade was profitable
+                if purchase_price < current_price:
+                    wins = wins + 1 
+                else:
+                    losses = losses + 1
+                
+
+            else:
+                pass
+                #moves.append("Pass")
+
+        if shorting_allowed == True:
+            #record the portfolio information
+            if short_position == False or short_position == None:
+                balance = position_size*current_price + fiat
+            if short_position == True:
+                short_delta = (purchase_price*position_size - current_price*position_size)
+                balance = purchase_price*position_size + short_delta + fiat
+        else:
+            #record the portfolio information
+            balance = position_size*current_price + fiat
+
+        if record_balance == True and next_balance < len(balance_bars) and balance_bars[next_balance] == x:
+            portfolio_balance[next_balance] = balance
+            next_balance = next_balance + 1
+        equity_metrics.append(balance)
+        if position_size != 0:
+            exposed_bars = exposed_bars + 1
+        
+        #record which moving average was higher this moment
+        last_average_higher = current_average_higher
+
+
+    
+    # compute final results
+    baseline_final = current_price
+    baseline_return_rate = (baseline_final/baseline_initial) - 1    
+    final_return_rate = ((position_size*current_price + fiat)/starting_capital) - 1
+    if (losses + wins) > 0:
+        hit_rate = wins/(losses + wins)
+    else:
+        hit_rate = "N/A"
+
+    # calculate the sharpe ratio (using 0% as the risk-free return benchmark), drawdowns, ... from the portfolio value
+    risk = backtest_risk_metrics(equity_metrics, exposed_bars,
+                                 baseline_position_size*sampled_data['price'].to_numpy(dtype=np.float64), timestamps)
+
+    if record_balance == True:
+        balance_data = {"time": timestamps[balance_bars],
+                        "Baseline": baseline_balance,
+                        "SMA Crossover": portfolio_balance}
+        if show_moving_averages:
+            balance_data["MA1"] = (np.asarray(ma1)[balance_bars]*baseline_position_size).astype(balance_dtype)
+            balance_data["MA2"] = (np.asarray(ma2)[balance_bars]*baseline_position_size).astype(balance_dtype)
+        if display_results == True:
+            plot_balance_data(balance_data)
+    else:
+        balance_data = NO_BALANCE_DATA
+
+    # calculate quarters_beating_baseline
+    count = 0
+    for x in range(0, len(quarter_return_rates)):
+        # we round so that a difference of 0.0000000001, etc. won't bring it over the edge.
+        if round(quarter_return_rates[x],2) > round(baseline_return_rates[x],2):
+            count = count + 1
+    
+    quarters_beating_baseline = round(count/len(quarter_return_rates), 2)
+
+    # return the results
+    backtest_results = {"final_return_rate" : final_return_rate,
+               "hit_rate": hit_rate,
+               "baseline_return_rate": baseline_return_rate,
+               "quarter_return_rates": quarter_return_rates, 
+               "quarter_trades": quarter_trades,
+               "quarter_hit_rates": quarter_hit_rates,
+               "baseline_return_rates": baseline_return_rates,
+               "balance_data": balance_data,
+               "sharpe_ratio": risk['sharpe_ratio'],
+               "quarters_beating_baseline": quarters_beating_baseline,
+               "strategy_quarterly_stdev": statistics.stdev(quarter_return_rates),
+               "baseline_quarterly_stdev": statistics.stdev(baseline_return_rates),
+               "aborted": False,
+               "abort_bar": None,
+               "abort_reason": None
+
+    }
+    backtest_results.update(risk)
+    
+    return backtest_results
+
+
+# where SharedDataset puts its arrays, /dev/shm is memory backed on linux so workers map the same pages
+SHARED_DATASET_DIRECTORY = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# read-only arrays attached in each worker process by attach_shared_dataset()
+SHARED_DATASET = None
+
+
+class SharedDataset:
+    """
+    Write the arrays the backtesters walk over (price, quarter and timestamp) to .npy files once, so worker
+    processes can memory map them instead of each receiving a pickled copy of the whole dataframe. Every
+    worker maps the same pages, so the dataset is only held in memory once no matter how many workers run.
+
+    Arguments:
+        crypto_df: pandas dataframe with 'timestamp', 'price' and 'quarter' columns
+        directory: where to create the files, default = SHARED_DATASET_DIRECTORY (/dev/shm when available)
+        ma_cache_bytes: memory budget of the MovingAverageCache of every worker, default = MOVING_AVERAGE_CACHE_BYTES
+    Use as a context manager (or call close()) so the files are removed when the sweep is done.
+    """
+
+    def __init__(self, crypto_df, directory=None, ma_cache_bytes=MOVING_AVERAGE_CACHE_BYTES):
+        if directory is None:
+            directory = SHARED_DATASET_DIRECTORY
+        self.path = tempfile.mkdtemp(prefix="crypto_backtesting_", dir=directory)
+
+        price, quarter, timestamps = extract_backtest_arrays(crypto_df)
+        np.save(os.path.join(self.path, "price.npy"), price)
+        np.save(os.path.join(self.path, "quarter.npy"), quarter)
+        np.save(os.path.join(self.path, "timestamp.npy"), timestamps)
+
+        # the handle is all a worker needs to attach, it is tiny to pickle
+        self.handle = {"path": self.path, "baseline_initial": float(crypto_df['price'][0]),
+                       "ma_cache_bytes": ma_cache_bytes}
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_shared_dataset(handle):
+    """
+    Process pool initializer, memory maps the arrays of a SharedDataset read-only into SHARED_DATASET and
+    sets up a MovingAverageCache on them, so the moving averages (and the buy and hold baseline's risk metrics,
+    see BaselineRisk) are shared by all the runs of this worker.
+
+    Arguments:
+        handle: SharedDataset.handle, or a dictionary with the arrays themselves (see dataset_handle()) for
+            workers that can't reach the SharedDataset files
+    """
+    global SHARED_DATASET
+
+    dataset = {"baseline_initial": handle["baseline_initial"],
+               "ma_cache_bytes": handle.get("ma_cache_bytes", MOVING_AVERAGE_CACHE_BYTES)}
+    for column in ["price", "quarter", "timestamp"]:
+        if "path" in handle:
+            dataset[column] = np.load(os.path.join(handle["path"], column + ".npy"), mmap_mode='r').view(np.ndarray)
+        else:
+            dataset[column] = handle[column]
+    dataset["ma_cache"] = MovingAverageCache(dataset["price"], dataset["ma_cache_bytes"])
+    # BaselineRisk of the first bars of the dataset, by bars (None for all of them)
+    dataset["baseline_risk"] = {}
+    # coarser copies made by run_shared_backtest(), by (bars, stride)
+    dataset["coarse"] = {}
+    SHARED_DATASET = dataset
+
+
+def dataset_handle(crypto_df, ma_cache_bytes=MOVING_AVERAGE_CACHE_BYTES):
+    """
+    Handle for attach_shared_dataset() that carries the arrays of crypto_df instead of the path of a
+    SharedDataset, for threads of this process or workers on other machines. ma_cache_bytes is the memory
+    budget of the MovingAverageCache of every worker.
+    """
+    price, quarter, timestamps = extract_backtest_arrays(crypto_df)
+
+    return {"baseline_initial": float(crypto_df['price'][0]), "price": price, "quarter": quarter, "timestamp": timestamps,
+            "ma_cache_bytes": ma_cache_bytes}
+
+
+# bumped whenever a change to the backtesters changes their results, stored results from other versions are dropped
+BACKTEST_ENGINE_VERSION = 2
+
+# default size limit of a BacktestResultStore
+RESULT_STORE_BYTES = 1024 * 1024 * 1024
+
+
+def backtest_result_key(strategy, settings, crypto_df):
+    """
+    Key a backtest result by its strategy, every setting that changes the result and the data it ran on.
+
+    Arguments:
+        strategy: "mean reversion" or "simple moving average crossover"
+        settings: dict of the backtest's parameters (moving average lengths, thresholds, fees, ...)
+        crypto_df: pandas dataframe the backtest ran on
+    Returns:
+        sha256 hex string
+    """
+    fingerprint = dataset_fingerprint(*extract_backtest_arrays(crypto_df))
+    # the baseline buys in at the price labelled 0, which depends on the index as well as the arrays
+    key = [strategy, settings, fingerprint, float(crypto_df['price'][0])]
+
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def backtest_settings(fee_schedule, abort_criteria, **settings):
+    """
+    Settings dict for backtest_result_key(), with the fee schedule and abort criteria spelled out.
+    """
+    settings['fee_schedule'] = [fee_schedule.breakpoints, fee_schedule.fees, fee_schedule.window]
+    settings['abort_criteria'] = None if abort_criteria is None else vars(abort_criteria)
+
+    return settings
+
+
+class BacktestResultStore:
+    """
+    SQLite file of backtest results keyed by backtest_result_key(), so backtests that were already run on the
+    same data with the same settings are looked up instead of simulated again.
+
+    Entries written by another BACKTEST_ENGINE_VERSION are dropped when the store is opened. When the stored
+    results grow past max_bytes, the least recently used ones are evicted.
+
+    Arguments:
+        path: sqlite file, default = BITCOIN_CACHE_DIRECTORY/backtest_results.sqlite
+        max_bytes: size limit of the stored results, default = RESULT_STORE_BYTES
+    """
+
+    def __init__(self, path=None, max_bytes=RESULT_STORE_BYTES):
+        if path is None:
+            path = os.path.join(BITCOIN_CACHE_DIRECTORY, "backtest_results.sqlite")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, strategy TEXT, "
+                                    "engine_version INTEGER, size INTEGER, last_used REAL, result BLOB)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self.connection.execute("DELETE FROM results WHERE engine_version != ?", (BACKTEST_ENGINE_VERSION,))
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def get(self, key):
+        """
+        Stored backtest_results for key (a fresh copy), or None.
+        """
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """
+        Stored backtest_results for each of keys, None where there is none.
+        """
+        found = {}
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self.connection.execute("SELECT key, result FROM results WHERE key IN (" + ",".join("?"*len(batch)) + ")", batch)
+            for key, result in rows:
+                found[key] = pickle.loads(result)
+
+        if found:
+            with self.connection:
+                now = time.time()
+                self.connection.executemany("UPDATE results SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+
+        return [found.get(key) for key in keys]
+
+    def put(self, key, strategy, backtest_results):
+        self.put_many([(key, strategy, backtest_results)])
+
+    def put_many(self, entries):
+        """
+        Store (key, strategy, backtest_results) entries, then evict the least recently used results if the
+        store grew past max_bytes.
+        """
+        now = time.time()
+        rows = []
+        for key, strategy, backtest_results in entries:
+            result = pickle.dumps(backtest_results, protocol=pickle.HIGHEST_PROTOCOL)
+            rows.append((key, strategy, BACKTEST_ENGINE_VERSION, len(result), now, result))
+
+        with self.connection:
+            for row in rows:
+                previous = self.connection.execute("SELECT size FROM results WHERE key = ?", (row[0],)).fetchone()
+                if previous is not None:
+                    self.total_bytes = self.total_bytes - previous[0]
+                self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)", row)
+                self.total_bytes = self.total_bytes + row[3]
+
+        if self.total_bytes > self.max_bytes:
+            self.evict(self.max_bytes)
+
+    def evict(self, max_bytes):
+        """
+        Delete the least recently used results until the store holds at most max_bytes.
+        """
+        evicted = []
+        for key, size in self.connection.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if self.total_bytes <= max_bytes:
+                break
+            evicted.append((key,))
+            self.total_bytes = self.total_bytes - size
+
+        with self.connection:
+            self.connection.executemany("DELETE FROM results WHERE key = ?", evicted)
+
+    def invalidate(self, strategy=None):
+        """
+        Delete every stored result, or only those of one strategy.
+        """
+        with self.connection:
+            if strategy is None:
+                self.connection.execute("DELETE FROM results")
+            else:
+                self.connection.execute("DELETE FROM results WHERE strategy = ?", (strategy,))
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def random_ma_length_generator(rng=None):
+    """
+    Generate random moving averages for optimization purposes.
+
+    Arguments:
+        rng: random.Random to draw from, default = None (the module level random functions)
+    """
+    if rng is None:
+        rng = random
+    num1 = rng.randrange(0, round(2191/2))
+    num2 = rng.randrange(0, round(2191/2))
+    while num2 < num1:
+        num2 = rng.randrange(0, round(2191/2))
+    
+    return num1, num2
+
+def random_backtest_parameters(strategy, rng=None):
+    """
+    Draw random parameters for one sweep run of a strategy.
+
+    Arguments:
+        strategy: "mean reversion" or "simple moving average crossover"
+        rng: random.Random to draw from, default = None (the module level random functions)
+    Returns:
+        parameters: dict, ma_length, buy_threshold, take_profit and stop_loss for mean reversion,
+            ma1_length and ma2_length for sma crossover
+    """
+    if rng is None:
+        rng = random
+
+    if strategy == "mean reversion":
+        stop_loss = round(rng.randrange(0, 100),2)/100
+        buy_threshold = round(rng.randrange(0, 100),2)/100
+        take_profit = round(rng.randrange(0, 100),2)/100
+        ma_length = rng.randrange(0, round(2191/2))
+        return {"ma_length": ma_length, "stop_loss": stop_loss, "buy_threshold": buy_threshold, "take_profit": take_profit}
+    elif strategy == "simple moving average crossover":
+        ma1_length, ma2_length = random_ma_length_generator(rng)
+        return {"ma1_length": ma1_length, "ma2_length": ma2_length}
+    else:
+        raise Exception("Error:", strategy, "is not valid, please select either 'simple moving average' or 'mean reversion'.")
+
+
+# values each sweep parameter can take, the same ones random_backtest_parameters() draws from
+MA_LENGTH_LEVELS = list(range(0, round(2191/2)))
+PERCENT_LEVELS = [round(x,2)/100 for x in range(0, 100)]
+PARAMETER_SPACES = {
+    "mean reversion": {"ma_length": MA_LENGTH_LEVELS, "stop_loss": PERCENT_LEVELS,
+                       "buy_threshold": PERCENT_LEVELS, "take_profit": PERCENT_LEVELS},
+    "simple moving average crossover": {"ma1_length": MA_LENGTH_LEVELS, "ma2_length": MA_LENGTH_LEVELS}
+}
+
+# Sobol direction numbers (s, a, m) for dimensions 2 to 8, from Joe and Kuo's new-joe-kuo-6.21201 table
+SOBOL_DIRECTIONS = [(1, 0, [1]), (2, 1, [1, 3]), (3, 1, [1, 3, 1]), (3, 2, [1, 1, 1]), (4, 1, [1, 1, 3, 3]),
+                    (4, 4, [1, 3, 5, 13]), (5, 2, [1, 1, 5, 5, 17])]
+
+SAMPLERS = ["random", "sobol", "latin hypercube", "grid"]
+
+
+def sobol_points(count, dimensions, start=0, seed=None):
+    """
+    Points start to start + count of the Sobol sequence in [0, 1)^dimensions.
+
+    Arguments:
+        count: how many points
+        dimensions: how many coordinates per point (up to 8)
+        start: index of the first point, so a sequence can be continued, default = 0
+        seed: if not None, every coordinate is XORed with a random 32 bit mask drawn from this seed
+            (a digital shift, which keeps the sequence's even coverage), default = None
+    Returns:
+        float64 array of shape (count, dimensions)
+    """
+    if dimensions > len(SOBOL_DIRECTIONS) + 1:
+        raise Exception("sobol_points() supports up to " + str(len(SOBOL_DIRECTIONS) + 1) + " dimensions.")
+
+    directions = np.zeros((dimensions, 32), dtype=np.uint64)
+    directions[0] = [1 << (31 - bit) for bit in range(32)]
+    for dimension in range(1, dimensions):
+        s, a, m = SOBOL_DIRECTIONS[dimension - 1]
+        v = [0]*32
+        for bit in range(32):
+            if bit < s:
+                v[bit] = m[bit] << (31 - bit)
+            else:
+                v[bit] = v[bit - s] ^ (v[bit - s] >> s)
+                for i in range(1, s):
+                    v[bit] ^= ((a >> (s - 1 - i)) & 1)*v[bit - i]
+        directions[dimension] = v
+
+    # point n is the XOR of the direction numbers of the set bits of n's gray code
+    index = np.arange(start, start + count, dtype=np.uint64)
+    gray = index ^ (index >> np.uint64(1))
+    points = np.zeros((count, dimensions), dtype=np.uint64)
+    for bit in range(32):
+        points ^= ((gray >> np.uint64(bit)) & np.uint64(1))[:, None]*directions[:, bit]
+
+    if seed is not None:
+        points ^= np.random.default_rng(seed).integers(0, 2**32, dimensions, dtype=np.uint64)
+
+    return points/2.0**32
+
+
+def latin_hypercube_points(count, dimensions, rng):
+    """
+    count points in [0, 1)^dimensions with exactly one point in each 1/count wide slice of every coordinate.
+
+    Arguments:
+        rng: numpy random Generator
+    """
+    strata = np.stack([rng.permutation(count) for dimension in range(dimensions)], axis=1)
+
+    return (strata + rng.random((count, dimensions)))/count
+
+
+def grid_points(levels, dimensions):
+    """
+    Centers of an evenly spaced grid with levels points on every coordinate, in [0, 1)^dimensions.
+    """
+    axis = (np.arange(levels) + 0.5)/levels
+    mesh = np.meshgrid(*[axis]*dimensions, indexing="ij")
+
+    return np.stack([coordinate.ravel() for coordinate in mesh], axis=1)
+
+
+def points_to_parameters(strategy, points):
+    """
+    Map points in [0, 1)^d onto the parameter levels of a strategy (see PARAMETER_SPACES).
+
+    Returns:
+        list of parameter dicts, with ma1_length <= ma2_length for sma crossover
+    """
+    space = PARAMETER_SPACES[strategy]
+    columns = []
+    for dimension, levels in enumerate(space.values()):
+        indices = np.minimum((points[:, dimension]*len(levels)).astype(np.int64), len(levels) - 1)
+        columns.append([levels[x] for x in indices])
+
+    parameters = [dict(zip(space, values)) for values in zip(*columns)]
+    if strategy == "simple moving average crossover":
+        for run in parameters:
+            if run['ma1_length'] > run['ma2_length']:
+                run['ma1_length'], run['ma2_length'] = run['ma2_length'], run['ma1_length']
+
+    return parameters
+
+
+def grid_parameters(strategy, levels):
+    """
+    Parameter sets on an evenly spaced grid with the given number of levels per parameter, without
+    duplicates (for sma crossover the pairs with equal lengths are left out, they never trade).
+    """
+    parameters = []
+    seen = set()
+    for run in points_to_parameters(strategy, grid_points(levels, len(PARAMETER_SPACES[strategy]))):
+        key = tuple(run.values())
+        if key in seen or (strategy == "simple moving average crossover" and run['ma1_length'] == run['ma2_length']):
+            continue
+        seen.add(key)
+        parameters.append(run)
+
+    return parameters
+
+
+def sample_parameters(strategy, num_runs, sampler="sobol", seed=None):
+    """
+    Generate the parameter sets of a sweep up front, without duplicates.
+
+    Samplers:
+        "random": the same draws as random_backtest_parameters(), from a random.Random(seed)
+        "sobol": the Sobol low discrepancy sequence (digitally shifted by seed), which covers the parameter
+            space much more evenly than random draws, so fewer runs tell the same story
+        "latin hypercube": every parameter's range is cut into num_runs slices with one run in each
+        "grid": an evenly spaced grid with as many levels per parameter as fit in num_runs (so usually fewer runs)
+
+    Arguments:
+        strategy: "mean reversion" or "simple moving average crossover"
+        num_runs: how many parameter sets
+        sampler: one of SAMPLERS, default = "sobol"
+        seed: makes the sample reproducible, default = None (a fresh sample every time, except for
+            "grid" and an unseeded "sobol", which are always the same)
+    Returns:
+        parameters: list of parameter dicts (keys as in PARAMETER_SPACES)
+    """
+    if strategy not in PARAMETER_SPACES:
+        raise Exception("Error:", strategy, "is not valid, please select either 'simple moving average' or 'mean reversion'.")
+    if sampler not in SAMPLERS:
+        raise Exception("Error:", sampler, "is not a valid sampler, please select one of", SAMPLERS)
+
+    dimensions = len(PARAMETER_SPACES[strategy])
+
+    rng = random.Random(seed)
+    numpy_rng = np.random.default_rng(seed)
+
+    if sampler == "grid":
+        levels = max(1, int(num_runs**(1/dimensions) + 1e-9))
+        grid = grid_parameters(strategy, levels)
+        # the sma triangle folds the grid onto itself, so more levels may fit
+        while len(grid_parameters(strategy, levels + 1)) <= num_runs:
+            levels = levels + 1
+            grid = grid_parameters(strategy, levels)
+
+    parameters = []
+    seen = set()
+    drawn = 0
+    # duplicates (several points landing on the same levels) are replaced by drawing more points
+    for attempt in range(20):
+        if sampler == "random":
+            batch = [random_backtest_parameters(strategy, rng) for x in range(num_runs - len(parameters))]
+        elif sampler == "sobol":
+            count = num_runs - len(parameters)
+            # unshifted, the first Sobol point is the corner of the space
+            start = drawn if seed is not None else drawn + 1
+            batch = points_to_parameters(strategy, sobol_points(count, dimensions, start, seed))
+            drawn = drawn + count
+        elif sampler == "latin hypercube":
+            batch = points_to_parameters(strategy, latin_hypercube_points(num_runs - len(parameters), dimensions, numpy_rng))
+        else:
+            batch = grid if attempt == 0 else []
+
+        for run in batch:
+            key = tuple(run.values())
+            if key not in seen:
+                seen.add(key)
+                parameters.append(run)
+
+        if len(parameters) >= num_runs or len(batch) == 0:
+            break
+
+    return parameters[:num_runs]
+
+
+def coarse_dataset(dataset, bars, stride):
+    """
+    Every stride-th bar of the first bars of a shared dataset (the last bar is always kept, so runs end on
+    the same price as the full resolution ones), with its own MovingAverageCache and BaselineRisk. Its averages
+    are stride times shorter, so the cache gets 1/stride of the dataset's budget and holds as many of them.
+
+    Arguments:
+        dataset: SHARED_DATASET
+        bars: how many bars of the dataset to take every stride-th from, None for all of them
+        stride: keep every stride-th bar
+    Returns:
+        dict with 'price', 'quarter', 'timestamp', 'ma_cache' and 'baseline_risk'
+    """
+    key = (bars, stride)
+    if key not in dataset['coarse']:
+        last = len(dataset['price']) if bars is None else bars
+        indices = np.arange(0, last, stride)
+        if len(indices) > 0 and indices[-1] != last - 1:
+            indices = np.append(indices, last - 1)
 
-            else:
-                pass
-                #moves.append("Pass")
+        coarse = {column: dataset[column][indices] for column in ["price", "quarter", "timestamp"]}
+        coarse['ma_cache'] = MovingAverageCache(coarse['price'], dataset['ma_cache_bytes'] // stride)
+        coarse['baseline_risk'] = BaselineRisk(coarse['price'], dataset['baseline_initial'])
+        dataset['coarse'][key] = coarse
 
-        if shorting_allowed == True:
-            #record the portfolio information
-            if short_position == False or short_position == None:
-                if record_balance == True:
-                    portfolio_balance.append(position_size*current_price + fiat)
-            if short_position == True:
-                short_delta = (purchase_price*position_size - current_price*position_size)
-                if record_balance == True:
-                    portfolio_balance.append(purchase_price*position_size + short_delta + fiat)
-        else:
-            #record the portfolio information
-            if record_balance == True:
-                portfolio_balance.append(position_size*current_price + fiat)
-            
-        if record_balance == True:
-            baseline_balance.append(baseline_position_size*current_price)
-        
-        #record which moving average was higher this moment
-        last_average_higher = current_average_higher
+    return dataset['coarse'][key]
 
-        # go through the volume data
-        thirty_day_volume = 0 # re-calculate the current thirty_day_volume
-        new_volume_data = []
-        for volume_data_entry in volume_data:
-            if volume_data_entry[0] < 720: # 720 hours in thirty days
-                thirty_day_volume = thirty_day_volume + volume_data_entry[1]
-                new_volume_data.append([volume_data_entry[0] + 1, volume_data_entry[1]])
-        
-        volume_data = new_volume_data
 
-    
-    # compute final results
-    baseline_final = current_price
-    baseline_return_rate = (baseline_final/baseline_initial) - 1    
-    final_return_rate = ((position_size*current_price + fiat)/starting_capital) - 1
-    if (losses + wins) > 0:
-        hit_rate = wins/(losses + wins)
-    else:
-        hit_rate = "N/A"
+def run_shared_backtest(strategy, parameters, shorting_allowed, fixed_fee, bars=None, stride=1, abort_criteria=None,
+                        profile=False):
+    """
+    Run one sweep backtest (order_sizing 1, 10000 starting capital, 30% annual taxes, no balance recording) on
+    the dataset attached to this worker by attach_shared_dataset().
 
-    # calculate sharpe ratio (using 0% as the risk-free return benchmark)
-    #sharpe_ratio = (statistics.mean(monthly_return_rates)-0)/(statistics.stdev(monthly_return_rates)*np.sqrt(12))
-    sharpe_ratio = None
+    With stride > 1 the backtest runs on every stride-th bar only, as a cheap approximation of the full run:
+    the moving average lengths and the fee volume window are divided by stride so they still span the same time.
 
-    if display_results == True and record_balance == True:
-        plot_data = pd.DataFrame()
-        plot_data['time'] = sampled_data['timestamp']
-        plot_data['Baseline'] = baseline_balance
-        plot_data['SMA Crossover'] = portfolio_balance
-        if show_moving_averages:
-            plot_data["MA1"] = [i*baseline_position_size for i in ma1]
-            plot_data["MA2"] = [i*baseline_position_size for i in ma2]
-        plot_data.plot(x = "time")
-        plt.xticks(rotation="vertical")
-        plt.show()
+    Arguments:
+        strategy: "mean reversion" or "simple moving average crossover"
+        parameters: dict generated by random_backtest_parameters()
+        shorting_allowed: whether or not to short or sell regularly (true or false)
+        fixed_fee: whether to use volume based fee or a fixed fee (true or false)
+        bars: only run on the first bars of the dataset, default = None (all of it)
+        stride: only run on every stride-th bar, default = 1 (all of them)
+        abort_criteria: AbortCriteria to stop the run early, default = None (abort_bar counts coarse bars
+            when stride > 1)
+        profile: add a 'profile' section to the results, see the backtesters, default = False
+    Returns:
+        backtest_results: same dictionary as the backtesters return
+    """
+    dataset = SHARED_DATASET
+    fee_schedule = DEFAULT_FEE_SCHEDULE
+
+    if stride == 1:
+        price = dataset['price'][:bars]
+        quarter = dataset['quarter'][:bars]
+        timestamps = dataset['timestamp'][:bars]
+        ma_cache = dataset['ma_cache']
+        if bars not in dataset['baseline_risk']:
+            dataset['baseline_risk'][bars] = BaselineRisk(price, dataset['baseline_initial'])
+        baseline_risk = dataset['baseline_risk'][bars]
     else:
-        plot_data = "Could not generate plot_data: display_results and/or record_balance was set to False."
-
-    # calculate quarters_beating_baseline
-    count = 0
-    for x in range(0, len(quarter_return_rates)):
-        # we round so that a difference of 0.0000000001, etc. won't bring it over the edge.
-        if round(quarter_return_rates[x],2) > round(baseline_return_rates[x],2):
-            count = count + 1
-    
-    quarters_beating_baseline = round(count/len(quarter_return_rates), 2)
+        coarse = coarse_dataset(dataset, bars, stride)
+        price = coarse['price']
+        quarter = coarse['quarter']
+        timestamps = coarse['timestamp']
+        ma_cache = coarse['ma_cache']
+        baseline_risk = coarse['baseline_risk']
+        fee_schedule = FeeSchedule(VOLUME_FEE_TABLE, max(1, round(fee_schedule.window/stride)))
+        # same time span in coarser bars (a length of 0 stays 0)
+        parameters = {key: (max(1, round(x/stride)) if x > 0 else 0) if key.endswith("length") else x
+                      for key, x in parameters.items()}
+
+    backtest_profile = BacktestProfile() if profile else None
+    if profile:
+        started = time.perf_counter()
+
+    # the moving averages only look back, so the first bars of a full length average are the average of the first bars
+    if strategy == "mean reversion":
+        ma_length = parameters['ma_length']
+        ma = ma_cache.get(ma_length)[:len(price)]
+        if profile:
+            backtest_profile.add("moving_averages", time.perf_counter() - started)
+        backtest_results = mean_reversion_arrays(price, quarter, timestamps, ma, ma_length, dataset['baseline_initial'],
+                                                 1, 10000, [(parameters['buy_threshold'], parameters['take_profit'],
+                                                 parameters['stop_loss'])], shorting_allowed, fixed_fee, False, True,
+                                                 0.3, 0, fee_schedule, abort_criteria, backtest_profile,
+                                                 baseline_risk=baseline_risk)[0][0]
+    elif strategy == "simple moving average crossover":
+        ma2_length = parameters['ma2_length']
+        ma1 = ma_cache.get(parameters['ma1_length'])[:len(price)]
+        ma2 = ma_cache.get(ma2_length)[:len(price)]
+        if profile:
+            backtest_profile.add("moving_averages", time.perf_counter() - started)
+        backtest_results = sma_crossover_arrays(price, quarter, timestamps, ma1, ma2, ma2_length,
+                                                dataset['baseline_initial'], 1, 10000, shorting_allowed, fixed_fee,
+                                                False, True, 0.3, 0, fee_schedule, abort_criteria, backtest_profile,
+                                                baseline_risk=baseline_risk)[0]
+    else:
+        raise Exception("Error:", strategy, "is not valid, please select either 'simple moving average' or 'mean reversion'.")
 
-    # return the results
-    backtest_results = {"final_return_rate" : final_return_rate,
-               "hit_rate": hit_rate,
-               "baseline_return_rate": baseline_return_rate,
-               "quarter_return_rates": quarter_return_rates, 
-               "quarter_trades": quarter_trades,
-               "quarter_hit_rates": quarter_hit_rates,
-               "baseline_return_rates": baseline_return_rates,
-               "balance_data": plot_data,
-               "sharpe_ratio": sharpe_ratio,
-               "quarters_beating_baseline": quarters_beating_baseline,
-               "strategy_quarterly_stdev": statistics.stdev(quarter_return_rates),
-               "baseline_quarterly_stdev": statistics.stdev(baseline_return_rates)
+    backtest_results['balance_data'] = NO_BALANCE_DATA
+    if profile:
+        backtest_results['profile'] = backtest_profile.to_dict()
 
-    }
-    
     return backtest_results
 
 
-def random_ma_length_generator():
+def run_shared_threshold_batch(ma_length, thresholds, shorting_allowed, fixed_fee, abort_criteria=None, profile=None):
     """
-    Generate random moving averages for optimization purposes.
+    Run sweep mean reversion backtests (same settings as run_shared_backtest()) for many (buy_threshold,
+    take_profit, stop_loss) triples that share ma_length on the dataset attached to this worker, with the
+    moving average and period boundaries computed once for all of them (see mean_reversion_arrays()).
+
+    Arguments:
+        ma_length: moving average length (in hours)
+        thresholds: list of (buy_threshold, take_profit, stop_loss) triples
+        shorting_allowed, fixed_fee, abort_criteria: see run_shared_backtest()
+        profile: BacktestProfile to record the time spent per phase in (adding up all of the triples), default = None
+    Returns:
+        results: list of backtest_results dictionaries, one per triple
     """
-    import random
-    num1 = random.randrange(0, round(2191/2))
-    num2 = random.randrange(0, round(2191/2))
-    while num2 < num1:
-        num2 = random.randrange(0, round(2191/2))
-    
-    return num1, num2
+    dataset = SHARED_DATASET
+
+    if profile is not None:
+        started = time.perf_counter()
+    ma = dataset['ma_cache'].get(ma_length)
+    if profile is not None:
+        profile.add("moving_averages", time.perf_counter() - started)
+    if None not in dataset['baseline_risk']:
+        dataset['baseline_risk'][None] = BaselineRisk(dataset['price'], dataset['baseline_initial'])
+
+    runs = mean_reversion_arrays(dataset['price'], dataset['quarter'], dataset['timestamp'], ma, ma_length,
+                                 dataset['baseline_initial'], 1, 10000, thresholds, shorting_allowed, fixed_fee, False,
+                                 True, 0.3, 0, DEFAULT_FEE_SCHEDULE, abort_criteria, profile,
+                                 baseline_risk=dataset['baseline_risk'][None])
+
+    results = [run[0] for run in runs]
+    for backtest_results in results:
+        backtest_results['balance_data'] = NO_BALANCE_DATA
+
+    return results
+
 
-def run_single_backtest_mean_reversion(x, crypto_df, shorting_allowed, fixed_fee):
-    stop_loss = round(random.randrange(0, 100),2)/100
-    buy_threshold = round(random.randrange(0, 100),2)/100
-    take_profit = round(random.randrange(0, 100),2)/100
-    ma_length = random.randrange(0, round(2191/2))
+def run_single_backtest_mean_reversion(x, crypto_df, shorting_allowed, fixed_fee, abort_criteria=None, parameters=None,
+                                       profile=False):
+    """
+    Run one mean reversion backtest with the given parameters (a dict from sample_parameters(), random ones
+    if None), on crypto_df or, when crypto_df is None, on the dataset attached to this worker by
+    attach_shared_dataset().
+    """
+    if parameters is None:
+        parameters = random_backtest_parameters("mean reversion")
+    stop_loss = parameters['stop_loss']
+    buy_threshold = parameters['buy_threshold']
+    take_profit = parameters['take_profit']
+    ma_length = parameters['ma_length']
+
+    if crypto_df is None:
+        backtest_results = run_shared_backtest("mean reversion", parameters, shorting_allowed, fixed_fee,
+                                               abort_criteria=abort_criteria, profile=profile)
+        return (stop_loss, buy_threshold, take_profit, ma_length, backtest_results)
 
     backtest_results = mean_reversion_backtester(
                 sampled_data = crypto_df,
@@ -955,14 +4253,32 @@ def run_single_backtest_mean_reversion(x, crypto_df, shorting_allowed, fixed_fee
                 display_results = False,
                 show_moving_averages = False,
                 annual_taxes = True,
-                tax_percentage = 0.3
+                tax_percentage = 0.3,
+                abort_criteria = abort_criteria,
+                profile = profile
             )
     
     # Extract and return relevant results
     return (stop_loss, buy_threshold, take_profit, ma_length, backtest_results)
 
-def run_single_backtest_sma_crossover(x, crypto_df, shorting_allowed, fixed_fee):
-    ma1_length, ma2_length = random_ma_length_generator()
+def run_single_backtest_sma_crossover(x, crypto_df, shorting_allowed, fixed_fee, abort_criteria=None, parameters=None,
+                                      profile=False):
+    """
+    Run one sma crossover backtest with the given parameters (a dict from sample_parameters(), random ones
+    if None), on crypto_df or, when crypto_df is None, on the dataset attached to this worker by
+    attach_shared_dataset().
+    """
+    if parameters is None:
+        ma1_length, ma2_length = random_ma_length_generator()
+    else:
+        ma1_length, ma2_length = parameters['ma1_length'], parameters['ma2_length']
+
+    if crypto_df is None:
+        backtest_results = run_shared_backtest("simple moving average crossover",
+                                               {"ma1_length": ma1_length, "ma2_length": ma2_length},
+                                               shorting_allowed, fixed_fee, abort_criteria=abort_criteria,
+                                               profile=profile)
+        return (ma1_length, ma2_length, backtest_results)
 
     backtest_results = sma_crossover_backtester(
         sampled_data=crypto_df,
@@ -973,96 +4289,1156 @@ def run_single_backtest_sma_crossover(x, crypto_df, shorting_allowed, fixed_fee)
         display_results=False,
         shorting_allowed=shorting_allowed,
         fixed_fee=fixed_fee,
-        record_balance=True,
+        record_balance=False,
         show_moving_averages=False,
         annual_taxes=True,
         tax_percentage=0.3,
-        fee=0
+        fee=0,
+        abort_criteria=abort_criteria,
+        profile=profile
     )
     
     # Extract and return relevant results
     return (ma1_length, ma2_length, backtest_results)
 
-def run_multiple_backtests(shorting_allowed, num_runs, fixed_fee, crypto_df, strategy):
+# batches a sweep keeps submitted to the process pool per worker, completed batches are replaced by new ones
+SWEEP_TASKS_PER_WORKER = 2
+
+# a sweep is split into about this many batches per worker, so workers that finish early take the remaining ones
+SWEEP_BATCHES_PER_WORKER = 8
+
+# most runs in one batch, which bounds the results a sweep holds in memory
+SWEEP_BATCH_MAX_RUNS = 64
 
+# runs written to a sweep's output file are flushed to disk in groups of this many
+SWEEP_FLUSH_ROWS = 64
+
+# rough cost of one trade in the array engine, in simulated bars (see estimate_backtest_cost())
+BACKTEST_TRADE_COST_BARS = 16
+
+
+def estimate_backtest_cost(strategy, parameters, bars):
+    """
+    Rough cost of one backtest run on bars bars, in simulated bars: one for every bar past the moving averages
+    plus BACKTEST_TRADE_COST_BARS for every trade the parameters are expected to make. Only meant for ordering
+    and batching runs, not for predicting their runtime.
+    """
     if strategy == "mean reversion":
-        with ProcessPoolExecutor() as executor:
-            results = list(executor.map(run_single_backtest_mean_reversion, range(num_runs), [crypto_df] * num_runs, [shorting_allowed] * num_runs, [fixed_fee] * num_runs))
-        
-        
-        # compile results into a table for exploration
-        result_dict = {
-            "ma_length": [],
-            "stop_loss": [],
-            "buy_threshold": [],
-            "take_profit": [],
-            "cumulative_return": [],
-            "cumulative_baseline_return": [],
-            "profitable_quarters": [],
-            "total_trades": [],
-            "quarters_beating_baseline_results": [],
-            "strategy_quarterly_stdev": [],
-            "baseline_quarterly_stdev": []
-        }
+        # the number of trades mostly depends on how far the price has to fall below its average to buy
+        trades = 0.0005 * bars / (parameters['buy_threshold'] + 0.01)
+        active_bars = bars - parameters['ma_length']
+    else:
+        # about one crossover per length of the slower moving average
+        slow_length = max(parameters['ma1_length'], parameters['ma2_length'], 1)
+        trades = bars / slow_length
+        active_bars = bars - slow_length
 
+    return max(active_bars, 0) + BACKTEST_TRADE_COST_BARS * trades
 
-        for res in results:
-            stop_loss, buy_threshold, take_profit, ma_length, backtest_results = res
 
-            result_dict['ma_length'].append(ma_length)
-            result_dict['stop_loss'].append(stop_loss)
-            result_dict['buy_threshold'].append(buy_threshold)
-            result_dict['take_profit'].append(take_profit)
-            result_dict['cumulative_return'].append(backtest_results['final_return_rate'])
-            result_dict['cumulative_baseline_return'].append(backtest_results['baseline_return_rate'])
-            result_dict['profitable_quarters'].append(len([x for x in backtest_results['quarter_return_rates'] if x > 0]))
-            result_dict['total_trades'].append(sum([x for x in backtest_results['quarter_trades']]))
-            result_dict['quarters_beating_baseline_results'].append(backtest_results['quarters_beating_baseline'])
-            result_dict['strategy_quarterly_stdev'].append(backtest_results['strategy_quarterly_stdev'])
-            result_dict['baseline_quarterly_stdev'].append(backtest_results['baseline_quarterly_stdev'])
+def schedule_backtest_batches(strategy, parameters, runs, bars, workers):
+    """
+    Group runs into batches of about equal estimated cost (see estimate_backtest_cost()), with the most
+    expensive runs first, so a sweep doesn't end with one worker still busy on a slow run while the others
+    sit idle. There are about SWEEP_BATCHES_PER_WORKER batches per worker, of at most SWEEP_BATCH_MAX_RUNS runs.
+    Mean reversion runs with the same moving average length are kept next to each other (most expensive length
+    first), so they tend to land in the same batch and share their moving average (see run_backtest_batch()).
 
+    Arguments:
+        parameters: list of parameter dicts
+        runs: indices of the parameters to schedule
+        bars: number of bars the runs simulate
+        workers: number of processes in the pool
+    Returns:
+        batches: list of lists of indices into parameters, most expensive first
+    """
+    costs = {x: estimate_backtest_cost(strategy, parameters[x], bars) for x in runs}
+    target_cost = sum(costs.values()) / max(1, workers * SWEEP_BATCHES_PER_WORKER)
 
-        optimization_results = pd.DataFrame(result_dict)
+    if strategy == "mean reversion":
+        length_costs = {}
+        for x in runs:
+            ma_length = parameters[x]['ma_length']
+            length_costs[ma_length] = length_costs.get(ma_length, 0) + costs[x]
+        order = sorted(runs, key=lambda x: (length_costs[parameters[x]['ma_length']], parameters[x]['ma_length'],
+                                            costs[x]), reverse=True)
+    else:
+        order = sorted(runs, key=lambda x: costs[x], reverse=True)
 
-    elif strategy == "simple moving average crossover":
+    batches = []
+    batch = []
+    batch_cost = 0
+    for x in order:
+        batch.append(x)
+        batch_cost = batch_cost + costs[x]
+        if batch_cost >= target_cost or len(batch) >= SWEEP_BATCH_MAX_RUNS:
+            batches.append(batch)
+            batch = []
+            batch_cost = 0
+    if batch:
+        batches.append(batch)
 
-        with ProcessPoolExecutor() as executor:
-            results = list(executor.map(run_single_backtest_sma_crossover, range(num_runs), [crypto_df] * num_runs, [shorting_allowed] * num_runs, [fixed_fee] * num_runs))
-        
-        
-        # compile results into a table for exploration
-        
-        result_dict = {
-            "ma1_length": [],
-            "ma2_length": [],
-            "cumulative_return": [],
-            "cumulative_baseline_return": [],
-            "profitable_quarters": [],
-            "total_trades": [],
-            "quarters_beating_baseline_results": [],
-            "strategy_quarterly_stdev": [],
-            "baseline_quarterly_stdev": []
-        }
+    return batches
+
+
+def run_backtest_batch(strategy, runs, crypto_df, shorting_allowed, fixed_fee, abort_criteria=None, profile=False):
+    """
+    Run a batch of a sweep's backtests in one task of the process pool. Mean reversion runs that share a
+    moving average length are run together, so the batch computes every moving average only once (see
+    mean_reversion_threshold_batch()).
+
+    Arguments:
+        runs: list of (index, parameters)
+        crypto_df: as for the run_single_backtest_* functions, None for the dataset attached to this worker
+        profile: profile the runs, default = False
+    Returns:
+        results: list of (index, backtest_results)
+        busy_seconds: how long the batch took
+        batch_profile: the profiles of the runs added up (see BacktestProfile.to_dict()) and taken out of
+            their results, None when profile is false
+    """
+    start_time = time.perf_counter()
+    # only the sum goes back to the sweep, not a profile per run
+    batch_profile = BacktestProfile() if profile else None
+
+    if strategy == "mean reversion":
+        groups = {}
+        for x, parameters in runs:
+            groups.setdefault(parameters['ma_length'], []).append((x, parameters))
+
+        results_by_run = {}
+        for ma_length, group in groups.items():
+            thresholds = [(parameters['buy_threshold'], parameters['take_profit'], parameters['stop_loss'])
+                          for x, parameters in group]
+            if crypto_df is None:
+                group_results = run_shared_threshold_batch(ma_length, thresholds, shorting_allowed, fixed_fee,
+                                                           abort_criteria, batch_profile)
+            else:
+                group_results = mean_reversion_threshold_batch(crypto_df, 1, ma_length, 10000, thresholds,
+                                                               shorting_allowed, fixed_fee, True, 0.3, 0,
+                                                               abort_criteria=abort_criteria, profile=batch_profile)
+            for (x, parameters), backtest_results in zip(group, group_results):
+                results_by_run[x] = backtest_results
+
+        results = [(x, results_by_run[x]) for x, parameters in runs]
+    else:
+        results = [(x, run_single_backtest_sma_crossover(x, crypto_df, shorting_allowed, fixed_fee, abort_criteria,
+                                                         parameters, profile)[-1])
+                   for x, parameters in runs]
+        if profile:
+            for x, backtest_results in results:
+                batch_profile.merge(backtest_results.pop('profile'))
+
+    if profile:
+        batch_profile = batch_profile.to_dict()
+
+    return results, time.perf_counter() - start_time, batch_profile
+
+
+# executors a sweep can run on by name, a BacktestCluster or any concurrent.futures.Executor can be passed too
+SWEEP_EXECUTORS = ["serial", "thread", "process"]
+
+
+class SerialExecutor(Executor):
+    """
+    Executor that runs every task in this thread as soon as it is submitted, for profiling or debugging a
+    sweep without a pool in the way.
+    """
 
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as error:
+            future.set_exception(error)
+        return future
 
-        for res in results:
-            ma1_length, ma2_length, backtest_results = res
 
-            result_dict['ma1_length'].append(ma1_length)
-            result_dict['ma2_length'].append(ma2_length)
-            result_dict['cumulative_return'].append(backtest_results['final_return_rate'])
-            result_dict['cumulative_baseline_return'].append(backtest_results['baseline_return_rate'])
-            result_dict['profitable_quarters'].append(len([x for x in backtest_results['quarter_return_rates'] if x > 0]))
-            result_dict['total_trades'].append(sum([x for x in backtest_results['quarter_trades']]))
-            result_dict['quarters_beating_baseline_results'].append(backtest_results['quarters_beating_baseline'])
-            result_dict['strategy_quarterly_stdev'].append(backtest_results['strategy_quarterly_stdev'])
-            result_dict['baseline_quarterly_stdev'].append(backtest_results['baseline_quarterly_stdev'])
+# queues and dictionaries served by the scheduler of a BacktestCluster (they live in its server process)
+CLUSTER_QUEUES = {}
+CLUSTER_STATE = {}
 
 
-        optimization_results = pd.DataFrame(result_dict)
+def cluster_queue(name):
+    return CLUSTER_QUEUES.setdefault(name, queue.Queue())
+
+
+def cluster_state(name):
+    return CLUSTER_STATE.setdefault(name, {})
+
+
+class BacktestClusterManager(BaseManager):
+    """
+    Connection to the scheduler of a BacktestCluster.
+    """
+
+
+BacktestClusterManager.register("queue", callable=cluster_queue)
+BacktestClusterManager.register("state", callable=cluster_state, proxytype=DictProxy)
+
+
+class BacktestCluster:
+    """
+    Scheduler for running sweeps on several machines. Tasks are served over TCP at address, and worker
+    processes started with run_cluster_worker(address, authkey) on any machine that can reach it (with this
+    module and the same package versions installed) pull them until the scheduler closes. start_workers()
+    starts workers on this machine, which is also how a cluster is tried out on localhost.
+
+    Pass the cluster as the executor of run_multiple_backtests() or successive_halving_search() to run a
+    sweep on it. Every worker receives the dataset once per sweep (see dataset_handle()), and the tasks only
+    carry their parameters.
+
+    Arguments:
+        address: (host, port) to listen on, default = ("127.0.0.1", 0) (this machine only, any free port).
+            Listen on ("0.0.0.0", port) to accept workers from other machines, they connect to (host name, port)
+        authkey: bytes workers need to connect, default = None (a random key, see the authkey attribute)
+    Use as a context manager (or call close()) to stop the scheduler and the workers started by start_workers().
+    """
+
+    def __init__(self, address=("127.0.0.1", 0), authkey=None):
+        if authkey is None:
+            authkey = os.urandom(16)
+        self.authkey = authkey
+        self.manager = BacktestClusterManager(address=address, authkey=authkey)
+        self.manager.start()
+        self.address = self.manager.address
+        self.processes = []
+
+    def start_workers(self, count, timeout=60):
+        """
+        Start count worker processes on this machine and wait until they have connected.
+        """
+        expected = self.worker_count() + count
+        for x in range(count):
+            process = Process(target=run_cluster_worker, args=(self.address, self.authkey), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        deadline = time.time() + timeout
+        while self.worker_count() < expected:
+            if time.time() > deadline:
+                raise Exception("Only", self.worker_count(), "of", expected, "cluster workers connected within", timeout, "seconds.")
+            time.sleep(0.05)
+
+    def worker_count(self):
+        """
+        Number of workers connected to the scheduler.
+        """
+        return len(self.manager.state("workers"))
+
+    def executor(self, initializer=None, initargs=()):
+        """
+        ClusterExecutor for one sweep, every worker calls initializer(*initargs) before its first task of it.
+        """
+        return ClusterExecutor(self.manager, initializer, initargs)
+
+    def close(self):
+        tasks = self.manager.queue("tasks")
+        for process in self.processes:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        self.manager.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ClusterExecutor(Executor):
+    """
+    Executor that hands its tasks to the workers of a BacktestCluster, see BacktestCluster.executor().
+    """
+
+    def __init__(self, manager, initializer=None, initargs=()):
+        self.sweep_id = uuid.uuid4().hex
+        self.tasks = manager.queue("tasks")
+        self.results = manager.queue("results " + self.sweep_id)
+        self.sweeps = manager.state("sweeps")
+        self.sweeps[self.sweep_id] = (initializer, initargs)
+
+        self.futures = {}
+        self.task_count = 0
+        self.lock = threading.Lock()
+        self.collector = threading.Thread(target=self.collect_results, daemon=True)
+        self.collector.start()
+
+    def submit(self, function, *args):
+        future = Future()
+        with self.lock:
+            task_id = self.task_count
+            self.task_count = self.task_count + 1
+            self.futures[task_id] = future
+        self.tasks.put((self.sweep_id, task_id, function, args))
+        return future
+
+    def collect_results(self):
+        while True:
+            task_id, succeeded, value = self.results.get()
+            if task_id is None:
+                break
+            with self.lock:
+                future = self.futures.pop(task_id)
+            # cancelled tasks still run, their results are dropped
+            if future.cancelled():
+                continue
+            if succeeded:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self.lock:
+            futures = list(self.futures.values())
+        if cancel_futures:
+            for future in futures:
+                future.cancel()
+        if wait:
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()
+
+        self.results.put((None, None, None))
+        self.collector.join()
+        self.sweeps.pop(self.sweep_id, None)
+
+
+def run_cluster_worker(address, authkey):
+    """
+    Worker of a BacktestCluster: pulls tasks from the scheduler at address and runs them until the scheduler
+    closes. Start one per cpu on every machine that should take part in the sweeps.
+
+    Arguments:
+        address: (host, port) of the scheduler
+        authkey: BacktestCluster.authkey
+    """
+    manager = BacktestClusterManager(address=tuple(address), authkey=authkey)
+    manager.connect()
+    tasks = manager.queue("tasks")
+    sweeps = manager.state("sweeps")
+    workers = manager.state("workers")
+    name = socket.gethostname() + ":" + str(os.getpid())
+    workers[name] = time.time()
+
+    sweep_id = None
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            task_sweep_id, task_id, function, args = task
+            try:
+                # set up the dataset of a sweep before running its first task
+                if task_sweep_id != sweep_id:
+                    sweep_id = None
+                    results = manager.queue("results " + task_sweep_id)
+                    initializer, initargs = sweeps[task_sweep_id]
+                    if initializer is not None:
+                        initializer(*initargs)
+                    sweep_id = task_sweep_id
+                result = (task_id, True, function(*args))
+            except Exception as error:
+                result = (task_id, False, error)
+            results.put(result)
+        workers.pop(name, None)
+    except (EOFError, ConnectionError):
+        # the scheduler closed
+        return
+
+
+def sweep_shares_dataset(executor, share_dataset):
+    """
+    Whether the tasks of a sweep on executor run on a dataset attached to the workers (taking their moving
+    averages from its MovingAverageCache) rather than on a dataframe they carry, see open_sweep_executor().
+    """
+    if isinstance(executor, Executor):
+        return False
+
+    return bool(share_dataset)
+
+
+@contextlib.contextmanager
+def open_sweep_executor(executor, max_workers, crypto_df, share_dataset):
+    """
+    Start the pool a sweep runs on.
+
+    Executors:
+        "process": a ProcessPoolExecutor, the workers memory map a SharedDataset when share_dataset is set
+        "thread": a ThreadPoolExecutor, the threads share the dataset (and its MovingAverageCache) without
+            copying it. Only faster than "serial" for the parts of a run that release the GIL (numpy array
+            operations), the event loop of simulate_backtest() holds it
+        "serial": a SerialExecutor, every task runs in this thread
+        BacktestCluster: the workers of the cluster, which receive the dataset once per sweep
+        any other concurrent.futures.Executor (a dask.distributed Client.get_executor() for example): the
+            tasks carry the whole dataframe, share_dataset is ignored
+
+    The workers of a process pool or a BacktestCluster each keep their own MovingAverageCache, so they split
+    MOVING_AVERAGE_CACHE_BYTES between them and the memory of a sweep stays flat as max_workers grows. Threads
+    share one cache with the whole budget.
+
+    Yields:
+        (pool, task_df): the concurrent.futures.Executor and the crypto_df argument of the tasks, None when
+            the workers have the dataset attached by attach_shared_dataset()
+    """
+    global SHARED_DATASET
+
+    share_dataset = sweep_shares_dataset(executor, share_dataset)
+    worker_ma_cache_bytes = MOVING_AVERAGE_CACHE_BYTES // max(1, max_workers)
+    if isinstance(executor, str) and executor == "process":
+        if share_dataset:
+            with SharedDataset(crypto_df, ma_cache_bytes=worker_ma_cache_bytes) as dataset:
+                with ProcessPoolExecutor(max_workers=max_workers, initializer=attach_shared_dataset,
+                                         initargs=(dataset.handle,)) as pool:
+                    yield pool, None
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                yield pool, crypto_df
+    elif isinstance(executor, str) and executor in ["serial", "thread"]:
+        previous_dataset = SHARED_DATASET
+        if share_dataset:
+            attach_shared_dataset(dataset_handle(crypto_df))
+        try:
+            if executor == "serial":
+                pool = SerialExecutor()
+            else:
+                pool = ThreadPoolExecutor(max_workers=max_workers)
+            with pool:
+                yield pool, None if share_dataset else crypto_df
+        finally:
+            SHARED_DATASET = previous_dataset
+    elif isinstance(executor, BacktestCluster):
+        if share_dataset:
+            pool = executor.executor(attach_shared_dataset, (dataset_handle(crypto_df, worker_ma_cache_bytes),))
+        else:
+            pool = executor.executor()
+        with pool:
+            yield pool, None if share_dataset else crypto_df
+    elif isinstance(executor, Executor):
+        # someone else's pool, it is left running
+        yield executor, crypto_df
+    else:
+        raise Exception("Error:", executor, "is not a valid executor, please select one of", SWEEP_EXECUTORS,
+                        "or pass a BacktestCluster or a concurrent.futures.Executor.")
+
+
+def sweep_worker_count(executor, max_workers=None):
+    """
+    Number of workers a sweep on executor (see open_sweep_executor()) runs on, max_workers if it is given.
+    """
+    if not (executor in SWEEP_EXECUTORS or isinstance(executor, (BacktestCluster, Executor))):
+        raise Exception("Error:", executor, "is not a valid executor, please select one of", SWEEP_EXECUTORS,
+                        "or pass a BacktestCluster or a concurrent.futures.Executor.")
+    if max_workers is not None:
+        return max_workers
+    if isinstance(executor, str) and executor == "serial":
+        return 1
+    if isinstance(executor, BacktestCluster):
+        return max(1, executor.worker_count())
+    if isinstance(executor, Executor) and getattr(executor, "_max_workers", None) is not None:
+        return executor._max_workers
+
+    return os.cpu_count() or 1
+
+
+def stream_backtest_pool(strategy, parameters, shorting_allowed, fixed_fee, crypto_df, share_dataset, abort_criteria=None,
+                         result_store=None, max_in_flight=None, runs=None, max_workers=None, progress=None,
+                         executor="process", profile=None):
+    """
+    Run a strategy's backtests over a list of parameter dicts on a pool (see open_sweep_executor()) and yield
+    every result as soon as its batch completes (so not in the order of parameters).
+
+    The runs are grouped into batches by schedule_backtest_batches(), most expensive first, and every task of
+    the pool is a batch (see run_backtest_batch()), which saves a round trip to the workers per run. With
+    share_dataset the workers get the dataset once (a process pool memory maps a SharedDataset), and the
+    tasks only carry their parameters. Otherwise the dataframe is sent with every task.
+    With a result_store, runs that are stored already are looked up (and yielded first) instead of run, and
+    new runs are stored. At most max_in_flight batches are submitted at a time, so only their results are
+    held in memory.
+
+    Arguments:
+        runs: indices of parameters to run, default = None (all of them)
+        max_in_flight: default = None (SWEEP_TASKS_PER_WORKER per worker)
+        max_workers: workers in the pool, default = None (see sweep_worker_count())
+        executor: "process", "thread", "serial", a BacktestCluster or a concurrent.futures.Executor, see
+            open_sweep_executor(), default = "process"
+        progress: function called as progress(report) after every batch, with a dictionary of:
+            runs: how many runs the sweep has
+            stored_runs: how many of them were found in the result_store
+            simulated_runs: how many have been simulated so far
+            batches: how many batches the simulated runs were split into
+            workers: workers in the pool
+            elapsed_seconds: time since the pool was started
+            busy_seconds: time the workers spent simulating
+            utilization: busy_seconds/(elapsed_seconds*workers), the share of the pool that was working
+            runs_per_second: simulated_runs/elapsed_seconds
+            default = None
+        profile: BacktestProfile the profiles of the simulated runs are added to (every worker sums up its
+            batches, so only one profile per batch comes back), default = None (don't profile)
+    Yields:
+        (index, backtest_results): index into parameters and the backtest_results dictionary of that run
+    """
+    if runs is None:
+        runs = range(len(parameters))
+    max_workers = sweep_worker_count(executor, max_workers)
+    if max_in_flight is None:
+        max_in_flight = SWEEP_TASKS_PER_WORKER * max_workers
+
+    missing = list(runs)
+    report = {"runs": len(missing), "stored_runs": 0, "simulated_runs": 0, "batches": 0, "workers": max_workers,
+              "elapsed_seconds": 0.0, "busy_seconds": 0.0, "utilization": 0.0, "runs_per_second": 0.0}
+    if result_store is not None:
+        # the settings the run_single_backtest_* functions use (shared runs take their averages from a MovingAverageCache)
+        ma_cache = sweep_shares_dataset(executor, share_dataset)
+        keys = {x: backtest_result_key(strategy, backtest_settings(DEFAULT_FEE_SCHEDULE, abort_criteria, order_sizing=1,
+                                       starting_capital=10000, shorting_allowed=shorting_allowed, fixed_fee=fixed_fee,
+                                       annual_taxes=True, tax_percentage=0.3, fee=0, ma_cache=ma_cache,
+                                       **parameters[x]), crypto_df)
+                for x in missing}
+        stored = result_store.get_many([keys[x] for x in missing])
+        for x, backtest_results in zip(list(missing), stored):
+            if backtest_results is not None:
+                report['stored_runs'] = report['stored_runs'] + 1
+                yield x, backtest_results
+        missing = [x for x, backtest_results in zip(missing, stored) if backtest_results is None]
+
+    if len(missing) == 0:
+        if progress is not None:
+            progress(dict(report))
+        return
+
+    batches = schedule_backtest_batches(strategy, parameters, missing, len(crypto_df.index), max_workers)
+    report['batches'] = len(batches)
+
+    start_time = time.perf_counter()
+    with open_sweep_executor(executor, max_workers, crypto_df, share_dataset) as (pool, task_df):
+        tasks = iter(batches)
+        pending = set()
+        unstored = []
+        try:
+            for batch in tasks:
+                pending.add(pool.submit(run_backtest_batch, strategy, [(x, parameters[x]) for x in batch], task_df,
+                                        shorting_allowed, fixed_fee, abort_criteria, profile is not None))
+                if len(pending) >= max_in_flight:
+                    break
+
+            while pending:
+                done = wait(pending, return_when=FIRST_COMPLETED)[0]
+                for future in done:
+                    pending.remove(future)
+                    results, busy_seconds, batch_profile = future.result()
+                    # top the window back up before handing the results over
+                    for batch in tasks:
+                        pending.add(pool.submit(run_backtest_batch, strategy, [(x, parameters[x]) for x in batch],
+                                                task_df, shorting_allowed, fixed_fee, abort_criteria,
+                                                profile is not None))
+                        break
+
+                    if profile is not None:
+                        profile.merge(batch_profile)
+
+                    report['simulated_runs'] = report['simulated_runs'] + len(results)
+                    report['busy_seconds'] = report['busy_seconds'] + busy_seconds
+                    report['elapsed_seconds'] = time.perf_counter() - start_time
+                    report['utilization'] = report['busy_seconds'] / (report['elapsed_seconds'] * max_workers)
+                    report['runs_per_second'] = report['simulated_runs'] / report['elapsed_seconds']
+                    if progress is not None:
+                        progress(dict(report))
+
+                    for x, backtest_results in results:
+                        if result_store is not None:
+                            unstored.append((keys[x], strategy, backtest_results))
+                        yield x, backtest_results
+                    if len(unstored) >= SWEEP_FLUSH_ROWS:
+                        result_store.put_many(unstored)
+                        unstored = []
+        finally:
+            for future in pending:
+                future.cancel()
+            if result_store is not None and unstored:
+                result_store.put_many(unstored)
+
+
+def run_backtest_pool(strategy, parameters, shorting_allowed, fixed_fee, crypto_df, share_dataset, abort_criteria=None,
+                      result_store=None):
+    """
+    Like stream_backtest_pool(), but waits for all of the runs.
+
+    Returns:
+        results: list of backtest_results dictionaries, in the order of parameters
+    """
+    results = [None] * len(parameters)
+    for x, backtest_results in stream_backtest_pool(strategy, parameters, shorting_allowed, fixed_fee, crypto_df,
+                                                    share_dataset, abort_criteria, result_store):
+        results[x] = backtest_results
+
+    return results
+
+
+def sweep_manifest(strategy, num_runs, shorting_allowed, fixed_fee, crypto_df, share_dataset, abort_criteria, sampler, seed):
+    """
+    Everything that decides which rows a run_multiple_backtests() sweep writes, saved next to its output file
+    so a resumed sweep can check it is continuing the same one.
+    """
+    return {
+        "engine_version": BACKTEST_ENGINE_VERSION,
+        "strategy": strategy,
+        "num_runs": num_runs,
+        "sampler": sampler,
+        "seed": seed,
+        "shorting_allowed": bool(shorting_allowed),
+        "fixed_fee": bool(fixed_fee),
+        "share_dataset": bool(share_dataset),
+        "abort_criteria": None if abort_criteria is None else vars(abort_criteria),
+        "dataset": dataset_fingerprint(*extract_backtest_arrays(crypto_df)),
+        "first_price": float(crypto_df['price'].iloc[0])
+    }
+
+
+def read_sweep_output(output_path):
+    """
+    Rows a run_multiple_backtests() sweep wrote to output_path, in the order of its runs. A row cut off by a
+    crash is dropped (and removed from the file, so the sweep can append after it).
+
+    Returns:
+        optimization_results: pandas dataframe with a 'run' column (index of the run in the sweep), missing
+            values are NaN (<NA> in the nullable Int64 'abort_bar' column, like a sweep without an output_path)
+    """
+    with open(output_path, "rb+") as handle:
+        content = handle.read()
+        if content and not content.endswith(b"\n"):
+            handle.truncate(content.rfind(b"\n") + 1)
+
+    optimization_results = pd.read_csv(output_path, float_precision="round_trip")
+    optimization_results = optimization_results.sort_values("run").reset_index(drop=True)
+    optimization_results['abort_bar'] = optimization_results['abort_bar'].astype("Int64")
+
+    return optimization_results
+
+
+def run_multiple_backtests(shorting_allowed, num_runs, fixed_fee, crypto_df, strategy, share_dataset=True, abort_criteria=None,
+                           sampler="random", seed=None, result_store=None, output_path=None, max_in_flight=None,
+                           max_workers=None, progress=None, executor="process", profile=False):
+    """
+    Run num_runs backtests with sampled parameters in parallel and compile the results into a table. The
+    parameters are sampled up front in this process (see sample_parameters()) and every task carries its
+    own, so workers never draw duplicates and a sweep with a seed can be repeated exactly.
+
+    Every run is reduced to its row of the table as soon as it completes. With an output_path the rows are
+    appended to that csv file as they come in (flushed every SWEEP_FLUSH_ROWS rows), and calling this again
+    with the same output_path resumes the sweep: the runs already in the file are skipped. The settings of
+    the sweep are saved next to it in output_path + ".json", and resuming with different ones raises an
+    exception. An unseeded "random" or "latin hypercube" sweep gets a seed picked for it, so it can be resumed.
+
+    Arguments:
+        shorting_allowed: whether or not to short or sell regularly (true or false)
+        num_runs: how many backtests to run
+        fixed_fee: whether to use volume based fee or a fixed fee (true or false)
+        crypto_df: pandas dataframe with 'timestamp', 'price' and 'quarter' columns
+        strategy: "mean reversion" or "simple moving average crossover"
+        share_dataset: hand the workers read-only memory mapped arrays (see SharedDataset) instead of
+            pickling crypto_df into every task, default = True
+        abort_criteria: AbortCriteria to stop hopeless runs early, default = None. The 'aborted' and 'abort_bar'
+            columns show which runs were stopped and where
+        sampler: how to pick the parameters, "random", "sobol", "latin hypercube" or "grid", default = "random"
+        seed: seed for the sampler, default = None
+        result_store: BacktestResultStore, runs already in it are looked up instead of simulated and new runs
+            are saved to it, default = None
+        output_path: csv file to stream the rows to, default = None (only return them)
+        max_in_flight: most batches of runs submitted to the process pool at a time, default = None
+            (SWEEP_TASKS_PER_WORKER per worker)
+        max_workers: workers in the pool, default = None (one per cpu)
+        progress: function called as progress(report) after every batch of runs, see stream_backtest_pool(),
+            default = None
+        executor: what runs the backtests, "process" (a process pool), "thread" (a thread pool), "serial"
+            (this thread, for profiling), a BacktestCluster (several machines) or a concurrent.futures.Executor,
+            see open_sweep_executor(), default = "process"
+        profile: profile the simulated runs (see BacktestProfile), their profiles added up over all of the
+            workers are in optimization_results.attrs['profile'], default = False
+    Returns:
+        optimization_results: pandas dataframe with one row per backtest, in the order of the sampled
+            parameters. Read back from output_path (with an extra 'run' column) when there is one. The last
+            progress report (runs per second, utilization of the pool, ...) is in
+            optimization_results.attrs['sweep_report']
+    """
+
+    if strategy not in PARAMETER_SPACES:
+        raise Exception("Error:", strategy, "is not valid, please select either 'simple moving average' or 'mean reversion'.")
+
+    columns = list(PARAMETER_SPACES[strategy]) + ["cumulative_return", "cumulative_baseline_return",
+                                                   "profitable_quarters", "total_trades",
+                                                   "quarters_beating_baseline_results", "strategy_quarterly_stdev",
+                                                   "baseline_quarterly_stdev", "sharpe_ratio", "sortino_ratio",
+                                                   "max_drawdown", "calmar_ratio", "exposure", "aborted", "abort_bar"]
+
+    sweep_report = {}
+    sweep_profile = BacktestProfile() if profile else None
+
+    def report_progress(report):
+        sweep_report.update(report)
+        if progress is not None:
+            progress(report)
+
+    if output_path is None:
+        parameters = sample_parameters(strategy, num_runs, sampler, seed)
+        rows = [None] * len(parameters)
+        for x, backtest_results in stream_backtest_pool(strategy, parameters, shorting_allowed, fixed_fee, crypto_df,
+                                                        share_dataset, abort_criteria, result_store, max_in_flight,
+                                                        max_workers=max_workers, progress=report_progress,
+                                                        executor=executor, profile=sweep_profile):
+            rows[x] = sweep_result_row(parameters[x], backtest_results)
+
+        optimization_results = pd.DataFrame(rows, columns=columns)
+        optimization_results['abort_bar'] = optimization_results['abort_bar'].astype("Int64")
+        optimization_results.attrs['sweep_report'] = sweep_report
+        if profile:
+            optimization_results.attrs['profile'] = sweep_profile.to_dict()
+
+        return optimization_results
+
+    manifest_path = output_path + ".json"
+    if seed is None and sampler in ["random", "latin hypercube"] and os.path.exists(manifest_path):
+        with open(manifest_path) as handle:
+            seed = json.load(handle)['seed']
+    elif seed is None and sampler in ["random", "latin hypercube"]:
+        seed = random.SystemRandom().randrange(2**32)
+    manifest = sweep_manifest(strategy, num_runs, shorting_allowed, fixed_fee, crypto_df,
+                              sweep_shares_dataset(executor, share_dataset), abort_criteria, sampler, seed)
+
+    if os.path.exists(output_path) and os.path.exists(manifest_path):
+        with open(manifest_path) as handle:
+            if json.load(handle) != json.loads(json.dumps(manifest)):
+                raise Exception(output_path, "was written by a sweep with different settings, remove it or pick another output_path.")
+        finished = set(read_sweep_output(output_path)['run'])
+    elif os.path.exists(output_path):
+        raise Exception(output_path, "exists but has no", manifest_path, "so it can't be resumed, remove it or pick another output_path.")
     else:
+        with open(manifest_path, "w") as handle:
+            json.dump(manifest, handle)
+        with open(output_path, "w", newline="") as handle:
+            csv.writer(handle).writerow(["run"] + columns)
+        finished = set()
+
+    parameters = sample_parameters(strategy, num_runs, sampler, seed)
+    runs = [x for x in range(len(parameters)) if x not in finished]
+
+    with open(output_path, "a", newline="") as handle:
+        writer = csv.writer(handle)
+        unflushed = 0
+        for x, backtest_results in stream_backtest_pool(strategy, parameters, shorting_allowed, fixed_fee, crypto_df,
+                                                        share_dataset, abort_criteria, result_store, max_in_flight, runs,
+                                                        max_workers, report_progress, executor, sweep_profile):
+            row = sweep_result_row(parameters[x], backtest_results)
+            writer.writerow([x] + [row[column] for column in columns])
+            unflushed = unflushed + 1
+            if unflushed >= SWEEP_FLUSH_ROWS:
+                handle.flush()
+                os.fsync(handle.fileno())
+                unflushed = 0
+
+    optimization_results = read_sweep_output(output_path)
+    optimization_results.attrs['sweep_report'] = sweep_report
+    if profile:
+        optimization_results.attrs['profile'] = sweep_profile.to_dict()
+
+    return optimization_results
+
+
+def sweep_result_row(parameters, backtest_results):
+    """
+    One row of a sweep results table: the parameters of a run followed by its summary metrics.
+    """
+    row = dict(parameters)
+    row['cumulative_return'] = backtest_results['final_return_rate']
+    row['cumulative_baseline_return'] = backtest_results['baseline_return_rate']
+    row['profitable_quarters'] = len([x for x in backtest_results['quarter_return_rates'] if x > 0])
+    row['total_trades'] = sum([x for x in backtest_results['quarter_trades']])
+    row['quarters_beating_baseline_results'] = backtest_results['quarters_beating_baseline']
+    row['strategy_quarterly_stdev'] = backtest_results['strategy_quarterly_stdev']
+    row['baseline_quarterly_stdev'] = backtest_results['baseline_quarterly_stdev']
+    row['sharpe_ratio'] = backtest_results['sharpe_ratio']
+    row['sortino_ratio'] = backtest_results['sortino_ratio']
+    row['max_drawdown'] = backtest_results['max_drawdown']
+    row['calmar_ratio'] = backtest_results['calmar_ratio']
+    row['exposure'] = backtest_results['exposure']
+    row['aborted'] = backtest_results['aborted']
+    row['abort_bar'] = backtest_results['abort_bar']
+
+    return row
+
+
+def successive_halving_search(shorting_allowed,
+                              num_candidates,
+                              fixed_fee,
+                              crypto_df,
+                              strategy,
+                              fidelity = "resolution",
+                              reduction_factor = 3,
+                              min_fraction = 1/9,
+                              min_bars = 2*2191,
+                              metric = "cumulative_return",
+                              abort_criteria = None,
+                              sampler = "random",
+                              seed = None,
+                              executor = "process"
+                              ):
+    """
+    Multi-fidelity alternative to run_multiple_backtests(). num_candidates sampled parameter sets are first
+    scored on a cheap approximation of the dataset, only the best 1/reduction_factor of them move on to an
+    approximation that is reduction_factor times more detailed, and so on until the survivors run on the whole
+    dataset (successive halving). With the defaults, 81 candidates are scored on 1/9 of the bars, 27 on 1/3
+    and 9 on all of them, which costs about as much as 27 full backtests instead of 81.
+
+    fidelity picks the approximation:
+        "resolution": every 9th (then every 3rd) bar of the whole history, with the moving average lengths and
+            the fee window scaled to match (see run_shared_backtest()). Rankings on coarse bars track the full
+            resolution rankings closely because every candidate still trades through the same market regimes.
+        "prefix": the first 1/9 (then 1/3) of the history. Cheaper to set up but a much noisier predictor, a
+            parameter set that did well in the first months of the data often doesn't over the whole of it.
+
+    Parameters:
+        shorting_allowed: whether or not to short or sell regularly (true or false)
+        num_candidates: how many random parameter sets to start with
+        fixed_fee: whether to use volume based fee or a fixed fee (true or false)
+        crypto_df: pandas dataframe with 'timestamp', 'price' and 'quarter' columns
+        strategy: "mean reversion" or "simple moving average crossover"
+        fidelity: "resolution" or "prefix", default = "resolution"
+        reduction_factor: how many times fewer candidates (and how many times more bars) every rung has, default = 3
+        min_fraction: share of the bars the first rung runs on, default = 1/9
+        min_bars: with fidelity="prefix", fewest bars a rung runs on past the longest moving average of the
+            candidates, so even the first rung has a couple of quarters to score on, default = 2*2191
+            (two quarters of hourly bars)
+        metric: column of the results the candidates are ranked by (highest is best), default = "cumulative_return"
+        abort_criteria: AbortCriteria to stop hopeless runs early, default = None
+        sampler: how to pick the candidates, see sample_parameters(), default = "random"
+        seed: seed for the sampler, default = None
+        executor: "process", "thread", "serial" or a BacktestCluster, see open_sweep_executor(), default = "process"
+    Returns:
+        optimization_results: pandas dataframe with one row per backtest run, with the 'rung' (0 is the
+            cheapest), the 'stride' and the number of 'bars' it ran on. The rows of the last rung are the
+            finalists, run on the full dataset. Rungs that would run on the same bars as the one before them
+            are merged into it, so there can be fewer rungs than min_fraction and reduction_factor give.
+    """
+    if strategy not in ["mean reversion", "simple moving average crossover"]:
         raise Exception("Error:", strategy, "is not valid, please select either 'simple moving average' or 'mean reversion'.")
+    if fidelity not in ["resolution", "prefix"]:
+        raise Exception("Error:", fidelity, "is not valid, please select either 'resolution' or 'prefix'.")
+    if reduction_factor <= 1:
+        raise Exception("reduction_factor must be greater than 1.")
+    if min_fraction <= 0 or min_fraction > 1:
+        raise Exception("min_fraction must be between 0 and 1.")
+    if not (executor in SWEEP_EXECUTORS or isinstance(executor, BacktestCluster)):
+        raise Exception("Error:", executor, "is not a valid executor for successive_halving_search(), please select one of",
+                        SWEEP_EXECUTORS, "or pass a BacktestCluster.")
+
+    candidates = sample_parameters(strategy, num_candidates, sampler, seed)
+    total_bars = len(crypto_df.index)
+    price = crypto_df['price'].to_numpy(dtype=np.float64)
+    longest_ma = max([max(x for key, x in parameters.items() if key.endswith("length")) for parameters in candidates])
+
+    # share of the bars each rung runs on, the last one is always all of them
+    rungs = 1 + int(math.floor(math.log(1/min_fraction)/math.log(reduction_factor) + 1e-9))
+    fractions = [reduction_factor**-(rungs - 1 - rung) for rung in range(rungs)]
+
+    # (bars, stride) of every rung, bars is None for all of them
+    rung_settings = []
+    for rung, fraction in enumerate(fractions):
+        if rung == rungs - 1:
+            bars, stride = None, 1
+        elif fidelity == "resolution":
+            bars, stride = None, max(1, int(round(1/fraction)))
+        else:
+            bars, stride = min(total_bars, max(int(total_bars*fraction), longest_ma + min_bars)), 1
+            # end on a bar with a price, otherwise every candidate's final return is NaN
+            while bars < total_bars and np.isnan(price[bars - 1]):
+                bars = bars + 1
+            if bars == total_bars:
+                bars = None
+        rung_settings.append((bars, stride))
+
+    # longest_ma + min_bars can give consecutive prefix rungs the same bars, rerunning the survivors on them would
+    # only repeat the ranking, so such rungs run once and cut the candidates down once for each of them
+    merged_rungs = []
+    for setting in rung_settings:
+        if merged_rungs and merged_rungs[-1][0] == setting:
+            merged_rungs[-1][1] = merged_rungs[-1][1] + 1
+        else:
+            merged_rungs.append([setting, 1])
+
+    rows = []
+    with open_sweep_executor(executor, sweep_worker_count(executor), crypto_df, True) as (pool, task_df):
+        for rung, ((bars, stride), cuts) in enumerate(merged_rungs):
+            count = len(candidates)
+            results = list(pool.map(run_shared_backtest, [strategy] * count, candidates,
+                                    [shorting_allowed] * count, [fixed_fee] * count, [bars] * count,
+                                    [stride] * count, [abort_criteria] * count))
+
+            simulated_bars = -(-(total_bars if bars is None else bars) // stride)
+            rung_rows = []
+            for parameters, backtest_results in zip(candidates, results):
+                row = {"rung": rung, "stride": stride, "bars": simulated_bars}
+                row.update(sweep_result_row(parameters, backtest_results))
+                rung_rows.append(row)
+            rows.extend(rung_rows)
+
+            # keep the best 1/reduction_factor (per rung merged into this one) for the next rung
+            if rung < len(merged_rungs) - 1:
+                ranking = pd.DataFrame(rung_rows)[metric].rank(method="first", ascending=False, na_option="bottom")
+                keep = max(1, int(math.ceil(count/reduction_factor**cuts)))
+                candidates = [candidates[x] for x in range(count) if ranking[x] <= keep]
+
+    optimization_results = pd.DataFrame(rows)
+    optimization_results['abort_bar'] = optimization_results['abort_bar'].astype("Int64")
 
-        
-        
     return optimization_results
+
+# metrics stored for every (ma1_length, ma2_length) pair by sma_parameter_surface(), wins and losses count the
+# whole run while hit_rate is the backtesters' hit_rate (of the last quarter)
+SMA_SURFACE_METRICS = ["final_return_rate", "baseline_return_rate", "total_trades", "wins", "losses", "hit_rate",
+                       "profitable_quarters", "quarters_beating_baseline", "strategy_quarterly_stdev",
+                       "baseline_quarterly_stdev"]
+
+# bumped whenever the simulation changes in a way that makes stored surfaces stale
+SMA_SURFACE_VERSION = 2
+
+# default memory budget for one tile of sma_parameter_surface()
+SMA_SURFACE_MEMORY_BYTES = 512 * 1024 * 1024
+
+
+def sma_surface_tiles(max_length, tile_size):
+    """
+    Split the ma1_length < ma2_length triangle of lengths 1 to max_length into square tiles.
+
+    Returns:
+        tiles: list of (ma1 lengths, ma2 lengths) range pairs, ordered by ma2 block then ma1 block
+    """
+    blocks = [range(start, min(start + tile_size, max_length + 1)) for start in range(1, max_length + 1, tile_size)]
+
+    tiles = []
+    for ma2_lengths in blocks:
+        for ma1_lengths in blocks:
+            if ma1_lengths.start < ma2_lengths[-1]:
+                tiles.append((ma1_lengths, ma2_lengths))
+
+    return tiles
+
+
+class SmaParameterSurface:
+    """
+    Results of sma_parameter_surface(), memory mapped read-only from its output directory.
+
+    Arguments:
+        directory: output_directory that sma_parameter_surface() wrote to
+    Attributes:
+        cube: float64 array of shape (len(metrics), max_length + 1, max_length + 1), cube[m, ma1, ma2] is metric m
+            of the pair (ma1, ma2). Pairs that are not valid (ma1_length >= ma2_length) or not computed yet are NaN.
+        manifest: dict with the settings the surface was computed with
+        tiles_done: bool array, which tiles of sma_surface_tiles() are finished
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "surface.json")) as file:
+            self.manifest = json.load(file)
+        self.metrics = self.manifest["metrics"]
+        self.cube = np.load(os.path.join(directory, "surface.npy"), mmap_mode='r')
+        self.tiles_done = np.load(os.path.join(directory, "tiles.npy"))
+
+    def complete(self):
+        return bool(self.tiles_done.all())
+
+    def metric(self, name):
+        """
+        2d array of one metric, indexed [ma1_length, ma2_length].
+        """
+        return self.cube[self.metrics.index(name)]
+
+    def to_frame(self, min_ma1_length=1, max_ma1_length=None, min_ma2_length=1, max_ma2_length=None):
+        """
+        Slice the surface into a dataframe with one row per computed pair and one column per metric.
+        """
+        size = self.cube.shape[1]
+        ma1_slice = slice(min_ma1_length, size if max_ma1_length is None else max_ma1_length + 1)
+        ma2_slice = slice(min_ma2_length, size if max_ma2_length is None else max_ma2_length + 1)
+
+        values = self.cube[:, ma1_slice, ma2_slice]
+        ma1_lengths, ma2_lengths = np.nonzero(~np.isnan(values[0]))
+        surface_frame = pd.DataFrame({"ma1_length": ma1_lengths + ma1_slice.start,
+                                      "ma2_length": ma2_lengths + ma2_slice.start})
+        for index, name in enumerate(self.metrics):
+            surface_frame[name] = values[index, ma1_lengths, ma2_lengths]
+
+        return surface_frame
+
+    def best(self, metric="final_return_rate", n=10):
+        """
+        The n pairs with the highest value of metric.
+        """
+        return self.to_frame().nlargest(n, metric).reset_index(drop=True)
+
+
+def sma_parameter_surface(crypto_df,
+                          output_directory,
+                          shorting_allowed,
+                          fixed_fee,
+                          max_length = 1095,
+                          order_sizing = 1,
+                          starting_capital = 10000,
+                          annual_taxes = True,
+                          tax_percentage = 0.3,
+                          fee = 0,
+                          fee_schedule = None,
+                          memory_budget = SMA_SURFACE_MEMORY_BYTES,
+                          tile_size = None,
+                          progress = None
+                          ):
+    """
+    Run the sma crossover backtest for every pair 1 <= ma1_length < ma2_length <= max_length (about 600k pairs
+    for the default max_length, the range random_ma_length_generator() draws from) and store the results in a
+    memory mapped cube, see SmaParameterSurface.
+
+    The pairs are evaluated in square tiles of lengths. Each moving average of a tile is computed once (with
+    moving_average(), so every cell matches what sma_crossover_backtester() returns for that pair), the
+    crossovers of every ma1_length in the tile against one ma2_length are found in one vectorized pass, and
+    only the trading simulation runs pair by pair. The tile size is picked so one tile fits in memory_budget.
+
+    Finished tiles are recorded in the output directory, calling this again with the same directory and
+    settings resumes where an interrupted run stopped.
+
+    Parameters:
+        crypto_df: pandas dataframe with 'timestamp', 'price' and 'quarter' columns
+        output_directory: where to write surface.npy, tiles.npy and surface.json
+        max_length: longest moving average to include, default = 1095
+        memory_budget: how many bytes one tile may use, default = SMA_SURFACE_MEMORY_BYTES
+        tile_size: how many lengths a tile spans on each side, overrides memory_budget, default = None
+        progress: function called as progress(tiles_done, total_tiles, elapsed_seconds) after every tile, default = None
+        (remaining parameters are the same as sma_crossover_backtester(), record_balance is always False)
+    Returns:
+        surface: SmaParameterSurface
+    """
+    if fee_schedule is None:
+        fee_schedule = DEFAULT_FEE_SCHEDULE
+    if starting_capital <= 0:
+        raise Exception("starting_capital must be greater than zero.")
+    if order_sizing > 1 or order_sizing <= 0:
+        raise Exception("order_sizing must be between 1 and 0.")
+    if max_length < 2:
+        raise Exception("max_length must be at least 2.")
+
+    baseline_initial = float(crypto_df['price'][0])
+    baseline_position_size = starting_capital/baseline_initial
+    price, quarter, timestamps = extract_backtest_arrays(crypto_df)
+    quarter_changes, year_changes = find_period_change_bars(quarter, timestamps)
+
+    # per tile: the moving averages of both sides (8 bytes per bar each) and four boolean crossover masks
+    if tile_size is None:
+        tile_size = memory_budget // (20 * max(len(price), 1))
+    tile_size = int(max(1, min(tile_size, max_length)))
+    tiles = sma_surface_tiles(max_length, tile_size)
+
+    manifest = {
+        "version": SMA_SURFACE_VERSION,
+        "metrics": SMA_SURFACE_METRICS,
+        "max_length": max_length,
+        "tile_size": tile_size,
+        "dataset": dataset_fingerprint(price, quarter, timestamps),
+        "settings": {"shorting_allowed": shorting_allowed, "fixed_fee": fixed_fee, "order_sizing": order_sizing,
+                     "starting_capital": starting_capital, "annual_taxes": annual_taxes,
+                     "tax_percentage": tax_percentage, "fee": fee,
+                     "fee_schedule": [fee_schedule.breakpoints, fee_schedule.fees, fee_schedule.window]}
+    }
+
+    manifest_path = os.path.join(output_directory, "surface.json")
+    cube_path = os.path.join(output_directory, "surface.npy")
+    tiles_path = os.path.join(output_directory, "tiles.npy")
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            if json.load(file) != json.loads(json.dumps(manifest)):
+                raise Exception("Error: " + output_directory + " holds a surface computed with different settings or data, use another output_directory.")
+        cube = np.load(cube_path, mmap_mode='r+')
+        tiles_done = np.load(tiles_path)
+    else:
+        os.makedirs(output_directory, exist_ok=True)
+        cube = np.lib.format.open_memmap(cube_path, mode='w+', dtype=np.float64,
+                                         shape=(len(SMA_SURFACE_METRICS), max_length + 1, max_length + 1))
+        cube[:] = np.nan
+        cube.flush()
+        tiles_done = np.zeros(len(tiles), dtype=bool)
+        np.save(tiles_path, tiles_done)
+        # the manifest goes last, a directory without one is started over
+        with open(manifest_path, "w") as file:
+            json.dump(manifest, file)
+
+    start_time = time.time()
+    for tile_index, (ma1_lengths, ma2_lengths) in enumerate(tiles):
+        if tiles_done[tile_index]:
+            continue
+
+        ma1_block = np.stack([moving_average(price, length) for length in ma1_lengths])
+        for ma2_length in ma2_lengths:
+            pair_count = np.searchsorted(ma1_lengths, ma2_length)
+            if pair_count == 0:
+                continue
+
+            # crossovers of every ma1 in the tile against this ma2, same rule as sma_crossover_arrays()
+            ma2 = moving_average(price, ma2_length)[ma2_length:]
+            ma1_higher = ma1_block[:pair_count, ma2_length:] > ma2
+            ma2_higher = ma1_block[:pair_count, ma2_length:] < ma2
+            buy_rows, buy_bars = np.nonzero(ma1_higher[:, 1:] & ma2_higher[:, :-1])
+            sell_rows, sell_bars = np.nonzero(ma2_higher[:, 1:] & ma1_higher[:, :-1])
+            buy_splits = np.searchsorted(buy_rows, np.arange(pair_count + 1))
+            sell_splits = np.searchsorted(sell_rows, np.arange(pair_count + 1))
+
+            truncated_price = price[ma2_length:]
+            quarter_starts, year_starts = offset_period_starts(quarter, quarter_changes, year_changes, ma2_length)
+
+            for row in range(pair_count):
+                simulation = simulate_backtest(truncated_price,
+                                               quarter_starts = quarter_starts,
+                                               year_starts = year_starts,
+                                               buy_bars = (buy_bars[buy_splits[row]:buy_splits[row + 1]] + 1).tolist(),
+                                               sell_bars = (sell_bars[sell_splits[row]:sell_splits[row + 1]] + 1).tolist(),
+                                               alternate_signals = False,
+                                               record_volume = True,
+                                               order_sizing = order_sizing,
+                                               starting_capital = starting_capital,
+                                               baseline_position_size = baseline_position_size,
+                                               shorting_allowed = shorting_allowed,
+                                               fixed_fee = fixed_fee,
+                                               fee = fee,
+                                               annual_taxes = annual_taxes,
+                                               tax_percentage = tax_percentage,
+                                               record_balance = False,
+                                               fee_schedule = fee_schedule)
+                backtest_results = summarize_backtest(simulation, truncated_price, baseline_initial, starting_capital)
+
+                hit_rate = backtest_results['hit_rate']
+                cube[:, ma1_lengths[row], ma2_length] = [
+                    backtest_results['final_return_rate'],
+                    backtest_results['baseline_return_rate'],
+                    sum(backtest_results['quarter_trades']),
+                    simulation['total_wins'],
+                    simulation['total_losses'],
+                    np.nan if hit_rate == "N/A" else hit_rate,
+                    len([x for x in backtest_results['quarter_return_rates'] if x > 0]),
+                    backtest_results['quarters_beating_baseline'],
+                    backtest_results['strategy_quarterly_stdev'],
+                    backtest_results['baseline_quarterly_stdev']
+                ]
+
+        # results hit the disk before the tile is marked done, so an interrupted tile is simply redone
+        cube.flush()
+        tiles_done[tile_index] = True
+        np.save(tiles_path + ".tmp.npy", tiles_done)
+        os.replace(tiles_path + ".tmp.npy", tiles_path)
+
+        if progress is not None:
+            progress(int(tiles_done.sum()), len(tiles), time.time() - start_time)
+
+    del cube
+
+    return SmaParameterSurface(output_directory)